@@ -1,17 +1,51 @@
-from flask import Flask, abort, request
+import hashlib
+import json
+import math
+import time
+
+from flask import Flask, Response, abort, request
+
+from plants import config, timings, util
+from plants.archive import ArchiveReader, lttb, merge_buckets
 
 app = Flask(__name__)
+# Seconds to wait for the gardener to apply a reloaded config
+RELOAD_TIMEOUT = 30
 
 
 @app.route("/")
 def summary():
-    g = app.gardener
-    return {
-        "pumps": g.pumps,
-        "sensor_groups": g.sensor_groups,
-        "last_poll": g.last_poll,
-        "queued_ops": g.queue.qsize(),
-    }
+    """Pumps, sensor groups, last poll and predictions, encoded by the
+    gardener when it published its last snapshot."""
+    snap = app.gardener.snapshot
+    if snap is None:
+        abort(503)
+    if request.if_none_match.contains(snap.etag):
+        return Response(status=304, headers={"ETag": f'"{snap.etag}"'})
+    return Response(
+        snap.summary, mimetype="application/json", headers={"ETag": f'"{snap.etag}"'}
+    )
+
+
+@app.route("/events")
+def stream():
+    """Server-sent events: `poll` with the readings of each poll, `pump`
+    on each pump transition. Ends with `dropped` if the client can't
+    keep up."""
+    broker = app.gardener.events
+    subscriber = broker.subscribe()
+    if subscriber is None:
+        abort(503)
+
+    def generate():
+        try:
+            yield from subscriber
+        finally:
+            broker.unsubscribe(subscriber)
+
+    return Response(
+        generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
 
 
 @app.route("/water/<pump>", methods=["POST"])
@@ -24,3 +58,105 @@ def water(pump):
     if not p:
         abort(404)
     return {"status": app.gardener.water(p[0], duration=duration, force=force)}
+
+
+@app.route("/cancel/<pump>", methods=["POST"])
+def cancel(pump):
+    """Drops pending waterings of a pump, and stops it if running"""
+    p = [p for p in app.gardener.pumps if p.name == pump]
+    if not p:
+        abort(404)
+    app.gardener.cancel(p[0])
+    return {"status": True}
+
+
+@app.route("/all-off", methods=["POST"])
+def all_off():
+    """Switches every pump off, and every CAN node with a broadcast"""
+    app.gardener.stop_all()
+    return {"status": True}
+
+
+@app.route("/reload", methods=["POST"])
+def reload():
+    """Reloads the config file, applying what changed: sensor groups
+    (kept, built, closed), pumps by name, and settings that need a
+    restart."""
+    try:
+        conf = config.load(app.config_path)
+        changes = app.gardener.reload_config(conf).result(timeout=RELOAD_TIMEOUT)
+    except (config.Error, OSError) as exc:
+        return {"status": False, "error": str(exc)}, 400
+    return {"status": True, "changes": changes}
+
+
+@app.route("/can/nodes")
+def can_nodes():
+    if not app.gardener.autoconf:
+        abort(404)
+    return app.gardener.autoconf.nodes()
+
+
+@app.route("/debug/timings")
+def debug_timings():
+    """Latency histograms of hot path spans (counts per bucket upper
+    bound), event counters, and the breakdown of recent loop cycles,
+    with how late their polls were against schedule."""
+    return dict(timings.report(), poll_interval=app.gardener.config.poll_interval)
+
+
+@app.route("/history")
+def history():
+    """Archived readings of one kind over a time range, downsampled to
+    about `points` per sensor: [[ts, mean, min, max], ...]. Accepts
+    start/end timestamps or since=<duration>, and repeated sensor=."""
+    archive = app.gardener.archive
+    if not archive:
+        abort(404)
+    now = time.time()
+    try:
+        end = float(request.args.get("end", now))
+        start = float(
+            request.args.get("start")
+            or end - util.htime(request.args.get("since", "1d"))
+        )
+        points = max(3, int(request.args.get("points", 500)))
+    except (ValueError, IndexError):  # IndexError: empty since
+        abort(400)
+    if not (math.isfinite(start) and math.isfinite(end)):
+        abort(400)
+    kind = request.args.get("kind", "moisture")
+    sensors = request.args.getlist("sensor")
+    resolution = ArchiveReader.resolution_for(start, end, points, now)
+
+    # Data only changes when the archive commits, or the range moves:
+    # since= is relative to now.
+    query = (kind, sensors, points, start, end, resolution)
+    etag = hashlib.sha1(repr((query, archive.manager.commits)).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    def generate():
+        reader = archive.reader()
+        try:
+            names = sensors or sorted(s for k, s in reader.series() if k == kind)
+            yield json.dumps(
+                {"kind": kind, "start": start, "end": end, "resolution": resolution}
+            )[:-1] + ', "series": {'
+            for i, name in enumerate(names):
+                if resolution:
+                    rows = merge_buckets(
+                        reader.rollup(kind, name, start, end, resolution), points
+                    )
+                    data = [(ts, mean, lo, hi) for ts, _, lo, hi, mean in rows]
+                else:
+                    raw = lttb(reader.raw(kind, name, start, end), points)
+                    data = [(ts, v, v, v) for ts, v in raw]
+                yield ("," if i else "") + json.dumps(name) + ":" + json.dumps(data)
+            yield "}}"
+        finally:
+            reader.close()
+
+    return Response(
+        generate(), mimetype="application/json", headers={"ETag": f'"{etag}"'}
+    )
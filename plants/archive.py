@@ -0,0 +1,206 @@
+"""Append-only archive of sensor readings, in the pump history db.
+
+Every poll lands in `samples`, kept for RAW_RETENTION. Each sample is
+also folded into `rollups`: per minute, hour and day buckets with
+count, min, max and sum, each kept for its own retention. Disk use
+stays bounded while years of daily data remain, and long ranges are
+read from a coarse rollup instead of raw samples."""
+
+import sqlite3
+import time
+
+RAW_RETENTION = 86400
+# Rollup resolution (seconds) -> retention (seconds, None is forever)
+RESOLUTIONS = {
+    60: 31 * 86400,
+    3600: 366 * 86400,
+    86400: None,
+}
+PRUNE_INTERVAL = 3600
+
+
+class SensorArchive:
+    """Writes from the gardener thread, through the HistoryManager
+    connection and commits. Readers in other threads use reader()."""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.path = manager.path
+        self.series = set()
+        self.last_prune = 0
+        self.maybe_create_tables(manager.conn)
+        for kind, sensor in manager.conn.execute(
+            "SELECT DISTINCT kind, sensor FROM rollups WHERE resolution=?",
+            [max(RESOLUTIONS)],
+        ):
+            self.series.add((kind, sensor))
+
+    @staticmethod
+    def maybe_create_tables(conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS samples(kind, sensor, ts, value, "
+            "PRIMARY KEY(kind, sensor, ts)) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rollups(resolution, kind, sensor, ts, "
+            "n, min, max, sum, PRIMARY KEY(resolution, kind, sensor, ts)) "
+            "WITHOUT ROWID"
+        )
+
+    def append(self, ts, poll):
+        """Archives one poll result: {kind: {sensor: value}}"""
+        rows = [
+            (kind, sensor, ts, value)
+            for kind, measures in poll.items()
+            for sensor, value in measures.items()
+            if value is not None
+        ]
+        if not rows:
+            return
+        conn = self.manager.conn
+        # A sample already archived (e.g. polled again within the same
+        # second) is kept, and only new ones are rolled up.
+        rows = [
+            row
+            for row in rows
+            if conn.execute(
+                "INSERT OR IGNORE INTO samples VALUES(?, ?, ?, ?)", row
+            ).rowcount
+        ]
+        for res in RESOLUTIONS:
+            # With the conflict target, for SQLite before 3.35
+            conn.executemany(
+                "INSERT INTO rollups VALUES(?, ?, ?, ?, 1, ?, ?, ?) "
+                "ON CONFLICT(resolution, kind, sensor, ts) DO UPDATE SET n=n+1, "
+                "min=min(min, excluded.min), max=max(max, excluded.max), "
+                "sum=sum+excluded.sum",
+                [(res, k, s, int(t - t % res), v, v, v) for k, s, t, v in rows],
+            )
+        self.series.update((k, s) for k, s, _, _ in rows)
+        if ts - self.last_prune >= PRUNE_INTERVAL:
+            self.prune(ts)
+        self.manager.written()
+
+    def prune(self, now):
+        """Drops samples and rollups past their retention. Deletes go
+        per series, along the primary key."""
+        conn = self.manager.conn
+        for kind, sensor in self.series:
+            conn.execute(
+                "DELETE FROM samples WHERE kind=? AND sensor=? AND ts<?",
+                [kind, sensor, now - RAW_RETENTION],
+            )
+            for res, retention in RESOLUTIONS.items():
+                if retention:
+                    conn.execute(
+                        "DELETE FROM rollups WHERE resolution=? AND kind=? "
+                        "AND sensor=? AND ts<?",
+                        [res, kind, sensor, now - retention],
+                    )
+        self.last_prune = now
+
+    def reader(self):
+        return ArchiveReader(self.path)
+
+
+class ArchiveReader:
+    """Read-only queries, on a connection of their own."""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def raw(self, kind, sensor, start, end):
+        """[(ts, value)] of samples in [start, end)"""
+        return self.conn.execute(
+            "SELECT ts, value FROM samples WHERE kind=? AND sensor=? "
+            "AND ts>=? AND ts<? ORDER BY ts",
+            [kind, sensor, start, end],
+        ).fetchall()
+
+    def rollup(self, kind, sensor, start, end, resolution):
+        """[(ts, n, min, max, mean)] of buckets starting in [start, end)"""
+        # pylint: disable=too-many-arguments
+        return self.conn.execute(
+            "SELECT ts, n, min, max, sum/n FROM rollups WHERE resolution=? "
+            "AND kind=? AND sensor=? AND ts>=? AND ts<? ORDER BY ts",
+            [resolution, kind, sensor, start - start % resolution, end],
+        ).fetchall()
+
+    @staticmethod
+    def resolution_for(start, end, points, now=None):
+        """Coarsest resolution still giving `points` buckets over [start,
+        end), among those covering it; 0 means raw samples. Callers merge
+        the extra buckets down to `points`."""
+        if now is None:
+            now = time.time()
+        candidates = [
+            res
+            for res, retention in sorted(RESOLUTIONS.items(), reverse=True)
+            if not retention or start >= now - retention
+        ]
+        for res in candidates:
+            if (end - start) / res >= points:
+                return res
+        if start >= now - RAW_RETENTION:
+            return 0
+        return candidates[-1]
+
+    def series(self):
+        return self.conn.execute(
+            "SELECT DISTINCT kind, sensor FROM rollups WHERE resolution=?",
+            [max(RESOLUTIONS)],
+        ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+def lttb(data, threshold):
+    """Largest-Triangle-Three-Buckets downsampling of [(x, y, ...)],
+    keeping the points that preserve the visual shape of the series."""
+    # pylint: disable=too-many-locals
+    if threshold >= len(data) or threshold < 3:
+        return data
+    sampled = [data[0]]
+    every = (len(data) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, len(data))
+        avg = data[avg_start:avg_end]
+        avg_x = sum(p[0] for p in avg) / len(avg)
+        avg_y = sum(p[1] for p in avg) / len(avg)
+        ax, ay = data[a][0], data[a][1]
+        best, best_area = None, -1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs(
+                (ax - avg_x) * (data[j][1] - ay) - (ax - data[j][0]) * (avg_y - ay)
+            )
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(data[best])
+        a = best
+    sampled.append(data[-1])
+    return sampled
+
+
+def merge_buckets(rows, points):
+    """Merges consecutive [(ts, n, min, max, mean)] rollup rows into at
+    most `points` rows."""
+    if len(rows) <= points:
+        return rows
+    size = -(-len(rows) // points)
+    merged = []
+    for i in range(0, len(rows), size):
+        group = rows[i : i + size]
+        n = sum(r[1] for r in group)
+        merged.append(
+            (
+                group[0][0],
+                n,
+                min(r[2] for r in group),
+                max(r[3] for r in group),
+                sum(r[1] * r[4] for r in group) / n,
+            )
+        )
+    return merged
@@ -0,0 +1,183 @@
+"""Commissioning of CAN nodes.
+
+A node without an id (new, or reset with its button) sends a remote
+request on PLANTS_AUTOCONF_ID until it gets a reply there with a
+4 bytes id. It then sends a 6 bytes frame on that id, and owns it if
+the frame is acknowledged. We offer the first free id of our range,
+and record it once the node used it.
+
+Nodes are also discovered when they reply on ids we don't know yet,
+e.g. to the PLANTS_ALL_SENSORS_ID broadcast request sent at startup
+and every discovery_interval. Known nodes persist in the pump history db, and
+join the `can` sensor groups set with `autoconf: true`, named
+node-<id> unless renamed in the db. Nodes configured by hand, in `can`
+groups or pumps on the channel, are never enrolled nor offered.
+
+Frames arrive in the CAN bus thread, which only filters them: they're
+handled by the gardener thread, owner of the db connection."""
+
+from plants.hw import can
+
+# Unanswered offers are made again after this long
+OFFER_TIMEOUT = 10
+# Nodes without config say so on this id at boot
+UNCONFIGURED_ID = 0x123
+
+
+def configured_nodes(conf, channel):
+    """Ids of nodes a GardenerConfig sets by hand on a channel"""
+    nodes = set()
+    for group in conf.sensor_groups:
+        if group["kind"] == "can" and group.get("channel", "can0") == channel:
+            nodes.update(s.value.get("node") for s in group.get("sensors", ()))
+    for pump in conf.pumps:
+        if pump.kind == "can" and pump.options.get("channel", "can0") == channel:
+            nodes.add(pump.options.get("node"))
+    nodes.discard(None)
+    return nodes
+
+
+class NodeRegistry:
+    """Known nodes of a channel: {id: name}, in the db if we have one,
+    and nodes configured by hand"""
+
+    def __init__(self, manager, channel):
+        self.manager = manager
+        self.channel = channel
+        self.nodes = {}
+        self.configured = set()
+        if manager.conn:
+            manager.conn.execute(
+                "CREATE TABLE IF NOT EXISTS can_nodes(channel, id, name, ts, "
+                "PRIMARY KEY(channel, id))"
+            )
+            for node, name in manager.conn.execute(
+                "SELECT id, name FROM can_nodes WHERE channel=?", [channel]
+            ):
+                self.nodes[node] = name
+
+    def add(self, node):
+        name = f"node-{node:#x}"
+        self.nodes[node] = name
+        if self.manager.conn:
+            self.manager.conn.execute(
+                "INSERT OR IGNORE INTO can_nodes VALUES(?, ?, ?, ?)",
+                [self.channel, node, name, self.manager.clock.time()],
+            )
+            self.manager.written()
+        return name
+
+    def __contains__(self, node):
+        return node in self.nodes or node in self.configured
+
+    def enrolled(self):
+        """{id: name} of nodes to add to autoconf groups"""
+        return dict(
+            (node, name)
+            for node, name in self.nodes.items()
+            if node not in self.configured
+        )
+
+
+class Autoconf:
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, conf, manager, post):
+        """conf is the can_autoconf section, post(frame) hands frames
+        over to the gardener thread."""
+        self.channel = conf.get("channel", "can0")
+        self.first_id = conf.get("first_id", 0x100)
+        self.last_id = conf.get("last_id", can.CAN_SFF_MASK)
+        self.discovery_interval = conf.get("discovery_interval")
+        self.clock = manager.clock
+        self.registry = NodeRegistry(manager, self.channel)
+        self.offers = {}  # id -> time offered
+        self.last_seen = {}
+        self.next_discovery = self.clock.monotonic()
+        self.joined = []  # Callbacks for new nodes: (id, name)
+        self.bus = can.open_bus(self.channel)
+        self.post = post
+        self.bus.add_listener(self.on_frame)
+
+    def set_configured(self, conf):
+        """Takes the nodes a GardenerConfig sets by hand, on start and
+        reload"""
+        self.registry.configured = configured_nodes(conf, self.channel)
+
+    def on_frame(self, can_id, data, rtr):
+        """Bus thread: keeps what we may have to act on."""
+        if can_id in (can.PLANTS_AUTOCONF_ID, UNCONFIGURED_ID):
+            self.post((can_id, data, rtr))
+        elif rtr or can_id == can.PLANTS_ALL_SENSORS_ID:
+            return
+        elif can_id in self.registry:
+            self.last_seen[can_id] = self.clock.time()
+        else:
+            self.post((can_id, data, rtr))
+
+    def handle(self, can_id, data, rtr):
+        """Gardener thread"""
+        now = self.clock.monotonic()
+        if can_id == can.PLANTS_AUTOCONF_ID:
+            if rtr:
+                self.offer(now)
+        elif can_id == UNCONFIGURED_ID:
+            print(f"Unconfigured CAN node booted on {self.bus}")
+        elif len(data) in (2, 6):
+            # Our offer was taken (6 bytes), or an unknown node replied
+            # with a reading.
+            self.offers.pop(can_id, None)
+            self.enroll(can_id)
+
+    def offer(self, now):
+        expired = [n for n, t in self.offers.items() if now - t > OFFER_TIMEOUT]
+        for node in expired:
+            del self.offers[node]
+        for node in range(self.first_id, self.last_id + 1):
+            if node not in self.registry and node not in self.offers:
+                break
+        else:
+            print(f"No CAN id left in {self.first_id:#x}-{self.last_id:#x}")
+            return
+        self.offers[node] = now
+        print(f"Offering CAN id {node:#x} on {self.bus}")
+        self.bus.send(can.PLANTS_AUTOCONF_ID, node.to_bytes(4, byteorder="little"))
+
+    def enroll(self, node):
+        if node in self.registry:
+            return
+        name = self.registry.add(node)
+        self.last_seen[node] = self.clock.time()
+        print(f"CAN node {name} joined {self.bus}")
+        for joined in self.joined:
+            joined(node, name)
+
+    def discover(self):
+        """Asks every node for a reading, on their own ids"""
+        self.bus.send(can.PLANTS_ALL_SENSORS_ID, rtr=True)
+
+    def run_due(self, now=None):
+        """Discovers nodes if due. Returns when it's due next, or None."""
+        if self.next_discovery is None:
+            return None
+        if now is None:
+            now = self.clock.monotonic()
+        if now >= self.next_discovery:
+            self.discover()
+            # Without an interval, only once at startup
+            self.next_discovery = (
+                now + self.discovery_interval if self.discovery_interval else None
+            )
+        return self.next_discovery
+
+    def all_off(self):
+        """Switches every node off, with one high priority frame"""
+        self.bus.switch(can.PLANTS_ALL_SENSORS_ID, False)
+
+    def nodes(self):
+        return dict(
+            (
+                f"{node:#x}",
+                {"name": name, "last_seen": self.last_seen.get(node)},
+            )
+            for node, name in sorted(self.registry.nodes.items())
+        )
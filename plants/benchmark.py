@@ -0,0 +1,217 @@
+"""Benchmarks the gardener hot paths on synthetic configurations.
+
+Builds a Gardener from mock-ads1115 groups and mock-gpio pumps, without
+starting its thread, and times poll cycles, rule evaluation, pump
+history accounting, Prometheus export, the / API, shared memory
+snapshots, config reloads, and the cold start import of the gardener
+in a new interpreter. Results are written as JSON, and compared to a
+previous run with --compare:
+
+    python -m plants.benchmark --groups 50 --pumps 200 -o before.json
+    python -m plants.benchmark --groups 50 --pumps 200 --compare before.json"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import prometheus_client
+
+from plants import api, config, metrics, shm
+from plants.gardener import Gardener
+
+
+def synthetic_config(
+    groups=20, sensors=8, pumps=100, thresholds=2, seed=0, history_db=None
+):
+    """GardenerConfig of `groups` mock ADS1115 groups of `sensors` each,
+    and pumps activated by `thresholds` random sensors."""
+    # pylint: disable=too-many-arguments
+    rand = random.Random(seed)
+    names = []
+    sensor_groups = []
+    for g in range(groups):
+        group = []
+        for i in range(sensors):
+            name = f"s{g}-{i}"
+            names.append(name)
+            group.append(
+                {name: {"voltage_dry": 2.9, "voltage_wet": 1.2, "port": i % 4}}
+            )
+        sensor_groups.append(
+            {"kind": "mock-ads1115", "warmup_duration": 0, "sensors": group}
+        )
+    pump_list = []
+    for p in range(pumps):
+        pump_list.append(
+            {
+                f"p{p}": {
+                    "kind": "mock-gpio",
+                    "duration": 10,
+                    "limits": [
+                        {"per_interval": "1h", "duration": 60},
+                        {"per_interval": "1d", "duration": 600},
+                    ],
+                    "activation_thresholds": [
+                        {s: round(rand.random(), 2)}
+                        for s in rand.sample(names, min(thresholds, len(names)))
+                    ],
+                    "activation_mode": rand.choice(["all", "any"]),
+                }
+            }
+        )
+    return config.GardenerConfig.parse(
+        {
+            "poll_interval": 60,
+            "sensor_groups": sensor_groups,
+            "pumps": pump_list,
+            "pumps_history_db": history_db,
+        }
+    )
+
+
+def timings(samples):
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "mean": statistics.fmean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1],
+    }
+
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return timings(samples)
+
+
+def cold_start():
+    """Imports the gardener in a new interpreter, as the server would"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run(
+        [sys.executable, "-c", "import plants.gardener"], check=True, cwd=root
+    )
+
+
+def run(conf, repeat=20):
+    """Times each hot path `repeat` times, in seconds"""
+    results = {"cold_start": measure(cold_start, min(repeat, 5))}
+    gardener = Gardener(conf)
+    start = time.perf_counter()
+    gardener.setup_thread_from_config()
+    results["setup"] = timings([time.perf_counter() - start])
+    names = [s.name for g in gardener.sensor_groups for s in g.sensors]
+    rand = random.Random(0)
+
+    def cycle():
+        gardener.poll()
+        # The loop would water triggered pumps, drop them.
+        while not gardener.queue.empty():
+            gardener.queue.get_nowait()
+
+    def evaluate():
+        gardener.rules.evaluate(dict((n, rand.random()) for n in names))
+
+    def accounting():
+        for p in gardener.pumps:
+            p.history.add(1)
+            p.history.forget_up_to(max(x.per_interval for x in p.limits))
+            p.water(dry_run=True)
+
+    registry = prometheus_client.CollectorRegistry()
+    registry.register(metrics.Collector(gardener))
+    api.app.gardener = gardener
+    client = api.app.test_client()
+    try:
+        results["poll_cycle"] = measure(cycle, repeat)
+        results["rules_evaluate"] = measure(evaluate, repeat)
+        results["history_accounting"] = measure(accounting, repeat)
+        gardener.publish()
+        results["publish"] = measure(lambda: metrics.Snapshot.of(gardener), repeat)
+        results["publish_unchanged"] = measure(gardener.publish, repeat)
+        results["encode_polled"] = measure(
+            lambda: metrics.encode_polled(gardener), repeat
+        )
+        results["prometheus_export"] = measure(
+            lambda: prometheus_client.generate_latest(registry), repeat
+        )
+        results["api_summary"] = measure(lambda: client.get("/"), repeat)
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = shm.Writer(os.path.join(tmp, "plants"))
+            writer.write(gardener.snapshot)
+            results["shm_write"] = measure(
+                lambda: writer.write(gardener.snapshot), repeat
+            )
+            with shm.Reader(writer.path) as reader:
+                results["shm_get"] = measure(
+                    lambda: reader.get("moisture", names[0]), repeat
+                )
+                results["shm_read"] = measure(reader.read, repeat)
+            writer.close()
+        results["reload"] = measure(lambda: gardener.reload(conf), repeat)
+    finally:
+        gardener.poller.shutdown()
+        gardener.history_manager.close()
+    return results
+
+
+def compare(results, previous):
+    """Ratio of mean timings to a previous run, above 1 when slower"""
+    return dict(
+        (k, v["mean"] / previous[k]["mean"])
+        for k, v in results.items()
+        if previous.get(k, {}).get("mean")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--sensors", type=int, default=8, help="per group")
+    parser.add_argument("--pumps", type=int, default=100)
+    parser.add_argument("--thresholds", type=int, default=2, help="per pump")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--history-db", help="sqlite pump history instead of memory")
+    parser.add_argument("-o", "--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    conf = synthetic_config(
+        args.groups, args.sensors, args.pumps, args.thresholds, 0, args.history_db
+    )
+    # Drivers and rules are chatty, keep the report readable.
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = run(conf, args.repeat)
+    report = {
+        "time": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "args": vars(args),
+        "results": results,
+    }
+    for name, t in results.items():
+        print(f"{name:20} mean {t['mean'] * 1000:9.3f}ms p95 {t['p95'] * 1000:9.3f}ms")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fd:
+            for name, ratio in compare(results, json.load(fd)["results"]).items():
+                print(f"{name:20} x{ratio:.2f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fd:
+            json.dump(report, fd, indent=2)
+
+
+if __name__ == "__main__":
+    main()
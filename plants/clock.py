@@ -0,0 +1,63 @@
+"""Time sources.
+
+Components that read the time or wait take a clock, defaulting to the
+system one. A VirtualClock only moves when slept on, or when a queue
+wait times out, so the gardener can run on a compressed timeline (see
+plants.simulate)."""
+
+import queue
+import threading
+import time
+
+
+class Clock:
+    """The system clock"""
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def get(self, q, deadline):
+        """Next item of queue q, waiting until the monotonic deadline.
+        Raises queue.Empty on timeout."""
+        return q.get(timeout=max(0, deadline - self.monotonic()))
+
+
+class VirtualClock(Clock):
+    """Time only advances when slept on, or when waiting on an empty
+    queue. Listeners are called with (start, end) of every advance,
+    before it's visible."""
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self.lock = threading.Lock()
+        self.listeners = []
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def advance_to(self, t):
+        with self.lock:
+            if t <= self.now:
+                return
+            for listener in self.listeners:
+                listener(self.now, t)
+            self.now = t
+
+    def sleep(self, seconds):
+        self.advance_to(self.now + seconds)
+
+    def get(self, q, deadline):
+        try:
+            return q.get_nowait()
+        except queue.Empty:
+            self.advance_to(deadline)
+            raise
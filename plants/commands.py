@@ -0,0 +1,196 @@
+"""Messages to the gardener loop, and the queue they wait in.
+
+Producers (API, rules, sensor alerts, CAN) put commands and the loop
+gets them one at a time, by priority then in order: stops first, then
+forced or manual waterings, other commands, and automatic waterings
+last. A Water for a pump that already has one pending merges into it,
+keeping the longest duration and the most urgent priority, so bursts of
+triggers and API calls run a pump once. Cancel and AllOff drop pending
+waterings as soon as they're put."""
+
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import queue
+import threading
+import time
+import typing
+
+from plants import config, timings
+from plants.clock import Clock
+from plants.hw.pumps import Pump
+
+# Priorities, most urgent first
+STOP, MANUAL, DEFAULT, AUTOMATIC = range(4)
+# Recent waits kept for stats
+WAITS = 100
+
+
+class Water(typing.NamedTuple):
+    pump: Pump
+    duration: int = None
+    force: bool = None
+    manual: bool = False  # Asked through the API
+
+
+class Cancel(typing.NamedTuple):
+    """Drops waterings of a pump, pending or running."""
+
+    pump: Pump
+
+
+class Poll(typing.NamedTuple):
+    """Polls a sensor group (by index) now."""
+
+    group: int
+
+
+class CanFrame(typing.NamedTuple):
+    """A frame for the CAN autoconf service."""
+
+    can_id: int
+    data: bytes
+    rtr: bool
+
+
+class AllOff(typing.NamedTuple):
+    """Switches every pump off, and every CAN node."""
+
+
+class Reload(typing.NamedTuple):
+    """Applies a new GardenerConfig, setting the result future to what
+    changed."""
+
+    config: config.GardenerConfig
+    result: concurrent.futures.Future
+
+
+class Wakeup(typing.NamedTuple):
+    """Wakes the loop up, e.g. to notice it should exit."""
+
+
+def priority(msg):
+    if isinstance(msg, (AllOff, Cancel)):
+        return STOP
+    if isinstance(msg, Water):
+        return MANUAL if msg.force or msg.manual else AUTOMATIC
+    return DEFAULT
+
+
+def merge(pending, msg):
+    """One Water for both"""
+    default = pending.pump.config.duration
+    duration = max(pending.duration or default, msg.duration or default)
+    return Water(
+        pending.pump,
+        None if duration == default else duration,
+        pending.force or msg.force,
+        pending.manual or msg.manual,
+    )
+
+
+class CommandQueue:
+    """What the loop uses of queue.Queue, coalescing and by priority"""
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, clock=None):
+        self.clock = clock or Clock()
+        self.cond = threading.Condition()
+        self.heap = []  # [priority, seq, time put, msg], msg None once dropped
+        self.seq = itertools.count()
+        self.waters = {}  # pump name -> heap entry of its pending Water
+        self.depth = 0
+        self.merged = 0
+        self.dropped = 0
+        self.waits = collections.deque(maxlen=WAITS)
+        self.changes = 0  # Counts puts, drops and gets, for snapshots
+
+    def put(self, msg):
+        now = self.clock.monotonic()
+        with self.cond:
+            self.changes += 1
+            if isinstance(msg, Water):
+                entry = self.waters.get(msg.pump.name)
+                if entry:
+                    self.merged += 1
+                    msg = merge(entry[3], msg)
+                    if priority(msg) == entry[0]:
+                        entry[3] = msg
+                        return
+                    # Moves up, waiting since the first one
+                    self._drop(entry)
+                    now = entry[2]
+            elif isinstance(msg, Cancel):
+                self._drop_water(msg.pump)
+            elif isinstance(msg, AllOff):
+                self.dropped += len(self.waters)
+                for entry in list(self.waters.values()):
+                    self._drop(entry)
+            entry = [priority(msg), next(self.seq), now, msg]
+            heapq.heappush(self.heap, entry)
+            if isinstance(msg, Water):
+                self.waters[msg.pump.name] = entry
+            self.depth += 1
+            self.cond.notify()
+
+    def drop_water(self, pump):
+        """Drops a pending Water for that pump"""
+        with self.cond:
+            self._drop_water(pump)
+
+    def _drop_water(self, pump):
+        if pump.name in self.waters:
+            self._drop(self.waters[pump.name])
+            self.dropped += 1
+            self.changes += 1
+
+    def _drop(self, entry):
+        """Under lock, entries stay in the heap until popped"""
+        del self.waters[entry[3].pump.name]
+        entry[3] = None
+        self.depth -= 1
+
+    def get(self, block=True, timeout=None):
+        with self.cond:
+            end = None if timeout is None else time.monotonic() + timeout
+            while not self.depth:
+                remaining = None if end is None else end - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise queue.Empty
+                self.cond.wait(remaining)
+            _, _, put, msg = heapq.heappop(self.heap)
+            while msg is None:
+                _, _, put, msg = heapq.heappop(self.heap)
+            if isinstance(msg, Water):
+                del self.waters[msg.pump.name]
+            self.depth -= 1
+            self.changes += 1
+            wait = self.clock.monotonic() - put
+            self.waits.append(wait)
+        timings.recorder.record("queue_wait", wait)
+        return msg
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        return self.depth
+
+    def empty(self):
+        return not self.depth
+
+    def stats(self):
+        """Depth, how long the oldest command waits, and recent waits"""
+        now = self.clock.monotonic()
+        with self.cond:
+            oldest = min((e[2] for e in self.heap if e[3] is not None), default=now)
+            waits = list(self.waits)
+            return {
+                "depth": self.depth,
+                "oldest_seconds": now - oldest,
+                "recent_wait_max_seconds": max(waits, default=0),
+                "recent_wait_mean_seconds": sum(waits) / len(waits) if waits else 0,
+                "merged": self.merged,
+                "dropped": self.dropped,
+            }
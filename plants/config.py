@@ -1,3 +1,12 @@
+"""Configuration, resolved and validated once at load time.
+
+load() returns an immutable GardenerConfig. Durations, intervals and
+percentages are converted when loading, so lookups at runtime are plain
+attribute or dict accesses. Driver specific settings stay available as
+read-only Config mappings."""
+
+import dataclasses
+
 import yaml
 
 from plants import util
@@ -7,9 +16,36 @@ class Error(Exception):
     pass
 
 
+def resolve(k, val):
+    """Converts a yaml value to its runtime form: human durations for
+    *duration and *interval keys, percentages to ratios and nested
+    containers to Config and tuples."""
+    if isinstance(val, str):
+        if isinstance(k, str) and (k.endswith("duration") or k.endswith("interval")):
+            try:
+                return util.htime(val)
+            except ValueError as exc:
+                raise Error(f"Invalid duration for {k}: {val!r}") from exc
+        if val.endswith("%"):
+            try:
+                return float(val[:-1]) / 100
+            except ValueError as exc:
+                raise Error(f"Invalid percentage for {k}: {val!r}") from exc
+        return val
+    if isinstance(val, dict):
+        return Config(val)
+    if isinstance(val, (list, tuple)):
+        return tuple(resolve(k, x) for x in val)
+    return val
+
+
 class Config(dict):
-    def __init__(self, v):
-        super().__init__(v)
+    """Read-only mapping, with values resolved on construction."""
+
+    __slots__ = ()
+
+    def __init__(self, v=()):
+        super().__init__((k, resolve(k, x)) for k, x in dict(v).items())
 
     @property
     def name(self):
@@ -24,25 +60,170 @@ class Config(dict):
             return self[self.name]
         raise Error("No or multiple values in conf dict")
 
-    def __getitem__(self, k):
-        val = super().__getitem__(k)
-        if k.endswith("duration") or k.endswith("interval"):
-            return util.htime(val)
-        if isinstance(val, list):
-            return [Config(x) for x in val]
-        if isinstance(val, dict):
-            return Config(val)
-        if isinstance(val, str):
-            if val.endswith("%"):
-                return float(val[:-1]) / 100
-            return val
-        return val
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Config is read-only")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _number(conf, k, default=None, where=""):
+    v = conf.get(k, default)
+    if v is not None and (not isinstance(v, (int, float)) or v < 0):
+        raise Error(f"{where}{k} should be a positive number, got {v!r}")
+    return v
+
+
+def _path(conf, k):
+    v = conf.get(k)
+    if v is not None and not isinstance(v, str):
+        raise Error(f"{k} should be a path, got {v!r}")
+    return v
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Limit:
+    per_interval: int
+    duration: int
+
+    @classmethod
+    def parse(cls, conf, where=""):
+        if not isinstance(conf, Config):
+            raise Error(f"{where}limits should be a list of mappings")
+        for k in ["per_interval", "duration"]:
+            if conf.get(k) is None:
+                raise Error(
+                    f"{where}limits need per_interval and duration, {k} is missing"
+                )
+        return cls(
+            _number(conf, "per_interval", where=where),
+            _number(conf, "duration", where=where),
+        )
+
+
+DEFAULT_LIMITS = (Limit(86400, 60),)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class PumpConfig:
+    # pylint: disable=too-many-instance-attributes
+    name: str
+    kind: str
+    duration: int
+    limits: tuple[Limit, ...]
+    activation_thresholds: Config  # sensor name -> moisture ratio
+    activation_mode: str  # all or any sensor below threshold
+    activation_hysteresis: float
+    dry_duration: int  # How long thresholds hold before activating
+    power: float
+    options: Config  # All settings, for drivers
+
+    @classmethod
+    def parse(cls, entry):
+        if not isinstance(entry, Config) or not isinstance(entry.value, Config):
+            raise Error(f"Invalid pump definition {entry!r}")
+        name, conf = entry.name, entry.value
+        where = f"pump {name}: "
+        if "kind" not in conf:
+            raise Error(f"{where}missing kind")
+        if not _number(conf, "duration", where=where):
+            raise Error(f"{where}missing duration")
+        thresholds = {}
+        for t in conf.get("activation_thresholds", ()):
+            if not isinstance(t, Config) or len(t) != 1:
+                raise Error(f"{where}thresholds should be 'sensor: ratio' items")
+            if not isinstance(t.value, (int, float)) or not 0 <= t.value <= 1:
+                raise Error(f"{where}invalid threshold {t.value!r} for {t.name}")
+            thresholds[t.name] = t.value
+        mode = conf.get("activation_mode", "all")
+        if mode not in ("all", "any"):
+            raise Error(f"{where}activation_mode should be all or any")
+        return cls(
+            name=name,
+            kind=conf["kind"],
+            duration=conf["duration"],
+            limits=tuple(Limit.parse(x, where) for x in conf["limits"])
+            if "limits" in conf
+            else DEFAULT_LIMITS,
+            activation_thresholds=Config(thresholds),
+            activation_mode=mode,
+            activation_hysteresis=_number(conf, "activation_hysteresis", 0, where),
+            dry_duration=_number(conf, "dry_duration", 0, where),
+            power=_number(conf, "power", 0, where),
+            options=conf,
+        )
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class GardenerConfig:
+    # pylint: disable=too-many-instance-attributes
+    poll_interval: int
+    sensor_groups: tuple[Config, ...] = ()
+    pumps: tuple[PumpConfig, ...] = ()
+    host: str = "127.0.0.1"
+    port: int = 9001
+    pumps_history_db: str = None
+    pumps_history_commit_interval: int = None
+    sensors_archive: bool = False
+    max_running_pumps: int = 1
+    pumps_power_budget: float = None
+    adaptive_polling: Config = None  # min_interval, max_interval
+    can_autoconf: Config = None  # channel, first_id, last_id, discovery_interval
+    shared_memory: str = None  # Path snapshots are written to, see shm
 
-    def get(self, k, default=None):
-        if k in self:
-            return self[k]
-        return default
+    @classmethod
+    def parse(cls, raw):
+        conf = dict(Config(raw or {}))
+        # Pump settings may be grouped in a watering section
+        conf.update(conf.pop("watering", None) or {})
+        fields = {f.name for f in dataclasses.fields(cls)}
+        unknown = set(conf) - fields
+        if unknown:
+            raise Error(f"Unknown settings: {', '.join(sorted(map(str, unknown)))}")
+        if not _number(conf, "poll_interval"):
+            raise Error("poll_interval should be set")
+        for k in ["max_running_pumps", "pumps_power_budget", "port"]:
+            _number(conf, k)
+        adaptive = conf.get("adaptive_polling")
+        if adaptive is not None:
+            if not isinstance(adaptive, Config):
+                raise Error("adaptive_polling should be a mapping")
+            lo = _number(adaptive, "min_interval", conf["poll_interval"])
+            hi = _number(adaptive, "max_interval", conf["poll_interval"])
+            if not 0 < lo <= hi:
+                raise Error("adaptive_polling needs 0 < min_interval <= max_interval")
+        autoconf = conf.get("can_autoconf")
+        if autoconf is not None:
+            if not isinstance(autoconf, Config):
+                raise Error("can_autoconf should be a mapping")
+            lo = _number(autoconf, "first_id", 0x100, "can_autoconf: ")
+            hi = _number(autoconf, "last_id", 0x7FF, "can_autoconf: ")
+            _number(autoconf, "discovery_interval", where="can_autoconf: ")
+            if not 0x2 <= lo <= hi <= 0x1FFFFFFF:
+                raise Error("can_autoconf ids should be within 0x2-0x1fffffff")
+        _path(conf, "shared_memory")
+        groups = conf.get("sensor_groups") or ()
+        for group in groups:
+            if not isinstance(group, Config) or "kind" not in group:
+                raise Error(f"Sensor group without kind: {group!r}")
+        conf["sensor_groups"] = groups
+        conf["pumps"] = tuple(PumpConfig.parse(p) for p in conf.get("pumps") or ())
+        names = [p.name for p in conf["pumps"]]
+        if len(set(names)) != len(names):
+            raise Error("Pump names should be unique")
+        return cls(**conf)
 
 
 def load(f):
-    return Config(yaml.unsafe_load(open(f, encoding="utf-8")))
+    with open(f, encoding="utf-8") as fd:
+        try:
+            raw = yaml.unsafe_load(fd)
+        except yaml.YAMLError as exc:
+            raise Error(f"{f}: {exc}") from exc
+    return GardenerConfig.parse(raw)
@@ -0,0 +1,80 @@
+"""Server-sent events of polls and pump transitions.
+
+The gardener publishes to a Broker, which encodes each event once and
+hands it to every subscriber's bounded buffer without blocking. A
+subscriber whose buffer is full is too slow: it's dropped, and its
+stream ends with a `dropped` event, so clients know to reconnect."""
+
+import json
+import queue
+import threading
+
+# Events buffered per subscriber
+BUFFER = 100
+# Comment lines sent when idle, which notice disconnected clients
+KEEPALIVE = 15
+
+
+class Subscriber:
+    def __init__(self, buffer=BUFFER, keepalive=KEEPALIVE):
+        self.queue = queue.Queue(maxsize=buffer)
+        self.keepalive = keepalive
+        self.dropped = False
+
+    def put(self, message):
+        """Returns False once the buffer is full"""
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped = True
+        return not self.dropped
+
+    def __iter__(self):
+        """SSE messages, until dropped"""
+        # Right away, for servers and clients waiting for a first chunk
+        yield ": subscribed\n\n"
+        while not self.dropped:
+            try:
+                yield self.queue.get(timeout=self.keepalive)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+        yield "event: dropped\ndata: {}\n\n"
+
+
+class Broker:
+    def __init__(self, buffer=BUFFER, max_subscribers=None):
+        """max_subscribers caps streams, each holding an API thread"""
+        self.buffer = buffer
+        self.max_subscribers = max_subscribers
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.sent = 0
+        self.dropped = 0
+
+    def subscribe(self):
+        """A new Subscriber, or None if there are too many already"""
+        with self.lock:
+            if (
+                self.max_subscribers is not None
+                and len(self.subscribers) >= self.max_subscribers
+            ):
+                return None
+            subscriber = Subscriber(self.buffer)
+            self.subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        with self.lock:
+            if not self.subscribers:
+                return
+            self.sent += 1
+            message = f"id: {self.sent}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+            slow = [s for s in self.subscribers if not s.put(message)]
+            for subscriber in slow:
+                self.subscribers.discard(subscriber)
+                self.dropped += 1
+                print(f"Dropped a slow {event} events subscriber")
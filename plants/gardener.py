@@ -1,125 +1,496 @@
 """This module forks a main loop thread, talking to hardware, serializing
-access to it through a queue, owning a few metrics. Sqlite connections also
-like being used from a single thread."""
+access to it through a queue, and publishing snapshots of its state for
+metrics, and events of polls and pumps. Sqlite connections also like
+being used from a single thread."""
 
+import concurrent.futures
+import dataclasses
+import functools
 import queue
-import time
 import threading
-import typing
-
-from prometheus_client import Gauge
 
+from plants import config, events, metrics, rules, schedule, shm, timings
+from plants.clock import Clock
+from plants.commands import AllOff, Cancel, CanFrame, CommandQueue, Poll, Reload
+from plants.commands import Wakeup, Water
 from plants.history import HistoryManager
 from plants.hw import pumps, sensors
 
-# This import style to populate registry
-# pylint: disable=wildcard-import,unused-wildcard-import
-from plants.hw.pumps import *
-from plants.hw.sensors import *
-
-sensor_metrics = {
-    "temperature": Gauge("plants_temp_celsius", "Temperature", ["sensor_id"]),
-    "moisture": Gauge(
-        "plants_moisture_ratio", "Moisture per sensor ([0..1])", ["sensor_id"]
-    ),
-}
-
 
-# Producer messages for queue:
-class Water(typing.NamedTuple):
-    pump: Pump
-    duration: int = None
-    force: bool = None
+# Settings a reload can't change, kept until restarted
+RESTART_SETTINGS = (
+    "host",
+    "port",
+    "pumps_history_db",
+    "pumps_history_commit_interval",
+    "sensors_archive",
+    "can_autoconf",
+    "shared_memory",
+)
 
 
 class Gardener:
     # pylint: disable=too-many-instance-attributes
-    def __init__(self, conf):
+    def __init__(self, conf, clock=None):
+        self.clock = clock or Clock()
         self.running = True
         self.last_poll = {}
         self.sensor_groups = []
         self.pumps = []
-        self.queue = queue.Queue()
+        self.queue = CommandQueue(self.clock)
         self.config = conf
         self.thread = None
         self.history_manager = None
+        self.actuator = None
+        self.poller = None
+        self.archive = None
+        self.rules = None
+        self.scheduler = None
+        self.autoconf = None
+        self.snapshot = None  # metrics.Snapshot, replaced when state changes
+        self.dirty = None  # Pumps changed since, by name, None for all
+        self.api_summary = True  # Encoded in snapshots, for the API
+        self.events = events.Broker()
+        self.shared = None  # shm.Writer of snapshots, if configured
 
     def start_thread(self):
         self.thread = threading.Thread(target=self.loop, daemon=True)
         self.thread.start()
 
     def setup_thread_from_config(self):
-        self.history_manager = HistoryManager(self.config)
+        self.history_manager = HistoryManager(self.config, self.clock)
+        self.archive = self.history_manager.archive()
+        self.actuator = pumps.Actuator(
+            self.config.max_running_pumps, self.config.pumps_power_budget, self.clock
+        )
+        self.sensor_groups = [self._make_group(c) for c in self.config.sensor_groups]
+        # Groups power up and read concurrently, locking their i2c bus
+        # and device as needed.
+        self.poller = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, len(self.sensor_groups)), thread_name_prefix="poll"
+        )
+        self.pumps = [self._make_pump(p) for p in self.config.pumps]
+        self.setup_rules()
+        if self.config.can_autoconf:
+            self.setup_autoconf()
+        if self.config.shared_memory:
+            self.shared = shm.Writer(self.config.shared_memory)
 
-        for conf in self.config["sensor_groups"]:
-            try:
-                sensor_cls = sensors.registry[conf["kind"]]
-            except KeyError as exc:
-                raise config.Error(
-                    "Invalid sensor group type " f"{conf['kind']}"
-                ) from exc
-            self.sensor_groups.append(sensor_cls(conf))
-
-        for p in self.config["pumps"]:
-            try:
-                pump_cls = pumps.registry[p.value["kind"]]
-            except KeyError as exc:
-                raise config.Error(
-                    "Invalid pump type " f"{p.value['kind']} for {p.name}"
-                ) from exc
-            self.pumps.append(pump_cls(p.name, p.value, self.history_manager))
+    def _make_group(self, conf):
+        try:
+            sensor_cls = sensors.registry[conf["kind"]]
+        except KeyError as exc:
+            raise config.Error("Invalid sensor group type " f"{conf['kind']}") from exc
+        try:
+            group = sensor_cls(conf)
+        except KeyError as exc:
+            raise config.Error(f"{conf['kind']} sensor group needs {exc}") from exc
+        group.clock = self.clock
+        return group
+
+    def _make_pump(self, conf):
+        try:
+            pump_cls = pumps.registry[conf.kind]
+        except KeyError as exc:
+            raise config.Error(
+                "Invalid pump type " f"{conf.kind} for {conf.name}"
+            ) from exc
+        try:
+            pump = pump_cls(conf.name, conf, self.history_manager, self.actuator)
+        except KeyError as exc:
+            raise config.Error(f"{conf.kind} pump {conf.name} needs {exc}") from exc
+        pump.switched.append(self.pump_switched)
+        return pump
+
+    def setup_rules(self):
+        """Rules, poll schedule and group thresholds, from groups and pumps"""
+        self.rules = rules.Engine(self.pumps)
+        self.scheduler = schedule.PollScheduler(
+            self.sensor_groups, self.pumps, self.config, self.clock
+        )
+        thresholds = {}
+        for p in self.pumps:
+            for sensor, t in p.activation_thresholds.items():
+                prev = thresholds.get(sensor, (t, p.config.activation_hysteresis))
+                thresholds[sensor] = (
+                    max(t, prev[0]),
+                    min(p.config.activation_hysteresis, prev[1]),
+                )
+        for i, group in enumerate(self.sensor_groups):
+            group.arm(thresholds, lambda i=i: self.queue.put(Poll(i)))
+
+    def setup_autoconf(self):
+        # CAN support (and asyncio) is only loaded when used
+        # pylint: disable=import-outside-toplevel
+        from plants import autoconf
+
+        self.autoconf = autoconf.Autoconf(
+            self.config.can_autoconf,
+            self.history_manager,
+            lambda frame: self.queue.put(CanFrame(*frame)),
+        )
+        self.autoconf.set_configured(self.config)
+        self.autoconf.joined.append(self.node_joined)
+        for node, name in self.autoconf.registry.enrolled().items():
+            self.node_joined(node, name)
+
+    def node_joined(self, node, name):
+        """Adds an enrolled CAN node to the autoconf groups of its channel"""
+        for i, group in enumerate(self.sensor_groups):
+            if getattr(group, "autoconf", False) and (
+                group.channel == self.autoconf.channel
+            ):
+                if group.add_node(node, name):
+                    self.scheduler.sensors[i].append(name)
+
+    def reload(self, conf):
+        """Applies a new config, only rebuilding the groups and pumps
+        that changed: others keep their hardware, history and schedule.
+        Returns what changed."""
+        self._mark_dirty()
+        restart = [
+            k for k in RESTART_SETTINGS if getattr(conf, k) != getattr(self.config, k)
+        ]
+        conf = dataclasses.replace(
+            conf, **dict((k, getattr(self.config, k)) for k in restart)
+        )
+        # Unknown kinds fail here, before anything is released
+        for kind in {c["kind"] for c in conf.sensor_groups}:
+            if kind not in sensors.registry:
+                raise config.Error(f"Invalid sensor group type {kind}")
+        for kind in {c.kind for c in conf.pumps}:
+            if kind not in pumps.registry:
+                raise config.Error(f"Invalid pump type {kind}")
+
+        previous = (self.config, self.sensor_groups, self.pumps)
+        previous += (self.rules, self.scheduler)
+        # Replacements often take the pins and ADC of what they replace,
+        # which is released first, and rebuilt if anything fails.
+        undo = []
+        try:
+            groups, moved = self._reload_groups(conf, undo)
+            new_pumps, changes = self._reload_pumps(conf, undo)
+            self.config, self.sensor_groups, self.pumps = conf, groups, new_pumps
+            self.setup_rules()
+        except Exception as exc:
+            self._rollback(previous, undo)
+            if isinstance(exc, (config.Error, OSError)):
+                raise
+            raise config.Error(f"Reload failed, config unchanged: {exc!r}") from exc
+        self.actuator.max_running = conf.max_running_pumps
+        self.actuator.power_budget = conf.pumps_power_budget
+        if len(groups) != len(previous[1]):
+            self.poller.shutdown(wait=False)
+            self.poller = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max(1, len(groups)), thread_name_prefix="poll"
+            )
+        self.rules.inherit(previous[3])
+        self.scheduler.inherit(previous[4], moved)
+        if self.autoconf:
+            self.autoconf.set_configured(conf)
+            for node, name in self.autoconf.registry.enrolled().items():
+                self.node_joined(node, name)
+        # Readings of sensors that are gone
+        names = {s.name for g in groups for s in g.sensors}
+        if self.last_poll:
+            self.last_poll = dict(
+                self.last_poll,
+                result=dict(
+                    (kind, dict((n, v) for n, v in measures.items() if n in names))
+                    for kind, measures in self.last_poll["result"].items()
+                ),
+            )
+
+        changes = {
+            "sensor_groups": {
+                "kept": len(moved),
+                "built": len(groups) - len(moved),
+                "closed": len(previous[1]) - len(moved),
+            },
+            "pumps": changes,
+            "restart_required": restart,
+        }
+        print(f"Reloaded config: {changes}")
+        self.events.publish("reload", changes)
+        return changes
+
+    def _reload_groups(self, conf, undo):
+        """Groups for conf, kept if configured the same, or released
+        then rebuilt. Returns them, and {new index: old index} of kept
+        ones. undo gets what restores the previous groups."""
+        unused = dict(enumerate(self.config.sensor_groups))
+        moved = {}
+        for i, c in enumerate(conf.sensor_groups):
+            old = next((j for j, o in unused.items() if o == c), None)
+            if old is not None:
+                moved[i] = old
+                del unused[old]
+        for j, c in unused.items():
+            self.sensor_groups[j].close()
+            undo.append(functools.partial(self._restore_group, j, c))
+        groups = []
+        for i, c in enumerate(conf.sensor_groups):
+            if i in moved:
+                groups.append(self.sensor_groups[moved[i]])
+                continue
+            groups.append(self._make_group(c))
+            undo.append(groups[-1].close)
+        return groups, moved
+
+    def _restore_group(self, i, conf):
+        self.sensor_groups[i] = self._make_group(conf)
+
+    def _reload_pumps(self, conf, undo):
+        """Pumps for conf, kept, or taking their new config in place if
+        it drives the same device. Others are stopped and released
+        first, keeping their history. Returns them, and pump names by
+        change. undo gets what restores the previous pumps."""
+        old_pumps = dict((p.name, p) for p in self.pumps)
+        changes = dict((k, []) for k in ["kept", "reconfigured", "rebuilt", "added"])
+        changes["removed"] = sorted(old_pumps.keys() - {c.name for c in conf.pumps})
+        for name in changes["removed"]:
+            self._release_pump(old_pumps[name], undo)
+        new_pumps = []
+        for c in conf.pumps:
+            pump = old_pumps.get(c.name)
+            previous_config = pump and pump.config
+            if pump and pump.config == c:
+                changes["kept"].append(c.name)
+            elif pump and pump.reconfigure(c):
+                undo.append(functools.partial(pump.reconfigure, previous_config))
+                changes["reconfigured"].append(c.name)
+            elif pump:
+                self._release_pump(pump, undo)
+                history, pump = pump.history, self._make_pump(c)
+                pump.history = history
+                undo.append(pump.close)
+                changes["rebuilt"].append(c.name)
+            else:
+                pump = self._make_pump(c)
+                undo.append(pump.close)
+                changes["added"].append(c.name)
+            new_pumps.append(pump)
+        return new_pumps, changes
+
+    def _release_pump(self, pump, undo):
+        self.queue.drop_water(pump)
+        self.actuator.stop(pump)
+        pump.close()
+        undo.append(functools.partial(self._restore_pump, pump))
+
+    def _restore_pump(self, pump):
+        """Rebuilds a released pump in its place, with its history"""
+        restored = self._make_pump(pump.config)
+        restored.history = pump.history
+        restored.seconds, restored.inhibitions = pump.seconds, pump.inhibitions
+        i = next(i for i, p in enumerate(self.pumps) if p is pump)
+        self.pumps[i] = restored
+
+    def _rollback(self, previous, undo):
+        """Back to the previous groups and pumps after a failed reload,
+        closing new ones and rebuilding those released."""
+        self.config, self.sensor_groups, self.pumps, rules_, scheduler = previous
+        for restore in reversed(undo):
+            restore()
+        self.setup_rules()
+        self.rules.inherit(rules_)
+        kept = range(len(scheduler.next_poll))
+        self.scheduler.inherit(scheduler, dict(zip(kept, kept)))
+
+    def pump_switched(self, pump, on):
+        self._mark_dirty(pump)
+        self.events.publish(
+            "pump", {"pump": pump.name, "on": on, "time": self.clock.time()}
+        )
 
     # Queue producers:
     def water(self, pump, duration=None, force=False):
-        if pump.water(duration, force, dry_run=True):
-            self.queue.put(Water(pump, duration, force))
-            return True
-        return False
+        """Queues a manual watering, unless the last snapshot shows the
+        pump busy or, without force, at a limit. The pump itself is the
+        loop's: it checks again when watering."""
+        snap = self.snapshot
+        state = snap and next((s for s in snap.pumps if s.name == pump.name), None)
+        if state:
+            if state.busy:
+                print(f"{pump} is already watering")
+                return False
+            usage = dict(state.usage)
+            for limit in state.config.limits:
+                if not force and usage.get(limit.per_interval, 0) >= limit.duration:
+                    print(f"Inhibiting {pump}, reached {limit}")
+                    return False
+        self.queue.put(Water(pump, duration, force, manual=True))
+        return True
+
+    def cancel(self, pump):
+        self.queue.put(Cancel(pump))
+
+    def stop_all(self):
+        self.queue.put(AllOff())
 
-    # Our only queue consumer is the main loop.
+    def reload_config(self, conf):
+        """Has the loop apply conf, returns a future of what changed"""
+        result = concurrent.futures.Future()
+        self.queue.put(Reload(conf, result))
+        return result
+
+    # Our only queue consumer is the main loop. It sleeps on the queue
+    # until the next poll or pump transition is due, so producers wake
+    # it up right away.
     def loop(self):
         self.setup_thread_from_config()
 
-        while self.running:
-            last_poll = {}
-            for s in self.sensor_groups:
-                for sensor_type, measures in s.poll().items():
-                    last_poll.setdefault(sensor_type, {}).update(measures)
-            # Plot metrics
-            for sensor_type, measures in last_poll.items():
-                for label, value in measures.items():
-                    if value is not None:
-                        sensor_metrics[sensor_type].labels(label).set(value)
-            # Export a summary for API
-            self.last_poll = {"time": time.time(), "result": last_poll}
-            # Check which pumps should activate
-            for p in self.pumps_to_activate(last_poll):
-                self.queue.put(Water(p))
-
-            # Consume from queue: process commands.
+        try:
+            while self.running:
+                self.step()
+        finally:
+            # Even if the loop died: nothing would switch running pumps off
+            self.all_off()
+            self.poller.shutdown()
+            self.history_manager.close()
+            if self.shared:
+                self.shared.close()
+            print("Gardener exited")
+
+    def step(self):
+        """Polls due groups, then handles one message, or waits until
+        the next poll, pump transition or commit. State is published
+        once, before waiting: what a message changes shows after the
+        next step's due polls."""
+        due = self.scheduler.due()
+        now = self.clock.monotonic()
+        timings.begin_cycle(
+            max((now - self.scheduler.next_poll[i] for i in due), default=None)
+        )
+        if due:
+            self.poll(due)
+
+        deadline = min(
+            (
+                d
+                for d in [
+                    self.scheduler.next_deadline(),
+                    self.actuator.run_due(),
+                    self.history_manager.commit_due(),
+                    self.autoconf.run_due() if self.autoconf else None,
+                ]
+                if d is not None
+            ),
+            default=self.clock.monotonic() + self.config.poll_interval,
+        )
+        self.publish()
+        try:
+            msg = self.clock.get(self.queue, deadline)
+        except queue.Empty:
+            return
+        with timings.span("message", type(msg).__name__):
+            self.handle(msg)
+
+    def handle(self, msg):
+        if isinstance(msg, (Water, Cancel)):
+            # Inhibited, or queued or dropped by the actuator
+            self._mark_dirty(msg.pump)
+        elif isinstance(msg, AllOff):
+            self._mark_dirty()
+        if isinstance(msg, Water):
+            if msg.pump.water(msg.duration, msg.force):
+                self.scheduler.watered(msg.pump)
+        elif isinstance(msg, Poll):
+            self.poll([msg.group])
+        elif isinstance(msg, CanFrame):
+            self.autoconf.handle(*msg)
+        elif isinstance(msg, AllOff):
+            self.all_off()
+        elif isinstance(msg, Cancel):
+            self.actuator.stop(msg.pump)
+        elif isinstance(msg, Reload):
             try:
-                while msg := self.queue.get_nowait():
-                    if isinstance(msg, Water):
-                        msg.pump.water(msg.duration, msg.force)
-            except queue.Empty:
-                pass
-
-            # Wait until next cycle
-            next_poll = time.time() + self.config["poll_interval"]
-            while time.time() < next_poll and self.running:
-                time.sleep(0.1)
-        print("Gardener exited")
+                msg.result.set_result(self.reload(msg.config))
+            except (config.Error, OSError) as exc:
+                print(f"Config reload failed: {exc}")
+                msg.result.set_exception(exc)
+
+    def _mark_dirty(self, pump=None):
+        """Has the next publish take the state of pump, of all pumps and
+        readings by default"""
+        if pump is None:
+            self.dirty = None
+        elif self.dirty is not None:
+            self.dirty.add(pump.name)
+
+    def publish(self):
+        """Replaces the snapshot, unless nothing it shows changed"""
+        snap = self.snapshot
+        if (
+            snap
+            and self.dirty == set()
+            and snap.queue_changes == self.queue.changes
+            and snap.history_commits == self.history_manager.commits
+        ):
+            return
+        with timings.span("publish"):
+            self.snapshot = metrics.Snapshot.of(self, self.dirty)
+            self.dirty = set()
+            if self.shared:
+                self.shared.write(self.snapshot)
+
+    def all_off(self):
+        self.actuator.all_off()
+        if self.autoconf:
+            self.autoconf.all_off()
+
+    def poll(self, due=None):
+        """Polls groups (by index, all by default), merging their
+        readings into last_poll."""
+        with timings.span("poll"):
+            self._poll(range(len(self.sensor_groups)) if due is None else due)
+
+    def poll_group(self, i):
+        with timings.span("group_poll", i):
+            try:
+                return self.sensor_groups[i].poll()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # One bad bus or device mustn't stop the loop
+                print(f"Caught {e} polling sensor group {i}")
+                timings.count("group_poll_errors")
+                return self.sensor_groups[i].unread()
+
+    def _poll(self, due):
+        # Readings, and pump usage as windows slide
+        self._mark_dirty()
+        polled = {}
+        results = self.poller.map(self.poll_group, due)
+        for i, result in zip(due, results):
+            # Interval is *between* polls of a group
+            self.scheduler.polled(i, result.get("moisture", {}))
+            for sensor_type, measures in result.items():
+                polled.setdefault(sensor_type, {}).update(measures)
+        last_poll = dict(
+            (k, dict(v)) for k, v in self.last_poll.get("result", {}).items()
+        )
+        for sensor_type, measures in polled.items():
+            last_poll.setdefault(sensor_type, {}).update(measures)
+        # Export a summary for API
+        self.last_poll = {"time": self.clock.time(), "result": last_poll}
+        self.events.publish("poll", {"time": self.last_poll["time"], "result": polled})
+        if self.archive:
+            with timings.span("archive"):
+                self.archive.append(self.last_poll["time"], polled)
+        # Check which pumps should activate
+        for p in self.pumps_to_activate(last_poll):
+            self.queue.put(Water(p))
 
     def pumps_to_activate(self, poll):
         """Check if pump activation rules triggered."""
-        for p in self.pumps:
-            if all(
-                poll["moisture"][s] and poll["moisture"][s] < p.activation_thresholds[s]
-                for s in p.activation_thresholds
-            ):
-                print(f"{p} triggered on {poll}")
-                yield p
+        with timings.span("rules"):
+            active = self.rules.evaluate(
+                poll.get("moisture", {}), self.clock.monotonic()
+            )
+        for p in active:
+            print(f"{p} triggered on {poll}")
+            yield p
 
     def exit(self):
         self.running = False
+        self.queue.put(Wakeup())
         self.thread.join()
@@ -1,5 +1,9 @@
+import bisect
 import sqlite3
-import time
+
+from plants import timings
+from plants.archive import SensorArchive
+from plants.clock import Clock
 
 
 class InMemoryHistory:
@@ -7,64 +11,115 @@ class InMemoryHistory:
 
     add() increments total, adding it to history.
     forget_up_to() is called to cleanup state.
-    total_up_to() provides sum of recent events."""
-
-    def __init__(self):
-        self.events = {}
-
-    def add(self, v):
-        self.events[time.time()] = v
+    total_up_to() provides sum of recent events.
+
+    Events are kept in time order next to their running totals, so a
+    window sum is two bisections and a subtraction. Forgotten events
+    are skipped over and compacted away once they are half the list."""
+
+    def __init__(self, clock=None):
+        self.clock = clock or Clock()
+        self.times = []
+        self.sums = [0]  # sums[i] is the total of events before times[i]
+        self.start = 0  # first event not forgotten
+
+    def add(self, v, ts=None):
+        """Adds v at ts, now by default"""
+        self.record(self.clock.time() if ts is None else ts, v)
+
+    def record(self, ts, v):
+        if not self.times or ts >= self.times[-1]:
+            self.times.append(ts)
+            self.sums.append(self.sums[-1] + v)
+            return
+        # Out of order (clock stepped back): rebuild totals from there.
+        i = bisect.bisect_right(self.times, ts, lo=self.start)
+        self.times.insert(i, ts)
+        self.sums.insert(i + 1, self.sums[i] + v)
+        for j in range(i + 2, len(self.sums)):
+            self.sums[j] += v
 
     def forget_up_to(self, interval):
         """Forget events that are no longer relevant"""
-        self.events = dict(
-            (k, v) for k, v in self.events.items() if k >= time.time() - interval
+        self.start = bisect.bisect_left(
+            self.times, self.clock.time() - interval, lo=self.start
         )
+        if self.start > len(self.times) // 2:
+            del self.times[: self.start]
+            del self.sums[: self.start]
+            self.start = 0
 
     def total_up_to(self, interval):
         """Return sums that happened up to that far in the past"""
-        return sum(v for k, v in self.events.items() if k >= time.time() - interval)
+        i = bisect.bisect_left(self.times, self.clock.time() - interval, lo=self.start)
+        return self.sums[-1] - self.sums[i]
+
+    def __len__(self):
+        return len(self.times) - self.start
 
 
 class SqliteHistory(InMemoryHistory):
     """The same as above, persisting to sqlite. Because sqlite
     defaults, only creator thread should mutate, which is fine
-    given this has to be synchronized with accessing GPIO."""
+    given this has to be synchronized with accessing GPIO.
 
-    def __init__(self, name, conn):
-        # pylint: disable=super-init-not-called
+    Writes are committed by the manager, right away or grouped."""
+
+    def __init__(self, name, manager):
+        super().__init__(manager.clock)
         self.name = name
-        self.conn = conn
-        cur = self.conn.cursor()
-        res = cur.execute(
-            'SELECT strftime("%s", ts), value FROM history WHERE name=?', [name]
-        )
-        self.events = dict((int(ts), int(v)) for ts, v in res.fetchall())
+        self.manager = manager
+        for ts, v in manager.rows.pop(name, []):
+            self.record(ts, v)
 
     def forget_up_to(self, interval):
-        cur = self.conn.cursor()
-        cur.execute(
-            "DELETE FROM history WHERE name=? and ts<current_timestamp - ?",
-            [self.name, interval],
-        )
-        self.conn.commit()
+        with timings.span("history_write", self.name):
+            self.manager.conn.execute(
+                "DELETE FROM history WHERE name=? and ts<datetime(?, 'unixepoch')",
+                [self.name, int(self.clock.time() - interval)],
+            )
+            self.manager.written()
         super().forget_up_to(interval)
 
-    def add(self, v):
-        cur = self.conn.cursor()
-        cur.execute("INSERT INTO history (name, value) VALUES(?, ?)", [self.name, v])
-        self.conn.commit()
-        super().add(v)
+    def add(self, v, ts=None):
+        if ts is None:
+            ts = self.clock.time()
+        with timings.span("history_write", self.name):
+            self.manager.conn.execute(
+                "INSERT INTO history (name, ts, value) "
+                "VALUES(?, datetime(?, 'unixepoch'), ?)",
+                [self.name, int(ts), v],
+            )
+            self.manager.written()
+        super().add(v, ts)
 
 
 class HistoryManager:
-    """Factory for the above, based on config."""
-
-    def __init__(self, config):
-        db = config.get("pumps_history_db")
+    """Factory for the above, based on config.
+
+    With pumps_history_commit_interval set, the db runs in WAL mode and
+    writes are committed in groups, at most that long after the first
+    uncommitted one: fewer fsyncs (and SD card wear) for a bounded
+    window of history lost on power failure. The owner calls
+    commit_due() from its loop to honor that bound."""
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, config, clock=None):
+        db = config.pumps_history_db
+        self.clock = clock or Clock()
+        self.path = db
+        self.archive_sensors = config.sensors_archive
+        self.commit_interval = config.pumps_history_commit_interval
+        self.dirty_since = None
+        self.commits = 0  # Lets readers tell when data changed
+        self.rows = {}
         if db:
             self.conn = sqlite3.connect(db)
+            if self.commit_interval:
+                self.conn.execute("PRAGMA journal_mode=WAL")
+                self.conn.execute("PRAGMA synchronous=NORMAL")
             self.maybe_create_table(self.conn)
+            self.load()
         else:
             self.conn = None
 
@@ -74,9 +129,56 @@ class HistoryManager:
             "CREATE TABLE IF NOT EXISTS "
             "history(name, ts default CURRENT_TIMESTAMP, value)"
         )
+        cur.execute("CREATE INDEX IF NOT EXISTS history_name_ts ON history(name, ts)")
+
+    def load(self):
+        """Reads history for all pumps at once, handed over by history_for()"""
+        res = self.conn.execute(
+            'SELECT name, strftime("%s", ts), value FROM history ORDER BY name, ts'
+        )
+        for name, ts, v in res:
+            self.rows.setdefault(name, []).append((int(ts), int(v)))
+
+    def written(self):
+        if not self.commit_interval:
+            self.commit()
+        elif self.dirty_since is None:
+            self.dirty_since = self.clock.monotonic()
+
+    def commit_due(self, now=None):
+        """Commits grouped writes if their delay expired. Returns when
+        the next commit is due, or None."""
+        if self.dirty_since is None:
+            return None
+        if now is None:
+            now = self.clock.monotonic()
+        deadline = self.dirty_since + self.commit_interval
+        if now < deadline:
+            return deadline
+        self.commit()
+        return None
+
+    def commit(self):
+        with timings.span("history_commit"):
+            self.conn.commit()
+        self.commits += 1
+        self.dirty_since = None
+
+    def close(self):
+        if self.conn:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+        self.dirty_since = None
+
+    def archive(self):
+        """Sensor readings archive, if enabled and we have a db."""
+        if self.conn and self.archive_sensors:
+            return SensorArchive(self)
+        return None
 
     def history_for(self, obj):
         name = repr(obj)
         if self.conn:
-            return SqliteHistory(name, self.conn)
-        return InMemoryHistory()
+            return SqliteHistory(name, self)
+        return InMemoryHistory(self.clock)
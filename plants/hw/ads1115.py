@@ -1,8 +1,10 @@
 #!/usr/bin/python
 
-import smbus
 import time
 
+from plants import timings
+from plants.hw import i2c
+
 # Valid addresses for ads1115
 # Address[0] is with address pin to GND
 addresses = [0b1001000, 0b1001001, 0b1001010, 0b1001011]
@@ -77,6 +79,43 @@ class Config:
             | (0b11 << cls.COMP_QUEUE)
         )
 
+    @classmethod
+    def continuous_read_gnd(cls, x=0, rate=860):
+        """Emit config register to continuously convert AINx at rate"""
+        rates = dict((v, k) for k, v in cls.dr_to_rate.items())
+        if rate not in rates:
+            raise ValueError(f"Data rate {rate} not in {sorted(rates)}")
+        return Config(
+            ((0b100 | x) << cls.MUX)
+            | (1 << cls.PGA)  # 4.096v FSR
+            | (rates[rate] << cls.DR)
+            | (0 << cls.MODE)  # Continuous conversion
+            | (0b11 << cls.COMP_QUEUE)
+        )
+
+    @classmethod
+    def comparator_gnd(cls, x=0, rate=8, queue=2):
+        """Continuous conversions of AINx, with the traditional comparator
+        asserting ALERT/RDY low after `queue` (1, 2 or 4) conversions
+        above HI_THRESH, until one falls below LO_THRESH."""
+        queues = {1: 0b00, 2: 0b01, 4: 0b10}
+        if queue not in queues:
+            raise ValueError(f"Comparator queue {queue} not in {sorted(queues)}")
+        conf = cls.continuous_read_gnd(x, rate).value
+        conf &= ~(0b11 << cls.COMP_QUEUE)
+        return Config(conf | (queues[queue] << cls.COMP_QUEUE))
+
+    @classmethod
+    def power_down(cls):
+        """Single-shot mode without starting a conversion: the ADC
+        powers down until the next one."""
+        return Config(cls.single_shot_read_gnd().value & ~(1 << cls.OS))
+
+    def to_code(self, volts):
+        """Conversion register value for volts, as 16 bits"""
+        code = int(volts / self.volts_range() * 32768)
+        return max(-32768, min(32767, code)) & 0xFFFF
+
     def delay(self):
         return 1 / self.dr_to_rate[(self.value >> self.DR) & self.DR_MASK]
 
@@ -92,12 +131,22 @@ class Config:
 
 class ADC:
     def __init__(self, smbus_id, address):
-        self.bus = smbus.SMBus(smbus_id)
+        self.bus = i2c.open_bus(smbus_id)
         self.address = address
+        # Held by users of this ADC across multiple conversions
+        self.lock = self.bus.device_lock(address)
+
+    def close(self):
+        self.bus.release(self.address)
 
     def write_config(self, config):
         self.bus.write_i2c_block_data(self.address, Register.CONFIG, config.to_bytes())
 
+    def write_register(self, register, value):
+        self.bus.write_i2c_block_data(
+            self.address, register, [(value >> 8) & 0xFF, value & 0xFF]
+        )
+
     def read_config(self, wait_for=None):
         attempts = 0
 
@@ -108,19 +157,14 @@ class ADC:
                 break
             time.sleep(wait_for.delay())
             attempts += 1
+            timings.count("ads1115_read_config_retries")
             if attempts > 3:
+                timings.count("ads1115_slow_reads")
                 raise Exception("Slow read %s!=%s" % (conf, wait_for))
 
         return conf
 
-    def single_shot_read_gnd(self, x):
-        # Write to config register
-        config = Config.single_shot_read_gnd(x)
-        self.write_config(config)
-
-        # Check it's there
-        conf = self.read_config(wait_for=config)
-
+    def read_conversion(self, conf):
         # Read conversion register (two bytes, MSB/LSB)
         reg = self.bus.read_i2c_block_data(self.address, Register.CONVERSION, 2)
 
@@ -131,6 +175,42 @@ class ADC:
             / 32768
         )
 
+    def single_shot_read_gnd(self, x):
+        # Write to config register
+        config = Config.single_shot_read_gnd(x)
+        self.write_config(config)
+
+        # Check it's there
+        conf = self.read_config(wait_for=config)
+
+        return self.read_conversion(conf)
+
+    def watch_gnd(self, x, lo, hi, rate=8, queue=2):
+        """Leaves the ADC converting AINx, ALERT/RDY asserted (low) while
+        above hi volts, released below lo. Any other read stops it."""
+        # pylint: disable=too-many-arguments
+        config = Config.comparator_gnd(x, rate, queue)
+        self.write_register(Register.LO_THRESH, config.to_code(lo))
+        self.write_register(Register.HI_THRESH, config.to_code(hi))
+        self.write_config(config)
+
+    def burst_read_gnd(self, x, samples, rate=860):
+        """Configures AINx once for continuous conversions at rate, and
+        returns the next `samples` conversions, in volts."""
+        config = Config.continuous_read_gnd(x, rate)
+        self.write_config(config)
+        try:
+            # Conversions land every period, the first one after
+            # the mux settled.
+            time.sleep(2 * config.delay())
+            readings = []
+            for _ in range(samples):
+                readings.append(self.read_conversion(config))
+                time.sleep(config.delay())
+            return readings
+        finally:
+            self.write_config(Config.power_down())
+
 
 if __name__ == "__main__":
     print("Test write for read-ain0 is %s\n", bin(Config.single_shot_read_gnd(0)))
@@ -0,0 +1,159 @@
+"""Shared SocketCAN buses.
+
+Our CAN nodes (see hw/canbus) answer remote requests on their id with
+a 2 bytes reading, and switch their output on PLANTS_CMD_SWITCH frames.
+
+Each bus has one non-blocking socket, served by an asyncio loop in its
+own thread: frames are demultiplexed by id to whoever waits for them,
+so a group can request readings from dozens of nodes at once and wait
+for all replies together. Callers from other threads use the blocking
+request() and send() wrappers.
+
+On Linux, a virtual bus is enough to try it out:
+
+    ip link add dev vcan0 type vcan && ip link set up vcan0"""
+
+import asyncio
+import socket
+import struct
+import threading
+
+# From plants.h
+PLANTS_ALL_SENSORS_ID = 0x01
+PLANTS_AUTOCONF_ID = 0x2A
+PLANTS_CMD_SWITCH = 0x12
+PLANTS_CMD_SWITCH_ON = 0x01
+PLANTS_CMD_SWITCH_OFF = 0x00
+
+# struct can_frame, from linux/can.h
+CAN_FRAME = struct.Struct("=IB3x8s")
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_SFF_MASK = 0x000007FF
+CAN_EFF_MASK = 0x1FFFFFFF
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+def pack(can_id, data=b"", rtr=False, length=None):
+    """can_frame bytes. Ids above 11 bits use the extended format."""
+    if can_id > CAN_SFF_MASK:
+        can_id |= CAN_EFF_FLAG
+    if rtr:
+        can_id |= CAN_RTR_FLAG
+    data = bytes(data)
+    return CAN_FRAME.pack(can_id, len(data) if length is None else length, data)
+
+
+def unpack(frame):
+    """(can id, data, rtr) from can_frame bytes, None for error frames"""
+    can_id, dlc, data = CAN_FRAME.unpack(frame[: CAN_FRAME.size])
+    if can_id & CAN_ERR_FLAG:
+        return None
+    rtr = bool(can_id & CAN_RTR_FLAG)
+    mask = CAN_EFF_MASK if can_id & CAN_EFF_FLAG else CAN_SFF_MASK
+    return can_id & mask, b"" if rtr else data[:dlc], rtr
+
+
+class Bus:
+    def __init__(self, channel, sock=None):
+        self.channel = channel
+        if sock is None:
+            # pylint: disable=no-member
+            sock = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+            sock.bind((channel,))
+        sock.setblocking(False)
+        self.sock = sock
+        # Owned by the loop thread:
+        self.waiters = {}  # (can id, data length) -> [futures]
+        self.listeners = []  # Called with (can id, data, rtr) for every frame
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self._run, name=f"can-{channel}", daemon=True
+        )
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.add_reader(self.sock, self._readable)
+        self.loop.run_forever()
+
+    def _readable(self):
+        while True:
+            try:
+                frame = unpack(self.sock.recv(CAN_FRAME.size))
+            except BlockingIOError:
+                return
+            if frame:
+                self.dispatch(*frame)
+
+    def dispatch(self, can_id, data, rtr):
+        if not rtr:
+            for fut in self.waiters.pop((can_id, len(data)), ()):
+                if not fut.done():
+                    fut.set_result(data)
+        for listener in self.listeners:
+            listener(can_id, data, rtr)
+
+    async def _send(self, frame):
+        await self.loop.sock_sendall(self.sock, frame)
+
+    async def _request(self, ids, length, timeout):
+        futures = {}
+        for can_id in ids:
+            fut = self.loop.create_future()
+            self.waiters.setdefault((can_id, length), []).append(fut)
+            futures[can_id] = fut
+            await self._send(pack(can_id, rtr=True, length=length))
+        if futures:
+            await asyncio.wait(futures.values(), timeout=timeout)
+        for can_id, fut in futures.items():
+            if not fut.done():
+                fut.cancel()
+                waiting = self.waiters.get((can_id, length), [])
+                if fut in waiting:
+                    waiting.remove(fut)
+        return dict(
+            (can_id, None if fut.cancelled() else fut.result())
+            for can_id, fut in futures.items()
+        )
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def request(self, ids, length=2, timeout=2.0):
+        """Sends remote requests to all ids, then waits up to timeout
+        for their replies of `length` bytes. Returns {id: data or None}."""
+        return self._call(self._request(list(ids), length, timeout))
+
+    def send(self, can_id, data=b"", rtr=False):
+        self._call(self._send(pack(can_id, data, rtr)))
+
+    def switch(self, can_id, on):
+        cmd = PLANTS_CMD_SWITCH_ON if on else PLANTS_CMD_SWITCH_OFF
+        self.send(can_id, [PLANTS_CMD_SWITCH, cmd])
+
+    def add_listener(self, listener):
+        self.loop.call_soon_threadsafe(self.listeners.append, listener)
+
+    def __repr__(self):
+        return f"can-{self.channel}"
+
+
+def open_bus(channel):
+    """Returns the shared Bus for that channel, opening it once."""
+    with _buses_lock:
+        if channel not in _buses:
+            _buses[channel] = Bus(channel)
+        return _buses[channel]
+
+
+def install(channel, sock):
+    """Serves channel from sock, anything behaving like a non-blocking
+    CAN_RAW socket (e.g. one end of a datagram socketpair), for drivers
+    opened from now on."""
+    with _buses_lock:
+        _buses[channel] = Bus(channel, sock)
+        return _buses[channel]
@@ -0,0 +1,62 @@
+"""Driver registries, importing drivers when first used.
+
+Sensor groups and pumps are looked up by the `kind` of their config.
+Built-in kinds name the module defining them, imported only when a
+config uses them: a garden of mock drivers doesn't load gpiozero, smbus
+or CAN support. Drivers out of tree are found through entry points,
+named after their kind, in the plants.sensors and plants.pumps groups:
+
+    setup(
+        entry_points={"plants.pumps": ["relay = my_relay:RelayPump"]},
+        ...
+    )
+"""
+
+import importlib
+
+
+class Registry:
+    """{kind: driver class}, loading drivers on lookup"""
+
+    def __init__(self, group, builtin):
+        """builtin is {kind: "module:class"}"""
+        self.group = group
+        self.builtin = builtin
+        self.loaded = {}
+
+    def __getitem__(self, kind):
+        if kind not in self.loaded:
+            self.loaded[kind] = self.load(kind)
+        return self.loaded[kind]
+
+    def __setitem__(self, kind, cls):
+        self.loaded[kind] = cls
+
+    def __contains__(self, kind):
+        if kind in self.builtin or kind in self.loaded:
+            return True
+        return any(e.name == kind for e in self.entry_points())
+
+    def entry_points(self):
+        # Scanning installed packages is slow, only done when needed.
+        # pylint: disable=import-outside-toplevel
+        import importlib.metadata
+
+        return importlib.metadata.entry_points(group=self.group)
+
+    def load(self, kind):
+        """The driver class of a kind, raising KeyError if unknown"""
+        if kind in self.builtin:
+            module, name = self.builtin[kind].split(":")
+            return getattr(importlib.import_module(module), name)
+        for entry_point in self.entry_points():
+            if entry_point.name == kind:
+                return entry_point.load()
+        raise KeyError(kind)
+
+    def kinds(self):
+        return (
+            set(self.builtin)
+            | set(self.loaded)
+            | set(e.name for e in self.entry_points())
+        )
@@ -0,0 +1,237 @@
+"""Register level emulation of our i2c devices.
+
+EmulatedBus stands in for smbus.SMBus, with per transaction latency and
+random faults (raised as the EREMOTEIO errors smbus gives on NACKs).
+ADS1115 and Chirp emulate the registers our drivers use, including
+conversion delays, so drivers run unchanged:
+
+    bus = EmulatedBus(latency=0.0002, fault_rate=0.01)
+    bus.attach(72, ADS1115({0: 1.7, 1: lambda: random.uniform(1, 2)}))
+    i2c.install(1, bus)
+
+Running this module benchmarks the drivers against it."""
+
+import argparse
+import contextlib
+import errno
+import io
+import random
+import time
+
+from plants.hw import ads1115
+from plants.hw.sensors import chirp
+
+
+def _word(value):
+    return [(value >> 8) & 0xFF, value & 0xFF]
+
+
+class EmulatedBus:
+    def __init__(self, latency=0, fault_rate=0, seed=None):
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.random = random.Random(seed)
+        self.devices = {}
+        self.transactions = 0
+        self.faults = 0
+
+    def attach(self, address, device):
+        self.devices[address] = device
+        return device
+
+    def _device(self, address):
+        self.transactions += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if address not in self.devices or (
+            self.fault_rate and self.random.random() < self.fault_rate
+        ):
+            self.faults += 1
+            raise OSError(errno.EREMOTEIO, "Remote I/O error")
+        return self.devices[address]
+
+    def read_i2c_block_data(self, address, register, length):
+        return self._device(address).read(register, length)
+
+    def write_i2c_block_data(self, address, register, data):
+        self._device(address).write(register, list(data))
+
+
+class ADS1115:
+    """Single-shot and continuous conversions of AINx against GND,
+    taking one data rate period each, and the traditional comparator.
+    Inputs are volts, or callables returning volts, by AIN port."""
+
+    def __init__(self, inputs=None):
+        self.inputs = dict(inputs or {})
+        self.config = 0x8583  # Power-up default
+        self.lo_thresh = 0x8000
+        self.hi_thresh = 0x7FFF
+        self.conversion = 0
+        self.started = 0  # Start of the conversions in progress
+        self.alert = False
+        self.above = 0  # Consecutive conversions above hi_thresh
+
+    def volts(self, port):
+        v = self.inputs.get(port, 0)
+        return v() if callable(v) else v
+
+    def _conf(self):
+        return ads1115.Config(self.config)
+
+    def _convert(self):
+        mux = (self.config >> ads1115.Config.MUX) & 0b111
+        volts = self.volts(mux & 0b11) if mux & 0b100 else 0
+        code = self._conf().to_code(volts)
+        self.conversion = code
+        signed = code - 0x10000 if code & 0x8000 else code
+        self._compare(signed)
+
+    def _compare(self, code):
+        queue = (self.config >> ads1115.Config.COMP_QUEUE) & 0b11
+        if queue == 0b11:
+            return
+        lo = self.lo_thresh - 0x10000 if self.lo_thresh & 0x8000 else self.lo_thresh
+        hi = self.hi_thresh - 0x10000 if self.hi_thresh & 0x8000 else self.hi_thresh
+        self.above = self.above + 1 if code > hi else 0
+        if self.above >= (1, 2, 4)[queue]:
+            self.alert = True
+        elif code < lo:
+            self.alert = False
+
+    def _update(self):
+        """Completes conversions due by now"""
+        conf = self._conf()
+        single = (self.config >> conf.MODE) & 1
+        if single and self.started is None:
+            return
+        periods = int((time.monotonic() - self.started) / conf.delay())
+        if periods < 1:
+            return
+        if single:
+            self._convert()
+            self.started = None
+            self.config |= 1 << conf.OS
+        else:
+            for _ in range(min(periods, 4)):
+                self._convert()
+            self.started += periods * conf.delay()
+
+    def write(self, register, data):
+        value = (data[0] << 8) | data[1]
+        if register == ads1115.Register.CONFIG:
+            self.config = value
+            single = (value >> ads1115.Config.MODE) & 1
+            if not single or (value >> ads1115.Config.OS) & 1:
+                # Converting: OS reads 0 until done.
+                self.config &= ~(1 << ads1115.Config.OS)
+                self.started = time.monotonic()
+            else:
+                self.started = None
+            self.above = 0
+        elif register == ads1115.Register.LO_THRESH:
+            self.lo_thresh = value
+        elif register == ads1115.Register.HI_THRESH:
+            self.hi_thresh = value
+
+    def read(self, register, length):
+        self._update()
+        value = {
+            ads1115.Register.CONVERSION: self.conversion,
+            ads1115.Register.CONFIG: self.config,
+            ads1115.Register.LO_THRESH: self.lo_thresh,
+            ads1115.Register.HI_THRESH: self.hi_thresh,
+        }[register]
+        return _word(value)[:length]
+
+
+class Chirp:
+    """Capacitance and temperature reads, and light measurements that
+    keep GET_BUSY set for measure_time seconds: GET_LIGHT returns the
+    previous measurement until then."""
+
+    def __init__(self, capacitance=400, temperature=21.5, light=1000, address=0x20):
+        # pylint: disable=too-many-arguments
+        self.capacitance = capacitance
+        self.temperature = temperature
+        self.light = light
+        self.address = address
+        self.measure_time = 0.5
+        self.busy_until = 0
+        self.light_reading = 0xFFFF
+        self.measuring = None
+
+    def _value(self, v):
+        return v() if callable(v) else v
+
+    def busy(self):
+        return time.monotonic() < self.busy_until
+
+    def write(self, register, data):
+        if register == chirp.Register.MEASURE_LIGHT:
+            self.busy_until = time.monotonic() + self.measure_time
+            self.measuring = int(self._value(self.light))
+        elif register == chirp.Register.SET_ADDRESS and data:
+            self.address = data[0]
+        elif register == chirp.Register.RESET:
+            self.busy_until = 0
+
+    def read(self, register, length):
+        if self.measuring is not None and not self.busy():
+            self.light_reading, self.measuring = self.measuring, None
+        reg = chirp.Register
+        value = {
+            reg.GET_CAPACITANCE: lambda: _word(int(self._value(self.capacitance))),
+            reg.GET_TEMPERATURE: lambda: _word(int(self._value(self.temperature) * 10)),
+            reg.GET_LIGHT: lambda: _word(self.light_reading),
+            reg.GET_ADDRESS: lambda: [self.address],
+            reg.GET_VERSION: lambda: [0x26],
+            reg.GET_BUSY: lambda: [int(self.busy())],
+        }[register]()
+        return value[:length]
+
+
+def benchmark(seconds=1.0, latency=0.0, fault_rate=0.0, samples=16):
+    """Runs drivers against emulated devices, returns reads/s and
+    failures per driver path."""
+    # pylint: disable=import-outside-toplevel
+    from plants.hw import i2c
+
+    bus = EmulatedBus(latency=latency, fault_rate=fault_rate, seed=1)
+    bus.attach(72, ADS1115({0: 1.7, 1: 2.1, 2: 2.5, 3: 0.9}))
+    bus.attach(0x20, Chirp())
+    i2c.install(99, bus)
+    adc = ads1115.ADC(99, 72)
+    group = chirp.SensorGroup({"i2c_bus": 99, "i2c_address": 0x20})
+    paths = {
+        "ads1115_single_shot": lambda: adc.single_shot_read_gnd(0),
+        "ads1115_burst": lambda: adc.burst_read_gnd(1, samples, 860),
+        # Chirp sensors log and return None on errors
+        "chirp_poll": lambda: group.poll()["moisture"][group.name],
+    }
+    results = {}
+    for name, read in paths.items():
+        reads = failures = 0
+        end = time.monotonic() + seconds
+        with contextlib.redirect_stdout(io.StringIO()):
+            while time.monotonic() < end:
+                try:
+                    if read() is None:
+                        failures += 1
+                    else:
+                        reads += 1
+                except Exception:  # pylint: disable=broad-exception-caught
+                    failures += 1
+        results[name] = {"reads_per_second": reads / seconds, "failures": failures}
+    results["bus"] = {"transactions": bus.transactions, "faults": bus.faults}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=benchmark.__doc__)
+    parser.add_argument("--seconds", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fault-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    for path, result in benchmark(args.seconds, args.latency, args.fault_rate).items():
+        print(path, result)
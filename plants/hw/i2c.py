@@ -0,0 +1,64 @@
+"""Shared i2c buses.
+
+Sensor groups are polled from several threads. Devices on the same bus
+share one handle, and transactions are serialized per bus, not
+globally. Groups sharing a device (e.g. two sensor groups switched in
+front of the same ADS1115) also serialize on a per-device lock, held for
+their whole power-up and read window."""
+
+import threading
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+
+class Bus:
+    def __init__(self, bus_id, impl=None):
+        self.bus_id = bus_id
+        if impl is None:
+            # Emulated buses don't need it
+            # pylint: disable=import-outside-toplevel
+            import smbus
+
+            impl = smbus.SMBus(bus_id)
+        self.smbus = impl
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.users = {}
+
+    def device_lock(self, address):
+        """Lock for a device, counting how many users share it"""
+        with self.lock:
+            self.users[address] = self.users.get(address, 0) + 1
+            return self.devices.setdefault(address, threading.RLock())
+
+    def release(self, address):
+        with self.lock:
+            self.users[address] -= 1
+
+    def read_i2c_block_data(self, address, register, length):
+        with self.lock:
+            return self.smbus.read_i2c_block_data(address, register, length)
+
+    def write_i2c_block_data(self, address, register, data):
+        with self.lock:
+            return self.smbus.write_i2c_block_data(address, register, data)
+
+    def __repr__(self):
+        return f"i2c-{self.bus_id}"
+
+
+def open_bus(bus_id):
+    """Returns the shared Bus for that id, opening it once."""
+    with _buses_lock:
+        if bus_id not in _buses:
+            _buses[bus_id] = Bus(bus_id)
+        return _buses[bus_id]
+
+
+def install(bus_id, impl):
+    """Serves bus_id from impl, anything with the SMBus block data
+    methods (e.g. an emulator), for drivers opened from now on."""
+    with _buses_lock:
+        _buses[bus_id] = Bus(bus_id, impl)
+        return _buses[bus_id]
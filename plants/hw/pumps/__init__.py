@@ -1,70 +1,111 @@
+import collections
 import dataclasses
-import time
 
 import sqlite3
-from gpiozero import LED
-from prometheus_client import Counter
+from plants import config, history, timings
+from plants.clock import Clock
+from plants.hw import drivers
 
-from plants import config, history
-
-pump_seconds = Counter("plants_pump_seconds", "Seconds of pump activation", ["pump_id"])
-
-registry = {}
+registry = drivers.Registry(
+    "plants.pumps",
+    {
+        "gpio": "plants.hw.pumps.gpio:GPIOPump",
+        "can": "plants.hw.pumps.can:CANPump",
+        "mock-gpio": "plants.hw.pumps:MockGPIOPump",
+    },
+)
 
 
 @dataclasses.dataclass
 class Pump:
     name: str
-    config: config.Config
+    config: config.PumpConfig
+    is_on: bool
     usage: dict
 
-    def __init__(self, name, config, history_manager):
+    def __init__(self, name, config, history_manager, actuator=None):
         self.name = name
         self.config = config
         self.history = history_manager.history_for(self)
+        self.clock = history_manager.clock
+        self.actuator = actuator
+        self.is_on = False
+        self.inhibitions = 0
+        self.seconds = 0  # Total activation
+        self.switched = []  # Callbacks on transitions: (pump, on)
+
+    # Options choosing the device, which a new config can't change
+    # in place
+    hardware_options = ()
 
     def __repr__(self):
         return f"pump@{self.name}"
 
+    def reconfigure(self, conf):
+        """Takes a new config if it drives the same device"""
+        if conf.kind != self.config.kind or any(
+            conf.options.get(k) != self.config.options.get(k)
+            for k in self.hardware_options
+        ):
+            return False
+        self.config = conf
+        return True
+
+    def close(self):
+        """Releases hardware, when a config reload drops the pump"""
+
     @property
     def usage(self):
         return dict(
-            (x["per_interval"], self.history.total_up_to(x["per_interval"]))
+            (x.per_interval, self.history.total_up_to(x.per_interval))
             for x in self.limits
         )
 
     @property
     def limits(self):
-        return self.config.get("limits", [{"per_interval": 86400, "duration": 60}])
+        return self.config.limits
+
+    @property
+    def power(self):
+        """Watts drawn while on, accounted against the actuator budget"""
+        return self.config.power
 
     @property
     def activation_thresholds(self):
-        return dict((c.name, c.value) for c in self.config["activation_thresholds"])
+        return self.config.activation_thresholds
 
     def _do_water(self, duration):
-        print(f"Pump {self} on for {duration}")
-        self.history.add(duration)
+        print(f"Watering {self} for {duration}")
         # Cleanup history that doesn't matter anymore
-        max_window = max(x["per_interval"] for x in self.limits)
+        max_window = max(x.per_interval for x in self.limits)
         self.history.forget_up_to(max_window)
 
-        pump_seconds.labels(self.name).inc(duration)
-        self.on()
-        time.sleep(duration)
-        self.off()
-        print(f"Pump {self} off")
+        if self.actuator:
+            # Charged once it switches on
+            self.actuator.start(self, duration)
+            return
+        # No actuator to schedule us, block for the duration.
+        self.charge(duration)
+        self.switch(True)
+        self.clock.sleep(duration)
+        self.switch(False)
 
     def water(self, duration=None, force=False, dry_run=False):
+        if self.actuator and self.actuator.busy(self):
+            print(f"{self} is already watering")
+            return False
         if not duration:
-            duration = self.config["duration"]
+            duration = self.config.duration
         allowed = duration
 
         # Check if we're above limits
         for limit in self.limits:
-            total_sofar = self.history.total_up_to(limit["per_interval"])
-            allowed = min(allowed, limit["duration"] - total_sofar)
+            total_sofar = self.history.total_up_to(limit.per_interval)
+            allowed = min(allowed, limit.duration - total_sofar)
             if not force and allowed <= 0:
                 print(f"Inhibiting {self}, reached {limit}")
+                if not dry_run:
+                    self.inhibitions += 1
                 return False
 
         # Water for duration
@@ -72,9 +113,30 @@ class Pump:
             if force:
                 allowed = duration
                 print(f"{self} watering forced")
-            self._do_water(allowed)
+            with timings.span("pump_water", self.name):
+                self._do_water(allowed)
         return True
 
+    def charge(self, seconds, ts=None):
+        """Accounts for seconds of watering started at ts (now by
+        default), negative to refund what didn't run. Returns ts."""
+        if ts is None:
+            ts = self.clock.time()
+        self.history.add(seconds, ts)
+        self.seconds += seconds
+        return ts
+
+    def switch(self, on):
+        with timings.span("pump_switch", self.name):
+            if on:
+                self.on()
+            else:
+                self.off()
+        self.is_on = on
+        print(f"Pump {self} {'on' if on else 'off'}")
+        for switched in self.switched:
+            switched(self, on)
+
     def on(self):
         raise NotImplementedError
 
@@ -82,24 +144,87 @@ class Pump:
         raise NotImplementedError
 
 
-class GPIOPump(Pump):
-    def __init__(self, name, config, history_manager):
-        super().__init__(name, config, history_manager)
-        self.gpio = LED(config["port"])
+class Actuator:
+    """Runs pumps without blocking the caller.
 
-    # def __del__(self):
-    #    """Gpiozero takes care of cleaning up the GPIO state,
-    #    turning them into inputs, so this isn't required here"""
-    #    self.off()
+    start() switches a pump on, or queues it while we're over budget,
+    and run_due() switches pumps off once their time is up, starting
+    queued ones in order. Pumps are charged their duration when they
+    switch on, and refunded what didn't run if stopped early.
+    Concurrency is capped by max_running and, if pumps declare their
+    `power`, by power_budget (in watts). A single pump above budget
+    still runs, alone."""
 
-    def on(self):
-        self.gpio.on()
+    def __init__(self, max_running=1, power_budget=None, clock=None):
+        self.clock = clock or Clock()
+        self.max_running = max_running
+        self.power_budget = power_budget
+        self.running = {}  # name -> (pump, off time, charged at)
+        self.waiting = collections.deque()  # (pump, duration)
 
-    def off(self):
-        self.gpio.off()
+    def busy(self, pump):
+        return pump.name in self.running or any(
+            p.name == pump.name for p, _ in self.waiting
+        )
 
+    def fits(self, pump):
+        if not self.running:
+            return True
+        if self.max_running and len(self.running) >= self.max_running:
+            return False
+        if self.power_budget is not None:
+            used = sum(p.power for p, _, _ in self.running.values())
+            return used + pump.power <= self.power_budget
+        return True
 
-registry["gpio"] = GPIOPump
+    def start(self, pump, duration, now=None):
+        self.waiting.append((pump, duration))
+        self.run_due(now)
+
+    def run_due(self, now=None):
+        """Apply on/off transitions that are due. Returns the time
+        of the next one, or None if no pump is running."""
+        if now is None:
+            now = self.clock.monotonic()
+        for name, (pump, off_at, _) in list(self.running.items()):
+            if off_at <= now:
+                pump.switch(False)
+                del self.running[name]
+        while self.waiting and self.fits(self.waiting[0][0]):
+            pump, duration = self.waiting.popleft()
+            pump.switch(True)
+            self.running[pump.name] = (pump, now + duration, pump.charge(duration))
+        return self.next_deadline()
+
+    def next_deadline(self):
+        if self.running:
+            return min(off_at for _, off_at, _ in self.running.values())
+        return None
+
+    def stop(self, pump, now=None):
+        """Switches a pump off, or drops it if waiting"""
+        if now is None:
+            now = self.clock.monotonic()
+        self.waiting = collections.deque(
+            (p, d) for p, d in self.waiting if p.name != pump.name
+        )
+        if pump.name in self.running:
+            self._switch_off(pump.name, now)
+        self.run_due(now)
+
+    def all_off(self, now=None):
+        if now is None:
+            now = self.clock.monotonic()
+        self.waiting.clear()
+        for name in list(self.running):
+            self._switch_off(name, now)
+
+    def _switch_off(self, name, now):
+        """Switches a running pump off early, refunding the rest"""
+        pump, off_at, charged_at = self.running.pop(name)
+        pump.switch(False)
+        if off_at > now:
+            pump.charge(now - off_at, charged_at)
 
 
 class MockGPIOPump(Pump):
@@ -108,6 +233,3 @@ class MockGPIOPump(Pump):
 
     def off(self):
         pass
-
-
-registry["mock-gpio"] = MockGPIOPump
@@ -0,0 +1,19 @@
+from plants.hw import can
+from plants.hw.pumps import Pump
+
+
+class CANPump(Pump):
+    """Output switch of a CAN node (see hw/canbus)"""
+
+    hardware_options = ("channel", "node")
+
+    def __init__(self, name, config, history_manager, actuator=None):
+        super().__init__(name, config, history_manager, actuator)
+        self.node = config.options["node"]
+        self.bus = can.open_bus(config.options.get("channel", "can0"))
+
+    def on(self):
+        self.bus.switch(self.node, True)
+
+    def off(self):
+        self.bus.switch(self.node, False)
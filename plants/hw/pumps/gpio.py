@@ -0,0 +1,25 @@
+from gpiozero import LED
+
+from plants.hw.pumps import Pump
+
+
+class GPIOPump(Pump):
+    hardware_options = ("port",)
+
+    def __init__(self, name, config, history_manager, actuator=None):
+        super().__init__(name, config, history_manager, actuator)
+        self.gpio = LED(config.options["port"])
+
+    # def __del__(self):
+    #    """Gpiozero takes care of cleaning up the GPIO state,
+    #    turning them into inputs, so this isn't required here"""
+    #    self.off()
+
+    def on(self):
+        self.gpio.on()
+
+    def off(self):
+        self.gpio.off()
+
+    def close(self):
+        self.gpio.close()
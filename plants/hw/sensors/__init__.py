@@ -1,11 +1,52 @@
-__all__ = ["ads1115", "chirp"]
+from plants import timings
+from plants.clock import Clock
+from plants.hw import drivers
 
-registry = {}
+registry = drivers.Registry(
+    "plants.sensors",
+    {
+        "ads1115": "plants.hw.sensors.ads1115:SensorGroup",
+        "mock-ads1115": "plants.hw.sensors.ads1115:MockSensorGroup",
+        "chirp": "plants.hw.sensors.chirp:SensorGroup",
+        "can": "plants.hw.sensors.can:SensorGroup",
+    },
+)
 
 
 class SensorGroup:
+    # Groups able to wake the gardener up on their own, when readings
+    # cross pump thresholds, are only polled this often otherwise.
+    alert_poll_interval = None
+    # Waits (e.g. sensors warm-up) go through the gardener's clock.
+    clock = Clock()
+
+    def arm(self, thresholds, wakeup):
+        """Gives the group {sensor: (threshold, hysteresis)} moisture
+        thresholds, and a wakeup() callback to request a poll when
+        crossed. Most groups can't and ignore this."""
+
+    def close(self):
+        """Releases hardware, when a config reload drops the group"""
+
     def poll(self):
+        """Returns readings by kind then sensor name. Sensors with a
+        raw_kind also report the raw value behind their reading."""
         ret = dict((x.kind, {}) for x in self.sensors)
         for s in self.sensors:
-            ret[s.kind].update({s.name: s.read(self)})
+            with timings.span("sensor_read", s.name):
+                value = s.read(self)
+            ret[s.kind].update({s.name: value})
+            if getattr(s, "raw_kind", None):
+                raw = s.raw_value if value is not None else None
+                ret.setdefault(s.raw_kind, {}).update({s.name: raw})
+        return ret
+
+    def unread(self):
+        """What poll() returns when no sensor could be read: None for
+        each, so their previous readings don't look current."""
+        ret = {}
+        for s in self.sensors:
+            ret.setdefault(s.kind, {})[s.name] = None
+            if getattr(s, "raw_kind", None):
+                ret.setdefault(s.raw_kind, {})[s.name] = None
         return ret
@@ -1,16 +1,21 @@
 from dataclasses import dataclass
+import statistics
+import threading
 import time
 
-from prometheus_client import Gauge
-from gpiozero import LED
-
-from plants import config
+from plants import config, timings
 from plants.hw import ads1115
 from plants.hw import sensors
 
-metric_moisture_volts = Gauge(
-    "plants_ads1115_sensor_volts", "Moisture per sensor volts", ["sensor_id"]
-)
+
+def trimmed_mean(values, trim=0.2):
+    """Mean without the lowest and highest `trim` fraction"""
+    values = sorted(values)
+    k = int(len(values) * trim)
+    return statistics.fmean(values[k : len(values) - k] or values)
+
+
+aggregates = {"median": statistics.median, "trimmed_mean": trimmed_mean}
 
 
 # We abuse dataclass along this project to provide somewhat
@@ -23,14 +28,18 @@ class Sensor:
     cur_v: float
     min_v: float
     max_v: float
+    noise_v: float
     moisture_ratio: float
 
+    raw_kind = "volts"
+
     def __init__(self, name, config):
         print(f"Initializing sensor {name}")
         self.kind = "moisture"
         self.name = name
         self.config = config
         self.cur_v = None
+        self.noise_v = None
         self.min_v = config["voltage_wet"]
         self.max_v = config["voltage_dry"]
         self.port = config["port"]
@@ -40,12 +49,22 @@ class Sensor:
         if self.cur_v:
             return (self.max_v - self.cur_v) / (self.max_v - self.min_v)
 
+    @property
+    def raw_value(self):
+        return self.cur_v
+
     def read(self, group):
         """Reads ADC. Returns moisture (as fraction), or None if
         exception"""
         try:
-            self.cur_v = group.adc.single_shot_read_gnd(self.port)
-            metric_moisture_volts.labels(self.name).set(self.cur_v)
+            if group.samples > 1:
+                readings = group.adc.burst_read_gnd(
+                    self.port, group.samples, group.data_rate
+                )
+                self.cur_v = group.aggregate(readings)
+                self.noise_v = statistics.pstdev(readings)
+            else:
+                self.cur_v = group.adc.single_shot_read_gnd(self.port)
             # Moisture is wet ratio (1=wet)
             return (self.max_v - self.cur_v) / (self.max_v - self.min_v)
         except Exception as e:
@@ -59,29 +78,126 @@ sensor_cls = {"moisture": Sensor}
 @dataclass
 class SensorGroup(sensors.SensorGroup):
     sensors: list[Sensor]
+    stats: dict
 
     def __init__(self, config):
-        self.adc = ads1115.ADC(config.get("smbus", 1), config.get("i2c_address", 72))
-        self.port = None
-        if config.get("enable_port"):
-            self.port = LED(config["enable_port"])
+        self.setup_acquisition(config)
+        self.warmup_duration = config.get("warmup_duration", 1)
         self.sensors = []
         for sensor in config["sensors"]:
             self.sensors.append(
                 sensor_cls[sensor.get("type", "moisture")](sensor.name, sensor.value)
             )
-
-    def poll(self):
+        self.setup_comparator(config.get("comparator"))
+        # Hardware last, once the config is known to be valid
+        self.adc = ads1115.ADC(config.get("smbus", 1), config.get("i2c_address", 72))
+        self.port = None
+        if config.get("enable_port"):
+            # Not imported by mock groups, which may run without it
+            # pylint: disable=import-outside-toplevel
+            from gpiozero import LED
+
+            try:
+                self.port = LED(config["enable_port"])
+            except Exception:
+                self.adc.close()
+                raise
+
+    def setup_acquisition(self, conf):
+        """With `samples` above 1, each sensor read is a burst of that
+        many continuous conversions at `data_rate`, reduced with
+        `aggregate` (median or trimmed_mean)."""
+        self.samples = conf.get("samples", 1)
+        self.data_rate = conf.get("data_rate", 860)
+        if self.data_rate not in ads1115.Config.dr_to_rate.values():
+            raise config.Error(f"Unsupported ADS1115 data_rate {self.data_rate}")
+        try:
+            self.aggregate = aggregates[conf.get("aggregate", "median")]
+        except KeyError as exc:
+            raise config.Error(f"Unknown aggregate, use one of {aggregates}") from exc
+        self.stats = {}
+
+    def setup_comparator(self, conf):
+        """With a comparator section, the ADC watches one sensor between
+        polls and pulls alert_port low once it gets dry for a pump: the
+        group is then polled right away, and otherwise only every
+        comparator poll_interval. Its sensors stay powered, so the ADC
+        can't be shared with another group."""
+        self.comparator = conf
+        self.watched = None
+        self.alert = None
+        if not conf:
+            return
+        self.alert_poll_interval = conf.get("poll_interval", 3600)
+        sensor = [s for s in self.sensors if s.name == conf.get("sensor")]
+        if not sensor or "alert_port" not in conf:
+            raise config.Error("ADS1115 comparator needs a group sensor and alert_port")
+
+    def arm(self, thresholds, wakeup):
+        if not self.comparator:
+            return
+        if self.adc.bus.users[self.adc.address] > 1:
+            raise config.Error(f"ADS1115 comparator needs its own ADC, {self.adc}")
+        sensor = [s for s in self.sensors if s.name == self.comparator["sensor"]][0]
+        if sensor.name not in thresholds:
+            print(f"No pump threshold for {sensor.name}, comparator unused")
+            return
+        threshold, hysteresis = thresholds[sensor.name]
+        span = sensor.max_v - sensor.min_v
+        # Moisture falls as volts rise: dry is above hi.
+        self.watched = (
+            sensor.port,
+            sensor.max_v - min(1, threshold + hysteresis) * span,
+            sensor.max_v - threshold * span,
+        )
+        if self.alert is None:
+            # pylint: disable=import-outside-toplevel
+            from gpiozero import DigitalInputDevice
+
+            self.alert = DigitalInputDevice(self.comparator["alert_port"], pull_up=True)
+        self.alert.when_activated = wakeup
+        self.watch()
+
+    def close(self):
+        self.adc.close()
+        for device in (self.port, self.alert):
+            if device:
+                device.close()
+
+    def watch(self):
+        port, lo, hi = self.watched
         if self.port:
             self.port.on()
-            time.sleep(1)
-        ret = super().poll()
-        if self.port:
-            self.port.off()
-        return ret
-
+        self.adc.watch_gnd(
+            port,
+            lo,
+            hi,
+            self.comparator.get("data_rate", 8),
+            self.comparator.get("queue", 2),
+        )
 
-sensors.registry["ads1115"] = SensorGroup
+    def poll(self):
+        # Groups can share an ADC, switching their sensors in front of it
+        # with enable_port: only one of them may be powered at a time.
+        with self.adc.lock:
+            if self.port:
+                self.port.on()
+                with timings.span("group_warmup"):
+                    self.clock.sleep(self.warmup_duration)
+            start = time.perf_counter()
+            ret = super().poll()
+            latency = time.perf_counter() - start
+            if self.watched:
+                self.watch()
+            elif self.port:
+                self.port.off()
+        conversions = self.samples * len(self.sensors)
+        self.stats = {
+            "read_seconds": latency,
+            "conversions_per_second": conversions / latency if latency else None,
+            "noise_v": dict((s.name, s.noise_v) for s in self.sensors),
+        }
+        return ret
 
 
 class MockGPIO:
@@ -91,21 +207,34 @@ class MockGPIO:
     def off(self):
         pass
 
+    def close(self):
+        pass
+
 
 class MockAdc:
+    def __init__(self):
+        self.lock = threading.Lock()
+
     def single_shot_read_gnd(self, port):
         return 1.7 + port / 5
 
+    def burst_read_gnd(self, port, samples, rate=860):
+        # pylint: disable=unused-argument
+        return [self.single_shot_read_gnd(port)] * samples
+
+    def close(self):
+        pass
+
 
 class MockSensorGroup(SensorGroup):
     """Same with no GPIO or ADC"""
 
     def __init__(self, config):
+        self.setup_acquisition(config)
+        self.setup_comparator(None)
+        self.warmup_duration = config.get("warmup_duration", 1)
         self.sensors = []
         self.port = MockGPIO()
         self.adc = MockAdc()
         for sensor in config["sensors"]:
             self.sensors.append(Sensor(sensor.name, sensor.value))
-
-
-sensors.registry["mock-ads1115"] = MockSensorGroup
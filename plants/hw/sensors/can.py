@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+
+from plants import config
+from plants.hw import can, sensors
+
+
+@dataclass
+class Sensor:
+    config: config.Config
+    kind: str
+    name: str
+    node: int
+    cur_v: int
+    min_v: int
+    max_v: int
+
+    raw_kind = "adc"
+
+    def __init__(self, name, conf):
+        if "node" not in conf:
+            raise config.Error(f"CAN sensor {name} needs a node id")
+        self.kind = "moisture"
+        self.name = name
+        self.config = conf
+        self.node = conf["node"]
+        self.cur_v = None
+        # Nodes read their sensor against Vcc, on 10 bits.
+        self.min_v = conf.get("value_wet", 0)
+        self.max_v = conf.get("value_dry", 1023)
+
+    def read(self, group):
+        data = group.replies.get(self.node)
+        if data is None:
+            print(f"No reply from {self} on {group.bus}")
+            self.cur_v = None
+            return None
+        self.cur_v = int.from_bytes(data, byteorder="little")
+        return (self.max_v - self.cur_v) / (self.max_v - self.min_v)
+
+    @property
+    def raw_value(self):
+        return self.cur_v
+
+    def __repr__(self):
+        return f"{self.name}@{self.node:#x}"
+
+
+@dataclass
+class SensorGroup(sensors.SensorGroup):
+    """Nodes on one CAN channel. A poll requests all their readings at
+    once and waits for them together: nodes take about half a second to
+    power and read their sensor. With autoconf, nodes join the group as
+    they're enrolled (see plants.autoconf)."""
+
+    sensors: list[Sensor]
+
+    def __init__(self, config):
+        self.channel = config.get("channel", "can0")
+        self.timeout = config.get("timeout", 2)
+        self.autoconf = config.get("autoconf", False)
+        self.sensors = [Sensor(s.name, s.value) for s in config.get("sensors", ())]
+        self.bus = can.open_bus(self.channel)
+        self.replies = {}
+
+    def __repr__(self):
+        return f"can@{self.channel}"
+
+    def add_node(self, node, name):
+        if any(s.node == node for s in self.sensors):
+            return None
+        sensor = Sensor(name, config.Config({"node": node}))
+        # Polls in other threads iterate over sensors: swap the list.
+        self.sensors = self.sensors + [sensor]
+        return sensor
+
+    def poll(self):
+        self.replies = self.bus.request(
+            [s.node for s in self.sensors], length=2, timeout=self.timeout
+        )
+        return super().poll()
@@ -1,18 +1,7 @@
 from dataclasses import dataclass
-import time
-
-import smbus
-from prometheus_client import Gauge
 
 from plants import config
-from plants.hw import sensors
-
-metric_moisture_cap = Gauge(
-    "plants_chirp_sensor_capacitance", "Capacitance value", ["sensor_id"]
-)
-metric_temperature = Gauge(
-    "plants_chirp_sensor_temperature", "Temperature in Celsius", ["sensor_id"]
-)
+from plants.hw import i2c, sensors
 
 
 class Register:
@@ -29,7 +18,7 @@ class Register:
 
 
 class Sensor:
-    pass
+    raw_kind = None
 
 
 @dataclass
@@ -41,6 +30,8 @@ class MoistureSensor(Sensor):
     max_c: int
     min_c: int
 
+    raw_kind = "capacitance"
+
     def __init__(self, name, config):
         self.kind = "moisture"
         self.config = config
@@ -57,11 +48,14 @@ class MoistureSensor(Sensor):
                 ),
                 byteorder="big",
             )
-            metric_moisture_cap.labels(self.name).set(self.cur_c)
             return (self.cur_c - self.min_c) / (self.max_c - self.min_c)
         except Exception as e:
             print(f"Caught {e} reading c from {self}")
 
+    @property
+    def raw_value(self):
+        return self.cur_c
+
 
 @dataclass
 class TemperatureSensor(Sensor):
@@ -87,7 +81,6 @@ class TemperatureSensor(Sensor):
                 )
                 / 10.0
             )
-            metric_temperature.labels(self.name).set(self.temp)
             return self.temp
         except Exception as e:
             print(f"Caught {e} reading temp from {self}")
@@ -101,7 +94,8 @@ class SensorGroup(sensors.SensorGroup):
         self.address = config.get("i2c_address", 0x20)
         bus = config.get("i2c_bus", 1)
         self.name = config.get("name", f"chirp@{bus}:{self.address}")
-        self.bus = smbus.SMBus(bus)
+        self.bus = i2c.open_bus(bus)
+        self.lock = self.bus.device_lock(self.address)
         self.sensors = [
             TemperatureSensor(f"temp-{self.name}", config),
             MoistureSensor(self.name, config),
@@ -110,5 +104,9 @@ class SensorGroup(sensors.SensorGroup):
     def __repr__(self):
         return self.name
 
+    def close(self):
+        self.bus.release(self.address)
 
-sensors.registry["chirp"] = SensorGroup
+    def poll(self):
+        with self.lock:
+            return super().poll()
@@ -0,0 +1,240 @@
+"""Prometheus metrics, built when scraped.
+
+The gardener thread publishes an immutable Snapshot after each loop
+step, and the Collector turns the latest one into metric families when
+/metrics is scraped. Polls and drivers don't touch metrics, and a
+scrape always shows a consistent state.
+
+Snapshots also carry the API summary, encoded once: sensor groups and
+predictions only when they were polled, pumps and queue on each step.
+Requests to / are served these bytes, without reaching the gardener."""
+
+import dataclasses
+import hashlib
+import json
+
+from plants import config, timings
+
+# Metric name and help for readings, by kind
+READINGS = {
+    "moisture": [("plants_moisture_ratio", "Moisture per sensor ([0..1])")],
+    "temperature": [
+        ("plants_temp_celsius", "Temperature"),
+        # Temperatures only came from chirps, dashboards may use this.
+        ("plants_chirp_sensor_temperature", "Temperature in Celsius"),
+    ],
+    "volts": [("plants_ads1115_sensor_volts", "Moisture per sensor volts")],
+    "capacitance": [("plants_chirp_sensor_capacitance", "Capacitance value")],
+    "adc": [("plants_can_sensor_value", "Raw 10 bits ADC reading of CAN nodes")],
+}
+
+
+def to_json(o):
+    """json.dumps default, dataclasses are dicts of their fields"""
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    raise TypeError(f"{type(o).__name__} is not JSON serializable")
+
+
+def encode_polled(gardener):
+    """Sensor groups and predictions, as JSON"""
+    with timings.span("encode_polled"):
+        return json.dumps(
+            {
+                "sensor_groups": gardener.sensor_groups,
+                "predictions": gardener.scheduler.predictions()
+                if gardener.scheduler
+                else None,
+            },
+            default=to_json,
+            sort_keys=True,
+        )
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class PumpState:
+    # pylint: disable=too-many-instance-attributes
+    name: str
+    config: config.PumpConfig
+    encoded_config: str  # Kept while the config is the same
+    is_on: bool
+    busy: bool  # Running or waiting in the actuator
+    seconds: float  # Total activation, since start
+    inhibitions: int
+    usage: tuple[tuple[int, float], ...]  # (per_interval, seconds used)
+
+    @classmethod
+    def of(cls, pump, previous=None, encode=True):
+        """State of pump, with the encoded config of previous if it's
+        the same"""
+        if not encode:
+            encoded_config = None
+        elif previous and previous.config is pump.config and previous.encoded_config:
+            encoded_config = previous.encoded_config
+        else:
+            encoded_config = json.dumps(pump.config, default=to_json, sort_keys=True)
+        return cls(
+            pump.name,
+            pump.config,
+            encoded_config,
+            pump.is_on,
+            bool(pump.actuator and pump.actuator.busy(pump)),
+            pump.seconds,
+            pump.inhibitions,
+            tuple(pump.usage.items()),
+        )
+
+    def encode(self):
+        state = {"name": self.name, "is_on": self.is_on, "usage": dict(self.usage)}
+        return (
+            '{"config": '
+            + self.encoded_config
+            + ", "
+            + json.dumps(state, sort_keys=True)[1:]
+        )
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Snapshot:
+    # pylint: disable=too-many-instance-attributes
+    poll_time: float
+    readings: tuple[tuple[str, str, float], ...]  # (kind, sensor, value)
+    pumps: tuple[PumpState, ...]
+    queued_ops: int
+    queue: dict  # CommandQueue.stats()
+    queue_changes: int  # CommandQueue.changes when taken
+    history_commits: int
+    last_poll: dict  # The gardener's, which replaces it on each poll
+    polled: str  # encode_polled() after that poll
+    summary: bytes  # Served by the API
+    etag: str
+
+    @classmethod
+    def of(cls, gardener, changed=None):
+        """Current state of the gardener, from its thread. Pumps not in
+        changed (names, None for all) keep their state in the previous
+        snapshot. The summary is only encoded if gardener.api_summary is
+        set."""
+        queue_changes = gardener.queue.changes
+        last_poll = gardener.last_poll
+        previous = gardener.snapshot
+        encode = gardener.api_summary
+        if not encode:
+            polled = None
+        elif previous and previous.last_poll is last_poll and previous.polled:
+            polled = previous.polled
+        else:
+            polled = encode_polled(gardener)
+        known = dict((p.name, p) for p in previous.pumps) if previous else {}
+        pumps = [
+            (
+                known[p.name]
+                if p.name in known and changed is not None and p.name not in changed
+                else PumpState.of(p, known.get(p.name), encode)
+            )
+            for p in gardener.pumps
+        ]
+        stats = gardener.queue.stats()
+        summary = etag = None
+        if encode:
+            summary = json.dumps(
+                {"last_poll": last_poll, "queued_ops": stats["depth"], "queue": stats},
+                sort_keys=True,
+            )
+            # One object, with the keys of all
+            summary = (
+                summary[:-1]
+                + ', "pumps": ['
+                + ", ".join(p.encode() for p in pumps)
+                + "], "
+                + polled[1:]
+            ).encode()
+            etag = hashlib.sha1(summary).hexdigest()
+        if previous and previous.last_poll is last_poll:
+            readings = previous.readings
+        else:
+            readings = tuple(
+                (kind, sensor, value)
+                for kind, measures in last_poll.get("result", {}).items()
+                for sensor, value in measures.items()
+                if value is not None
+            )
+        return cls(
+            poll_time=last_poll.get("time"),
+            readings=readings,
+            pumps=tuple(pumps),
+            queued_ops=stats["depth"],
+            queue=stats,
+            queue_changes=queue_changes,
+            history_commits=gardener.history_manager.commits,
+            last_poll=last_poll,
+            polled=polled,
+            summary=summary,
+            etag=etag,
+        )
+
+
+class Collector:
+    """Registered with prometheus_client, reads gardener.snapshot"""
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, gardener):
+        self.gardener = gardener
+
+    def collect(self):
+        # Loaded by scrapes only, the gardener doesn't need it
+        # pylint: disable=import-outside-toplevel,too-many-locals
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+        snap = self.gardener.snapshot
+        if snap is None:
+            return
+        families = {}
+        for kind, sensor, value in snap.readings:
+            for name, doc in READINGS.get(kind, ()):
+                if name not in families:
+                    families[name] = GaugeMetricFamily(name, doc, labels=["sensor_id"])
+                families[name].add_metric([sensor], value)
+        yield from families.values()
+
+        seconds = CounterMetricFamily(
+            "plants_pump_seconds", "Seconds of pump activation", labels=["pump_id"]
+        )
+        inhibitions = CounterMetricFamily(
+            "plants_pump_inhibitions",
+            "Waterings refused by pump limits",
+            labels=["pump_id"],
+        )
+        on = GaugeMetricFamily("plants_pump_on", "Pump running", labels=["pump_id"])
+        usage = GaugeMetricFamily(
+            "plants_pump_usage_seconds",
+            "Pump activation within each limit interval",
+            labels=["pump_id", "per_interval"],
+        )
+        for p in snap.pumps:
+            seconds.add_metric([p.name], p.seconds)
+            inhibitions.add_metric([p.name], p.inhibitions)
+            on.add_metric([p.name], int(p.is_on))
+            for interval, used in p.usage:
+                usage.add_metric([p.name, str(interval)], used)
+        yield from [seconds, inhibitions, on, usage]
+
+        if snap.poll_time is not None:
+            yield GaugeMetricFamily(
+                "plants_last_poll_timestamp_seconds",
+                "Time of the last sensor poll",
+                value=snap.poll_time,
+            )
+        yield GaugeMetricFamily(
+            "plants_queued_ops", "Operations queued for the gardener", snap.queued_ops
+        )
+        yield GaugeMetricFamily(
+            "plants_queue_oldest_seconds",
+            "How long the oldest queued operation waits",
+            snap.queue["oldest_seconds"],
+        )
+        yield CounterMetricFamily(
+            "plants_history_commits",
+            "Pump history and archive db commits",
+            snap.history_commits,
+        )
@@ -0,0 +1,117 @@
+"""Pump activation rules, compiled once and evaluated incrementally.
+
+Each pump with activation_thresholds gets a Rule. The Engine indexes
+rules by sensor, so a poll only re-evaluates rules whose sensors changed
+(plus rules waiting on a dry_duration), and keeps the set of active
+rules in between.
+
+A sensor is dry below its threshold, and only turns wet again at
+threshold + activation_hysteresis. Missing readings are unknown: they
+never count as dry. With activation_mode `all` (the default) every
+sensor must be dry, with `any` one is enough, and with dry_duration the
+condition must hold that long before the pump triggers. Pumps without
+thresholds are never activated by rules."""
+
+import time
+
+
+class Rule:
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, index, pump):
+        conf = pump.config
+        self.index = index
+        self.pump = pump
+        self.thresholds = dict(conf.activation_thresholds)
+        self.mode = all if conf.activation_mode == "all" else any
+        self.hysteresis = conf.activation_hysteresis
+        self.dry_duration = conf.dry_duration
+        self.dry_since = dict((s, None) for s in self.thresholds)
+        self.known = set()
+
+    def update(self, sensor, value, now):
+        if value is None:
+            if sensor in self.known:
+                print(f"{self.pump} lost readings from {sensor}")
+            self.known.discard(sensor)
+            self.dry_since[sensor] = None
+            return
+        self.known.add(sensor)
+        threshold = self.thresholds[sensor]
+        if self.dry_since[sensor] is None:
+            if value < threshold:
+                self.dry_since[sensor] = now
+        elif value >= threshold + self.hysteresis:
+            self.dry_since[sensor] = None
+
+    def since(self):
+        """Since when the rule condition holds, or None"""
+        dry = self.dry_since.values()
+        if not self.thresholds or not self.mode(t is not None for t in dry):
+            return None
+        times = [t for t in dry if t is not None]
+        return max(times) if self.mode is all else min(times)
+
+    def __repr__(self):
+        return f"rule@{self.pump.name}"
+
+
+class Engine:
+    # pylint: disable=too-few-public-methods
+    def __init__(self, pumps):
+        self.rules = [Rule(i, p) for i, p in enumerate(pumps)]
+        self.by_sensor = {}
+        for rule in self.rules:
+            for sensor in rule.thresholds:
+                self.by_sensor.setdefault(sensor, []).append(rule)
+        self.last = {}
+        self.pending = set()  # Condition holds, waiting for dry_duration
+        self.active = set()
+
+    def inherit(self, previous):
+        """Keeps since when sensors are dry for rules of the same pump
+        and thresholds in the previous engine, on config reload. Every
+        reading is evaluated again on the next poll."""
+        rules = dict((id(r.pump), r) for r in previous.rules)
+        for rule in self.rules:
+            old = rules.get(id(rule.pump))
+            if old and (old.thresholds, old.hysteresis) == (
+                rule.thresholds,
+                rule.hysteresis,
+            ):
+                rule.dry_since = dict(old.dry_since)
+                rule.known = set(old.known)
+
+    def evaluate(self, readings, now=None):
+        """Updates rules from {sensor: moisture} readings, returns the
+        pumps whose rule is active, in configuration order."""
+        if now is None:
+            now = time.monotonic()
+        changes = dict(
+            (s, v)
+            for s, v in readings.items()
+            if s in self.by_sensor and (s not in self.last or self.last[s] != v)
+        )
+        # Sensors that stopped reporting
+        changes.update((s, None) for s in self.last.keys() - readings.keys())
+
+        touched = set(self.pending)
+        for sensor, value in changes.items():
+            if value is None:
+                self.last.pop(sensor, None)
+            else:
+                self.last[sensor] = value
+            for rule in self.by_sensor[sensor]:
+                rule.update(sensor, value, now)
+                touched.add(rule)
+
+        for rule in touched:
+            since = rule.since()
+            self.pending.discard(rule)
+            self.active.discard(rule)
+            if since is None:
+                continue
+            if now - since >= rule.dry_duration:
+                self.active.add(rule)
+            else:
+                self.pending.add(rule)
+        return [r.pump for r in sorted(self.active, key=lambda r: r.index)]
@@ -0,0 +1,148 @@
+"""Decides when each sensor group is polled next.
+
+Without adaptive_polling, every group is polled poll_interval after its
+previous poll. With it, each moisture sensor's drying rate is estimated
+from its recent readings, and its group is polled again after half the
+predicted time to reach its highest activation threshold, between
+min_interval and max_interval: rarely when soaked, often when close.
+Groups feeding a pump that just watered are polled again soon."""
+
+import collections
+
+from plants.clock import Clock
+
+# Readings kept per sensor to estimate its drying rate
+RATE_SAMPLES = 12
+
+
+def slope(samples):
+    """Least squares slope of [(t, v)], per second"""
+    n = len(samples)
+    mean_t = sum(t for t, _ in samples) / n
+    mean_v = sum(v for _, v in samples) / n
+    var = sum((t - mean_t) ** 2 for t, _ in samples)
+    if not var:
+        return 0.0
+    return sum((t - mean_t) * (v - mean_v) for t, v in samples) / var
+
+
+class PollScheduler:
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, groups, pumps, conf, clock=None):
+        self.clock = clock or Clock()
+        adaptive = conf.adaptive_polling or {}
+        self.min_interval = adaptive.get("min_interval", conf.poll_interval)
+        self.max_interval = adaptive.get("max_interval", conf.poll_interval)
+        self.pumps = pumps
+        # Moisture sensors by group index, and the threshold they
+        # first cross when drying.
+        self.sensors = [
+            [s.name for s in g.sensors if s.kind == "moisture"] for g in groups
+        ]
+        self.thresholds = {}
+        for p in pumps:
+            for sensor, threshold in p.activation_thresholds.items():
+                self.thresholds[sensor] = max(
+                    threshold, self.thresholds.get(sensor, threshold)
+                )
+        self.samples = collections.defaultdict(
+            lambda: collections.deque(maxlen=RATE_SAMPLES)
+        )
+        self.next_poll = [0] * len(groups)
+        # Groups alerting on their own need fewer polls.
+        self.fixed = [g.alert_poll_interval for g in groups]
+
+    def inherit(self, previous, moved):
+        """Keeps drying rates, and poll times of groups {new index: old
+        index} moved over from the previous scheduler on config reload"""
+        self.samples.update(previous.samples)
+        for new, old in moved.items():
+            self.next_poll[new] = previous.next_poll[old]
+
+    @property
+    def adaptive(self):
+        return self.min_interval != self.max_interval
+
+    def due(self, now=None):
+        if now is None:
+            now = self.clock.monotonic()
+        return [i for i, t in enumerate(self.next_poll) if t <= now]
+
+    def next_deadline(self):
+        return min(self.next_poll, default=None)
+
+    def polled(self, index, readings, now=None):
+        """Records a group's moisture readings, schedules its next poll"""
+        if now is None:
+            now = self.clock.monotonic()
+        delay = self.max_interval
+        for sensor in self.sensors[index]:
+            value = readings.get(sensor)
+            if value is not None:
+                self.samples[sensor].append((now, value))
+            delay = min(delay, self.delay_for(sensor))
+        if self.fixed[index]:
+            delay = self.fixed[index]
+        self.next_poll[index] = now + max(self.min_interval, delay)
+
+    def watered(self, pump, now=None):
+        """Polls groups feeding that pump again soon"""
+        if now is None:
+            now = self.clock.monotonic()
+        for i, names in enumerate(self.sensors):
+            if any(s in pump.activation_thresholds for s in names):
+                self.next_poll[i] = min(self.next_poll[i], now + self.min_interval)
+
+    def time_to_threshold(self, sensor, samples):
+        """Seconds until sensor reaches its threshold at the current
+        drying rate: 0 if already below, None if unknown or not drying."""
+        if sensor not in self.thresholds or not samples:
+            return None
+        value = samples[-1][1]
+        if value < self.thresholds[sensor]:
+            return 0
+        rate = slope(samples) if len(samples) > 2 else 0
+        if rate >= 0:
+            return None
+        return (value - self.thresholds[sensor]) / -rate
+
+    def delay_for(self, sensor):
+        if not self.adaptive:
+            return self.max_interval
+        if sensor in self.thresholds and len(self.samples.get(sensor, ())) <= 2:
+            return self.min_interval  # Learning its rate
+        remaining = self.time_to_threshold(sensor, self.samples.get(sensor))
+        if remaining is None:
+            return self.max_interval
+        return min(self.max_interval, max(self.min_interval, remaining / 2))
+
+    def predictions(self):
+        """Predicted threshold crossings per sensor, and next watering
+        per pump, as timestamps. Safe to call from other threads."""
+        now, wall = self.clock.monotonic(), self.clock.time()
+        crossing = {}
+        for sensor in self.thresholds:
+            samples = list(self.samples.get(sensor, ()))
+            remaining = self.time_to_threshold(sensor, samples)
+            crossing[sensor] = {
+                "drying_rate_per_hour": slope(samples) * 3600
+                if len(samples) > 1
+                else None,
+                "threshold_at": None
+                if remaining is None
+                else wall + max(0, samples[-1][0] + remaining - now),
+            }
+        pumps = {}
+        for p in self.pumps:
+            times = [crossing[s]["threshold_at"] for s in p.activation_thresholds]
+            if not times or (p.config.activation_mode == "all" and None in times):
+                pumps[p.name] = None
+            elif p.config.activation_mode == "all":
+                pumps[p.name] = max(times)
+            else:
+                pumps[p.name] = min((t for t in times if t is not None), default=None)
+        return {
+            "sensors": crossing,
+            "next_watering": pumps,
+            "next_polls": [wall + max(0, t - now) for t in self.next_poll],
+        }
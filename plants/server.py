@@ -4,9 +4,10 @@ import argparse
 import signal
 
 import prometheus_client
+import waitress
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 
-from plants import api, config
+from plants import api, config, metrics, timings
 from plants.gardener import Gardener
 
 
@@ -16,9 +17,22 @@ def on_signal(sig, stack):
     raise KeyboardInterrupt
 
 
+def on_reload(sig, stack):
+    # pylint: disable=unused-argument
+    print(f"Caught {sig}, reloading {api.app.config_path}")
+    try:
+        api.app.gardener.reload_config(config.load(api.app.config_path))
+    except (config.Error, OSError) as exc:
+        print(f"Not reloading: {exc}")
+
+
 def server():
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--conf", default="/usr/local/etc/plants.yaml")
+    parser.add_argument("--threads", type=int, default=8, help="API threads")
+    parser.add_argument(
+        "--dev", action="store_true", help="Flask development server, debugger on"
+    )
     args = parser.parse_args()
 
     # Send /metrics to prometheus
@@ -27,14 +41,23 @@ def server():
     )
     # Init hardware, and make sure it stays clean at exit
     conf = config.load(args.conf)
+    api.app.config_path = args.conf
     api.app.gardener = Gardener(conf)
+    # Leave threads to requests other than event streams
+    api.app.gardener.events.max_subscribers = max(1, args.threads - 2)
+    prometheus_client.REGISTRY.register(metrics.Collector(api.app.gardener))
+    prometheus_client.REGISTRY.register(timings.Collector())
     for sig in [signal.SIGTERM, signal.SIGINT]:
         signal.signal(sig, on_signal)
+    signal.signal(signal.SIGHUP, on_reload)
 
     api.app.gardener.start_thread()
-    api.app.run(
-        debug=True,
-        use_reloader=False,
-        host=conf.get("host", "127.0.0.1"),
-        port=conf.get("port", 9001),
-    )
+    if args.dev:
+        api.app.run(
+            debug=True,
+            use_reloader=False,
+            host=conf.host,
+            port=conf.port,
+        )
+    else:
+        waitress.serve(api.app, host=conf.host, port=conf.port, threads=args.threads)
@@ -0,0 +1,289 @@
+"""Latest readings and pump states in shared memory, for local readers.
+
+With `shared_memory` set, the gardener writes each Snapshot into a file
+mapped in memory (under /dev/shm, it never reaches a disk). Processes on
+the same host map it too and read current values in microseconds,
+without HTTP or JSON: a display, a logger, another controller.
+
+The layout is fixed, little endian:
+
+    header   HEADER, at 0
+    readings READING * max_readings, at HEADER.size
+    pumps    PUMP * max_pumps, after readings
+
+A seqlock keeps reads consistent without making the writer wait: the
+writer makes `seq` odd, writes, and makes it even again. Readers read
+`seq`, the values they want straight from the mapping, and `seq` again,
+retrying if it was odd or changed. `layout` changes when sensors or
+pumps are added, removed or reordered: readers keep where values of a
+name are until then. Names longer than NAME bytes are truncated, and
+what doesn't fit in the slots is left out.
+
+    with shm.Reader("/dev/shm/plants") as reader:
+        reader.get("moisture", "Pachira aquatica")
+        reader.read()  # Everything, as a dict
+
+`python -m plants.shm /dev/shm/plants` prints the latter."""
+
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b"PLNT"
+VERSION = 1
+# magic, version, seq, layout, max_readings, max_pumps, readings, pumps,
+# poll time (NaN before the first poll), time written
+HEADER = struct.Struct("<4sIQIIIIIdd")
+SEQ = struct.Struct("<Q")
+SEQ_OFFSET = 8
+NAME = 32
+# kind, sensor, value
+READING = struct.Struct(f"<16s{NAME}sd")
+VALUE = struct.Struct("<d")
+VALUE_OFFSET = 16 + NAME
+# name, is_on, seconds, inhibitions
+PUMP = struct.Struct(f"<{NAME}s?dI")
+STATE = struct.Struct("<?dI")
+# Slots, enough for most gardens in under 70KB
+MAX_READINGS = 1024
+MAX_PUMPS = 256
+# Reads retried while the writer is busy
+RETRIES = 1000
+
+
+def _name(s, size=NAME):
+    return s.encode()[:size]
+
+
+def _str(b):
+    return b.rstrip(b"\0").decode(errors="ignore")
+
+
+class Writer:
+    """Writes snapshots, from the gardener thread only"""
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, path, max_readings=MAX_READINGS, max_pumps=MAX_PUMPS):
+        self.path = path
+        self.max_readings = max_readings
+        self.max_pumps = max_pumps
+        self.pumps_offset = HEADER.size + READING.size * max_readings
+        size = self.pumps_offset + PUMP.size * max_pumps
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.seq = 0
+        self.layout = 0
+        self.names = None  # (readings, pumps) names written
+        self.truncated = False
+        self._header(0, 0, float("nan"))
+
+    def _header(self, readings, pumps, poll_time):
+        HEADER.pack_into(
+            self.mm,
+            0,
+            MAGIC,
+            VERSION,
+            self.seq,
+            self.layout,
+            self.max_readings,
+            self.max_pumps,
+            readings,
+            pumps,
+            poll_time,
+            time.time(),
+        )
+
+    def write(self, snapshot):
+        readings = snapshot.readings[: self.max_readings]
+        pumps = snapshot.pumps[: self.max_pumps]
+        if not self.truncated and (readings, pumps) != (
+            snapshot.readings,
+            snapshot.pumps,
+        ):
+            self.truncated = True
+            print(f"Too many readings or pumps for {self.path}, writing the first ones")
+        names = (
+            tuple((kind, sensor) for kind, sensor, _ in readings),
+            tuple(p.name for p in pumps),
+        )
+        self.seq += 1
+        SEQ.pack_into(self.mm, SEQ_OFFSET, self.seq)
+        if names != self.names:
+            self.names = names
+            self.layout += 1
+            self._write_names(readings, pumps)
+        else:
+            for i, (_, _, value) in enumerate(readings):
+                VALUE.pack_into(
+                    self.mm, HEADER.size + READING.size * i + VALUE_OFFSET, value
+                )
+            for i, p in enumerate(pumps):
+                STATE.pack_into(
+                    self.mm,
+                    self.pumps_offset + PUMP.size * i + NAME,
+                    p.is_on,
+                    p.seconds,
+                    p.inhibitions,
+                )
+        poll_time = snapshot.poll_time
+        self._header(
+            len(readings), len(pumps), float("nan") if poll_time is None else poll_time
+        )
+        self.seq += 1
+        SEQ.pack_into(self.mm, SEQ_OFFSET, self.seq)
+
+    def _write_names(self, readings, pumps):
+        for i, (kind, sensor, value) in enumerate(readings):
+            READING.pack_into(
+                self.mm,
+                HEADER.size + READING.size * i,
+                _name(kind, 16),
+                _name(sensor),
+                value,
+            )
+        for i, p in enumerate(pumps):
+            PUMP.pack_into(
+                self.mm,
+                self.pumps_offset + PUMP.size * i,
+                _name(p.name),
+                p.is_on,
+                p.seconds,
+                p.inhibitions,
+            )
+
+    def close(self):
+        """Leaves the file, readers see the last state"""
+        self.mm.close()
+
+
+class Reader:
+    """Reads what a Writer wrote, from any process"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, *_ = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError(f"{path} is not a plants snapshot v{VERSION}")
+        self.layout = None
+        self.offsets = {}  # (kind, sensor) or pump name -> offset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.mm.close()
+
+    def _consistent(self, read):
+        """read() while no write happens"""
+        for _ in range(RETRIES):
+            (seq,) = SEQ.unpack_from(self.mm, SEQ_OFFSET)
+            if seq & 1:
+                time.sleep(0)
+                continue
+            result = read()
+            if SEQ.unpack_from(self.mm, SEQ_OFFSET)[0] == seq:
+                return result
+        raise TimeoutError("Snapshot kept changing while read")
+
+    def _header(self):
+        fields = HEADER.unpack_from(self.mm)
+        layout, max_readings = fields[3:5]
+        readings, pumps, poll, written = fields[6:]
+        pumps_offset = HEADER.size + READING.size * max_readings
+        return layout, readings, pumps, pumps_offset, poll, written
+
+    def _index(self):
+        """(layout, {(kind, sensor) or pump name: offset}), cached by layout"""
+        layout, readings, pumps, pumps_offset, _, _ = self._header()
+        if layout == self.layout:
+            return layout, self.offsets
+        offsets = {}
+        for i in range(readings):
+            offset = HEADER.size + READING.size * i
+            kind, sensor, _ = READING.unpack_from(self.mm, offset)
+            offsets[(_str(kind), _str(sensor))] = offset + VALUE_OFFSET
+        for i in range(pumps):
+            offset = pumps_offset + PUMP.size * i
+            offsets[_str(PUMP.unpack_from(self.mm, offset)[0])] = offset + NAME
+        return layout, offsets
+
+    def _lookup(self, key, value):
+        """Unpacks value at the offset of key, None if unknown"""
+
+        def read():
+            layout, offsets = self._index()
+            offset = offsets.get(key)
+            return (
+                layout,
+                offsets,
+                value.unpack_from(self.mm, offset) if offset else None,
+            )
+
+        # Only kept once read consistently
+        self.layout, self.offsets, result = self._consistent(read)
+        return result
+
+    def get(self, kind, sensor):
+        """The latest reading of a sensor, None if it has none"""
+        result = self._lookup((kind, _str(_name(sensor))), VALUE)
+        return result and result[0]
+
+    def pump(self, name):
+        """(is_on, seconds, inhibitions) of a pump, None if unknown"""
+        return self._lookup(_str(_name(name)), STATE)
+
+    def read(self):
+        """Poll time, readings by kind and sensor, and pump states"""
+
+        def read():
+            _, readings, pumps, pumps_offset, poll, written = self._header()
+            result = {}
+            for i in range(readings):
+                kind, sensor, value = READING.unpack_from(
+                    self.mm, HEADER.size + READING.size * i
+                )
+                result.setdefault(_str(kind), {})[_str(sensor)] = value
+            states = {}
+            for i in range(pumps):
+                name, is_on, seconds, inhibitions = PUMP.unpack_from(
+                    self.mm, pumps_offset + PUMP.size * i
+                )
+                states[_str(name)] = {
+                    "is_on": is_on,
+                    "seconds": seconds,
+                    "inhibitions": inhibitions,
+                }
+            return {
+                "poll_time": None if math.isnan(poll) else poll,
+                "time": written,
+                "result": result,
+                "pumps": states,
+            }
+
+        return self._consistent(read)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prints the shared snapshot")
+    parser.add_argument("path", nargs="?", default="/dev/shm/plants")
+    args = parser.parse_args()
+    with Reader(args.path) as reader:
+        print(json.dumps(reader.read(), indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Runs a configuration on a virtual timeline.
+
+The real Gardener and pumps run on a VirtualClock, against a soil model:
+each moisture sensor's pot dries a little every day, faster by day than
+by night, and gets wetter while the pumps activated by that sensor run.
+ADS1115 groups read the model instead of hardware. A year of watering
+runs in seconds, reporting pump runtime, limit inhibitions and time
+spent below activation thresholds:
+
+    python -m plants.simulate -c plants.yaml --days 365 --poll-interval 10m
+
+History and archive databases are never touched."""
+
+import argparse
+import contextlib
+import dataclasses
+import json
+import math
+import os
+import time
+
+from plants import config, util
+from plants.clock import VirtualClock
+from plants.gardener import Gardener
+
+
+class Soil:
+    """Moisture ratio of one pot"""
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, moisture=0.8, drying_per_day=0.1, watering_per_second=0.01):
+        self.moisture = moisture
+        self.drying_per_day = drying_per_day
+        self.watering_per_second = watering_per_second
+
+    def advance(self, start, end, watering):
+        # Drying peaks mid-day: mean rate over the day is drying_per_day.
+        mid = (start + end) / 2 % 86400 / 86400
+        rate = self.drying_per_day / 86400 * (1 - math.cos(2 * math.pi * mid))
+        self.moisture -= rate * (end - start)
+        self.moisture += watering * self.watering_per_second
+        self.moisture = min(1.0, max(0.0, self.moisture))
+
+
+class SoilAdc:
+    """Stands for a mock ADS1115, converting soil moisture to volts"""
+
+    def __init__(self, group, soils):
+        self.lock = group.adc.lock
+        self.sensors = dict((s.port, (s, soils[s.name])) for s in group.sensors)
+
+    def single_shot_read_gnd(self, port):
+        sensor, soil = self.sensors[port]
+        return sensor.max_v - soil.moisture * (sensor.max_v - sensor.min_v)
+
+    def burst_read_gnd(self, port, samples, rate=860):
+        # pylint: disable=unused-argument
+        return [self.single_shot_read_gnd(port)] * samples
+
+
+class Simulation:
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, conf, drying_per_day=0.1, watering_per_second=0.01, start=None):
+        groups = []
+        for group in conf.sensor_groups:
+            if group["kind"] in ("ads1115", "mock-ads1115"):
+                groups.append(config.Config(dict(group, kind="mock-ads1115")))
+            else:
+                print(f"No soil model for {group['kind']} groups, skipped")
+        conf = dataclasses.replace(
+            conf,
+            sensor_groups=tuple(groups),
+            pumps_history_db=None,
+            sensors_archive=False,
+            shared_memory=None,
+        )
+        self.clock = VirtualClock(time.time() if start is None else start)
+        self.gardener = Gardener(conf, self.clock)
+        self.gardener.api_summary = False
+        self.gardener.setup_thread_from_config()
+        self.soils = {}
+        for group in self.gardener.sensor_groups:
+            for s in group.sensors:
+                self.soils[s.name] = Soil(0.8, drying_per_day, watering_per_second)
+            group.adc = SoilAdc(group, self.soils)
+        self.thresholds = {}
+        for p in self.gardener.pumps:
+            for sensor, t in p.activation_thresholds.items():
+                self.thresholds[sensor] = max(t, self.thresholds.get(sensor, t))
+        self.runtime = dict((p.name, 0.0) for p in self.gardener.pumps)
+        self.waterings = dict((p.name, 0) for p in self.gardener.pumps)
+        self.below = dict((s, 0.0) for s in self.thresholds)
+        self.lowest = dict((s, 1.0) for s in self.soils)
+        self.was_on = set()
+        self.clock.listeners.append(self.advance)
+
+    def advance(self, start, end):
+        watering = dict((s, 0.0) for s in self.soils)
+        for p in self.gardener.pumps:
+            if not p.is_on:
+                self.was_on.discard(p.name)
+                continue
+            if p.name not in self.was_on:
+                self.waterings[p.name] += 1
+                self.was_on.add(p.name)
+            self.runtime[p.name] += end - start
+            for sensor in p.activation_thresholds:
+                if sensor in watering:
+                    watering[sensor] += end - start
+        for name, soil in self.soils.items():
+            if name in self.below and soil.moisture < self.thresholds[name]:
+                self.below[name] += end - start
+            soil.advance(start, end, watering[name])
+            self.lowest[name] = min(self.lowest[name], soil.moisture)
+
+    def run(self, seconds):
+        start = self.clock.time()
+        end = start + seconds
+        while self.clock.time() < end:
+            self.gardener.step()
+        self.gardener.actuator.all_off()
+        self.gardener.poller.shutdown()
+        self.gardener.history_manager.close()
+        return self.report(self.clock.time() - start)
+
+    def report(self, elapsed):
+        return {
+            "seconds": elapsed,
+            "pumps": dict(
+                (
+                    p.name,
+                    {
+                        "runtime_seconds": self.runtime[p.name],
+                        "waterings": self.waterings[p.name],
+                        "inhibitions": p.inhibitions,
+                    },
+                )
+                for p in self.gardener.pumps
+            ),
+            "sensors": dict(
+                (
+                    name,
+                    {
+                        "moisture": soil.moisture,
+                        "lowest": self.lowest[name],
+                        "threshold": self.thresholds.get(name),
+                        "seconds_below_threshold": self.below.get(name),
+                    },
+                )
+                for name, soil in self.soils.items()
+            ),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("-c", "--conf", default="/usr/local/etc/plants.yaml")
+    parser.add_argument("--days", type=float, default=365)
+    parser.add_argument("--poll-interval", help="overrides poll_interval, e.g. 10m")
+    parser.add_argument("--drying-per-day", type=float, default=0.1)
+    parser.add_argument("--watering-per-second", type=float, default=0.01)
+    parser.add_argument("-o", "--output", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    conf = config.load(args.conf)
+    if args.poll_interval:
+        conf = dataclasses.replace(conf, poll_interval=util.htime(args.poll_interval))
+    started = time.perf_counter()
+    # Pumps and rules log every event, keep the report readable.
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            sim = Simulation(conf, args.drying_per_day, args.watering_per_second)
+            report = sim.run(args.days * 86400)
+    report["wall_seconds"] = time.perf_counter() - started
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fd:
+            fd.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import contextlib
+import io
+import time
+import unittest
+
+from plants import config
+from plants.clock import VirtualClock
+from plants.commands import Poll
+from plants.gardener import Gardener
+from plants.hw import emulator, i2c
+from plants.hw.ads1115 import Config, Register
+from plants.hw.sensors.ads1115 import trimmed_mean
+from plants.testing import ads1115_group, mock_pins
+
+
+class TestAds1115Config(unittest.TestCase):
+    def test_single_shot(self):
+        conf = Config.single_shot_read_gnd(2)
+        self.assertEqual(conf.value, 0b1110_0011_1000_0011)
+        self.assertEqual(conf.delay(), 1 / 128)
+        self.assertEqual(conf.volts_range(), 4.096)
+
+    def test_continuous(self):
+        conf = Config.continuous_read_gnd(1, rate=860)
+        self.assertEqual(conf.value, 0b0101_0010_1110_0011)
+        self.assertEqual(conf.delay(), 1 / 860)
+        self.assertEqual(Config.power_down().value >> Config.OS, 0)
+        with self.assertRaises(ValueError):
+            Config.continuous_read_gnd(0, rate=1000)
+
+    def test_comparator(self):
+        conf = Config.comparator_gnd(0, rate=8, queue=4)
+        self.assertEqual(conf.value, 0b0100_0010_0000_0010)
+        self.assertEqual(conf.to_code(2.048), 0x4000)
+        self.assertEqual(conf.to_code(5), 0x7FFF)
+
+    def test_trimmed_mean(self):
+        self.assertEqual(trimmed_mean([1, 2, 2, 2, 2, 2, 2, 2, 2, 100]), 2)
+
+
+class TestComparator(unittest.TestCase):
+    """A group watching its sensor, on an emulated ADS1115 and mock pins"""
+
+    def setUp(self):
+        self.pins = mock_pins(self)
+        self.adc = emulator.ADS1115({0: 2.0})
+        i2c.install(94, emulator.EmulatedBus()).smbus.attach(72, self.adc)
+        self.group = ads1115_group(94, 72, 9, 0)
+        self.group["comparator"] = {
+            "sensor": "94.72.9",
+            "alert_port": 25,
+            "data_rate": 860,
+            "queue": 1,
+        }
+        self.pump = {
+            "kind": "mock-gpio",
+            "duration": 1,
+            "activation_thresholds": [{"94.72.9": "30%"}],
+            "activation_hysteresis": 0.1,
+        }
+
+    def gardener(self, *groups):
+        gardener = Gardener(
+            config.GardenerConfig.parse(
+                {
+                    "poll_interval": "1h",
+                    "sensor_groups": [self.group, *groups],
+                    "pumps": [{"P": self.pump}],
+                }
+            ),
+            VirtualClock(),
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.setup_thread_from_config()
+        self.addCleanup(gardener.poller.shutdown)
+        return gardener
+
+    def test_watch(self):
+        gardener = self.gardener()
+        group = gardener.sensor_groups[0]
+        # Moisture falls as volts rise, between 1.5 (wet) and 2.9 (dry):
+        # alert above 30% moist, released above 30 + 10%.
+        port, lo, hi = group.watched
+        self.assertEqual(port, 0)
+        self.assertAlmostEqual(lo, 2.9 - 0.4 * 1.4)
+        self.assertAlmostEqual(hi, 2.9 - 0.3 * 1.4)
+        conf = Config.comparator_gnd(0, 860, 1)
+        self.assertEqual(self.adc.lo_thresh, conf.to_code(lo))
+        self.assertEqual(self.adc.hi_thresh, conf.to_code(hi))
+        # Sensors stay powered while watched
+        self.assertEqual(self.pins.pin(9).state, 1)
+
+        # Getting dry: the ADC alerts, which wakes a poll of the group up.
+        self.adc.inputs[0] = 2.6
+        time.sleep(3 / 860)
+        self.adc.read(Register.CONVERSION, 2)
+        self.assertTrue(self.adc.alert)
+        self.pins.pin(25).drive_low()
+        self.assertEqual(gardener.queue.get_nowait(), Poll(0))
+
+        # Polling reads in single shots, then watches again.
+        self.adc.lo_thresh = self.adc.hi_thresh = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.poll()
+        self.assertAlmostEqual(
+            gardener.last_poll["result"]["volts"]["94.72.9"], 2.6, places=3
+        )
+        self.assertEqual(self.adc.hi_thresh, conf.to_code(hi))
+        self.assertEqual((self.adc.config >> Config.MODE) & 1, 0)  # Continuous
+        self.assertEqual(self.pins.pin(9).state, 1)
+
+    def test_shared_adc(self):
+        with self.assertRaises(config.Error):
+            self.gardener(ads1115_group(94, 72, 10, 0))
@@ -0,0 +1,108 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import types
+import unittest
+
+from plants import api, config
+from plants.gardener import Gardener
+from plants.history import HistoryManager
+from plants.testing import CONF
+
+
+class TestHistoryEndpoint(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmp = tempfile.TemporaryDirectory()
+        db = os.path.join(self.tmp.name, "h.db")
+        self.manager = HistoryManager(
+            config.GardenerConfig(1, pumps_history_db=db, sensors_archive=True)
+        )
+        archive = self.manager.archive()
+        now = time.time()
+        for i in range(100):
+            archive.append(now - 3600 + i * 30, {"moisture": {"a": i, "b": -i}})
+        api.app.gardener = types.SimpleNamespace(archive=archive)
+        self.client = api.app.test_client()
+
+    def tearDown(self):
+        self.manager.close()
+        self.tmp.cleanup()
+
+    def test_downsampled(self):
+        r = self.client.get("/history?since=2h&points=20&sensor=a")
+        body = json.loads(r.get_data())
+        self.assertEqual(body["resolution"], 60)
+        self.assertEqual(list(body["series"]), ["a"])
+        self.assertLessEqual(len(body["series"]["a"]), 20)
+
+        body = json.loads(self.client.get("/history?since=2h").get_data())
+        self.assertEqual(body["resolution"], 0)
+        self.assertEqual(sorted(body["series"]), ["a", "b"])
+        self.assertEqual(len(body["series"]["b"]), 100)
+
+    def test_bad_range(self):
+        for query in [
+            "since=",
+            "since=2x",
+            "start=a",
+            "points=many",
+            "start=nan",
+            "end=inf",
+            "since=1h&end=-inf",
+        ]:
+            r = self.client.get(f"/history?{query}")
+            self.assertEqual(r.status_code, 400, query)
+
+    def test_conditional(self):
+        end = time.time()
+        url = f"/history?since=1h&end={end}"
+        etag = self.client.get(url).headers["ETag"]
+        r = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 304)
+        # Same range
+        same = f"/history?start={end - 3600}&end={end}"
+        r = self.client.get(same, headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 304)
+        # The range moved
+        moved = f"/history?since=1h&end={end + 60}"
+        r = self.client.get(moved, headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 200)
+        self.manager.archive().append(time.time(), {"moisture": {"a": 1}})
+        r = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 200)
+
+
+class TestSummary(unittest.TestCase):
+    def test_cached(self):
+        gardener = Gardener(config.GardenerConfig.parse(CONF))
+        api.app.gardener = gardener
+        client = api.app.test_client()
+        self.assertEqual(client.get("/").status_code, 503)
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.setup_thread_from_config()
+            gardener.poll()
+        gardener.publish()
+        gardener.poller.shutdown()
+
+        r = client.get("/")
+        body = json.loads(r.get_data())
+        self.assertAlmostEqual(body["last_poll"]["result"]["moisture"]["A"], 0.857, 3)
+        self.assertEqual(body["pumps"][0]["name"], "P")
+        self.assertEqual(body["sensor_groups"][0]["sensors"][0]["name"], "A")
+        etag = r.headers["ETag"]
+        r = client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 304)
+
+        # Pumps change on each step, groups are encoded again after polls.
+        polled = gardener.snapshot.polled
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.pumps[0].water(duration=5)
+        gardener.publish()
+        self.assertIs(gardener.snapshot.polled, polled)
+        r = client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(json.loads(r.get_data())["pumps"][0]["is_on"])
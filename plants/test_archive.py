@@ -0,0 +1,90 @@
+import os
+import tempfile
+import time
+import unittest
+
+from plants import config
+from plants.archive import ArchiveReader, lttb, merge_buckets
+from plants.history import HistoryManager
+
+
+class TestSensorArchive(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmp = tempfile.TemporaryDirectory()
+        db = os.path.join(self.tmp.name, "h.db")
+        self.manager = HistoryManager(
+            config.GardenerConfig(1, pumps_history_db=db, sensors_archive=True)
+        )
+        self.archive = self.manager.archive()
+
+    def tearDown(self):
+        self.manager.close()
+        self.tmp.cleanup()
+
+    def test_rollups(self):
+        now = time.time()
+        start = now - now % 86400 - 86400
+        for i in range(120):
+            self.archive.append(start + i * 30, {"moisture": {"a": i / 100, "b": None}})
+        reader = self.archive.reader()
+        self.assertEqual(len(reader.raw("moisture", "a", start, now)), 120)
+        minutes = reader.rollup("moisture", "a", start, now, 60)
+        self.assertEqual(len(minutes), 60)
+        self.assertEqual(minutes[0], (start, 2, 0.0, 0.01, 0.005))
+        hours = reader.rollup("moisture", "a", start, now, 3600)
+        self.assertEqual(hours[0][1:4], (120, 0.0, 1.19))
+        self.assertEqual(reader.series(), [("moisture", "a")])
+        reader.close()
+
+    def test_same_ts(self):
+        ts = time.time() // 60 * 60
+        self.archive.append(ts, {"moisture": {"a": 0.2}})
+        self.archive.append(ts, {"moisture": {"a": 0.4, "b": 0.5}})
+        self.manager.commit()
+        reader = self.archive.reader()
+        self.assertEqual(reader.raw("moisture", "a", ts, ts + 1), [(ts, 0.2)])
+        self.assertEqual(
+            reader.rollup("moisture", "a", ts, ts + 1, 60), [(ts, 1, 0.2, 0.2, 0.2)]
+        )
+        self.assertEqual(reader.raw("moisture", "b", ts, ts + 1), [(ts, 0.5)])
+        reader.close()
+
+    def test_prune(self):
+        now = time.time()
+        self.archive.append(now - 40 * 86400, {"moisture": {"a": 0.5}})
+        self.archive.append(now, {"moisture": {"a": 0.5}})
+        reader = self.archive.reader()
+        self.assertEqual(len(reader.raw("moisture", "a", 0, now + 1)), 1)
+        self.assertEqual(len(reader.rollup("moisture", "a", 0, now + 1, 60)), 1)
+        self.assertEqual(len(reader.rollup("moisture", "a", 0, now + 1, 3600)), 2)
+        reader.close()
+
+    def test_resolution_for(self):
+        now = time.time()
+        for days, points, res in [(0.01, 1000, 0), (7, 1000, 60), (31, 500, 3600)]:
+            self.assertEqual(
+                ArchiveReader.resolution_for(now - days * 86400, now, points, now),
+                res,
+            )
+        self.assertEqual(
+            ArchiveReader.resolution_for(now - 3 * 366 * 86400, now, 1000, now), 86400
+        )
+
+
+class TestDownsampling(unittest.TestCase):
+    def test_lttb(self):
+        data = [(x, 0) for x in range(100)]
+        data[42] = (42, 10)
+        sampled = lttb(data, 10)
+        self.assertEqual(len(sampled), 10)
+        self.assertEqual(sampled[0], data[0])
+        self.assertEqual(sampled[-1], data[-1])
+        self.assertIn((42, 10), sampled)
+
+    def test_merge_buckets(self):
+        rows = [(i * 60, 2, i, i + 1, i + 0.5) for i in range(10)]
+        merged = merge_buckets(rows, 4)
+        self.assertEqual(len(merged), 4)
+        self.assertEqual(merged[0], (0, 6, 0, 3, 1.5))
+        self.assertEqual(merged[-1], (540, 2, 9, 10, 9.5))
@@ -0,0 +1,129 @@
+import contextlib
+import io
+import os
+import queue
+import socket
+import tempfile
+import unittest
+
+from plants import config
+from plants.autoconf import Autoconf
+from plants.history import HistoryManager
+from plants.hw import can
+
+
+class TestAutoconf(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.conf = config.GardenerConfig(
+            1, pumps_history_db=os.path.join(self.tmp.name, "h.db")
+        )
+        ours, self.node = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(ours.close)
+        self.addCleanup(self.node.close)
+        self.node.settimeout(1)
+        can.install("auto", ours)
+        self.frames = queue.Queue()
+
+    def autoconf(self, manager):
+        return Autoconf(
+            config.Config({"channel": "auto", "first_id": 0x100}),
+            manager,
+            self.frames.put,
+        )
+
+    def handle_next(self, autoconf):
+        with contextlib.redirect_stdout(io.StringIO()):
+            autoconf.handle(*self.frames.get(timeout=1))
+
+    def test_enrollment(self):
+        manager = HistoryManager(self.conf)
+        autoconf = self.autoconf(manager)
+        joined = []
+        autoconf.joined.append(lambda node, name: joined.append(name))
+
+        # A node asks for an id, gets the first free one, uses it.
+        self.node.send(can.pack(can.PLANTS_AUTOCONF_ID, rtr=True, length=0))
+        self.handle_next(autoconf)
+        offer = can.unpack(self.node.recv(can.CAN_FRAME.size))
+        self.assertEqual(offer, (can.PLANTS_AUTOCONF_ID, b"\0\1\0\0", False))
+        self.node.send(can.pack(0x100, b"random"))
+        self.handle_next(autoconf)
+        self.assertEqual(joined, ["node-0x100"])
+
+        # Another node shows up replying to a discovery.
+        autoconf.run_due()
+        self.assertEqual(
+            can.unpack(self.node.recv(can.CAN_FRAME.size)),
+            (can.PLANTS_ALL_SENSORS_ID, b"", True),
+        )
+        self.node.send(can.pack(0x200, b"\x10\x02"))
+        self.handle_next(autoconf)
+        self.assertEqual(sorted(autoconf.nodes()), ["0x100", "0x200"])
+
+        # Next offer skips known ids, which persist.
+        self.node.send(can.pack(can.PLANTS_AUTOCONF_ID, rtr=True, length=0))
+        self.handle_next(autoconf)
+        offer = can.unpack(self.node.recv(can.CAN_FRAME.size))
+        self.assertEqual(offer[1], b"\1\1\0\0")
+        manager.close()
+        manager = HistoryManager(self.conf)
+        self.assertEqual(
+            self.autoconf(manager).registry.nodes,
+            {0x100: "node-0x100", 0x200: "node-0x200"},
+        )
+        manager.close()
+
+    def test_configured_nodes(self):
+        manager = HistoryManager(self.conf)
+        autoconf = self.autoconf(manager)
+        autoconf.registry.add(0x200)  # Enrolled before configured by hand
+        autoconf.set_configured(
+            config.GardenerConfig.parse(
+                {
+                    "poll_interval": 1,
+                    "sensor_groups": [
+                        {
+                            "kind": "can",
+                            "channel": "auto",
+                            "sensors": [{"s": {"node": 0x200}}, {"t": {"node": 0x300}}],
+                        },
+                        {"kind": "can", "sensors": [{"u": {"node": 0x400}}]},
+                    ],
+                    "pumps": [
+                        {
+                            "p": {
+                                "kind": "can",
+                                "channel": "auto",
+                                "node": 0x100,
+                                "duration": 1,
+                            }
+                        }
+                    ],
+                }
+            )
+        )
+        self.assertEqual(autoconf.registry.configured, {0x100, 0x200, 0x300})
+        self.assertEqual(autoconf.registry.enrolled(), {})
+        # Their replies are only seen, and their ids never offered.
+        autoconf.on_frame(0x300, b"\x10\x02", False)
+        self.assertTrue(self.frames.empty())
+        self.assertIn(0x300, autoconf.last_seen)
+        autoconf.handle(0x300, b"\x10\x02", False)
+        self.assertNotIn(0x300, autoconf.registry.nodes)
+        self.node.send(can.pack(can.PLANTS_AUTOCONF_ID, rtr=True, length=0))
+        self.handle_next(autoconf)
+        offer = can.unpack(self.node.recv(can.CAN_FRAME.size))
+        self.assertEqual(offer[1], b"\1\1\0\0")
+        manager.close()
+
+    def test_all_off(self):
+        manager = HistoryManager(self.conf)
+        self.autoconf(manager).all_off()
+        self.assertEqual(
+            can.unpack(self.node.recv(can.CAN_FRAME.size)),
+            (can.PLANTS_ALL_SENSORS_ID, b"\x12\x00", False),
+        )
+        manager.close()
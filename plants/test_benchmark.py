@@ -0,0 +1,17 @@
+import contextlib
+import io
+import unittest
+
+from plants import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run(self):
+        conf = benchmark.synthetic_config(groups=3, sensors=4, pumps=10)
+        self.assertEqual(len(conf.pumps), 10)
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = benchmark.run(conf, repeat=2)
+        for path in ["cold_start", "poll_cycle", "rules_evaluate", "api_summary"]:
+            self.assertEqual(results[path]["n"], 2)
+        ratios = benchmark.compare(results, results)
+        self.assertEqual(ratios["poll_cycle"], 1)
@@ -0,0 +1,99 @@
+import contextlib
+import io
+import os
+import socket
+import threading
+import unittest
+
+from plants import config
+from plants.history import HistoryManager
+from plants.hw import can
+from plants.hw.pumps.can import CANPump
+from plants.hw.sensors.can import SensorGroup
+
+
+class FakeNodes(threading.Thread):
+    """Answers remote requests for the nodes in `readings`, recording
+    other frames."""
+
+    def __init__(self, sock, readings):
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.readings = readings
+        self.received = []
+
+    def run(self):
+        while True:
+            try:
+                can_id, data, rtr = can.unpack(self.sock.recv(can.CAN_FRAME.size))
+            except OSError:
+                return
+            if rtr and can_id in self.readings:
+                value = self.readings[can_id].to_bytes(2, byteorder="little")
+                self.sock.send(can.pack(can_id, value))
+            elif not rtr:
+                self.received.append((can_id, data))
+
+
+GROUP = config.Config(
+    {
+        "kind": "can",
+        "channel": "test",
+        "timeout": 0.2,
+        "sensors": [
+            {"A": {"node": 0x101, "value_dry": 800, "value_wet": 400}},
+            {"B": {"node": 0x1234567}},
+        ],
+    }
+)
+
+
+class TestCan(unittest.TestCase):
+    def setUp(self):
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(ours.close)
+        self.addCleanup(theirs.close)
+        self.bus = can.install("test", ours)
+        self.nodes = FakeNodes(theirs, {0x101: 600})
+        self.nodes.start()
+
+    def test_frames(self):
+        frame = can.pack(0x1234567, b"\x01\x02", rtr=False)
+        self.assertEqual(can.unpack(frame), (0x1234567, b"\x01\x02", False))
+        self.assertEqual(
+            can.unpack(can.pack(0x2A, rtr=True, length=4)), (0x2A, b"", True)
+        )
+
+    def test_group_poll(self):
+        group = SensorGroup(GROUP)
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = group.poll()
+        self.assertEqual(result["moisture"], {"A": 0.5, "B": None})
+        self.assertEqual(result["adc"], {"A": 600, "B": None})
+
+    def test_pump(self):
+        conf = config.PumpConfig.parse(
+            config.Config(
+                {"P": {"kind": "can", "channel": "test", "node": 0x101, "duration": 1}}
+            )
+        )
+        pump = CANPump("P", conf, HistoryManager(config.GardenerConfig(1)))
+        with contextlib.redirect_stdout(io.StringIO()):
+            pump.switch(True)
+            pump.switch(False)
+        self.bus.request([0x101], timeout=1)  # Frames are handled in order
+        self.assertEqual(
+            self.nodes.received, [(0x101, b"\x12\x01"), (0x101, b"\x12\x00")]
+        )
+
+
+@unittest.skipUnless(os.path.exists("/sys/class/net/vcan0"), "needs vcan0")
+class TestVcan(unittest.TestCase):
+    def test_request(self):
+        # pylint: disable=no-member
+        node = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+        node.bind(("vcan0",))
+        self.addCleanup(node.close)
+        FakeNodes(node, {0x101: 600}).start()
+        bus = can.open_bus("vcan0")
+        self.assertEqual(bus.request([0x101, 0x102], timeout=0.2)[0x101], b"\x58\x02")
@@ -0,0 +1,67 @@
+import unittest
+
+from plants import config
+from plants.clock import VirtualClock
+from plants.commands import AllOff, Cancel, CommandQueue, Poll, Water
+from plants.hw.pumps import MockGPIOPump
+from plants.history import HistoryManager
+
+
+class TestCommandQueue(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.queue = CommandQueue(self.clock)
+        manager = HistoryManager(config.GardenerConfig(1), self.clock)
+        self.pumps = [
+            MockGPIOPump(
+                name,
+                config.PumpConfig.parse(
+                    config.Config({name: {"kind": "mock-gpio", "duration": 10}})
+                ),
+                manager,
+            )
+            for name in "AB"
+        ]
+
+    def drain(self):
+        msgs = []
+        while not self.queue.empty():
+            msgs.append(self.queue.get_nowait())
+        return msgs
+
+    def test_priorities(self):
+        a, b = self.pumps
+        self.queue.put(Water(a))
+        self.queue.put(Poll(0))
+        self.queue.put(Water(b, manual=True))
+        self.assertEqual(self.drain(), [Water(b, manual=True), Poll(0), Water(a)])
+        self.queue.put(Poll(1))
+        self.queue.put(AllOff())
+        self.assertEqual(self.drain(), [AllOff(), Poll(1)])
+
+    def test_coalescing(self):
+        a, b = self.pumps
+        self.queue.put(Water(a))
+        self.queue.put(Water(b))
+        self.clock.advance_to(5)
+        self.queue.put(Water(a, duration=20))
+        self.queue.put(Water(a, duration=5, force=True))
+        self.assertEqual(self.queue.qsize(), 2)
+        self.clock.advance_to(8)
+        stats = self.queue.stats()
+        self.assertEqual((stats["merged"], stats["oldest_seconds"]), (2, 8))
+        # Forced moved up, still waiting since the first one
+        self.assertEqual(self.drain(), [Water(a, 20, True), Water(b)])
+        self.assertEqual(self.queue.stats()["recent_wait_max_seconds"], 8)
+
+    def test_cancel(self):
+        a, b = self.pumps
+        self.queue.put(Water(a))
+        self.queue.put(Water(b))
+        self.queue.put(Cancel(a))
+        self.assertEqual(self.drain(), [Cancel(a), Water(b)])
+        self.queue.put(Water(a))
+        self.queue.put(Water(b))
+        self.queue.put(AllOff())
+        self.assertEqual(self.drain(), [AllOff()])
+        self.assertEqual(self.queue.stats()["dropped"], 3)
@@ -7,3 +7,43 @@ class TestConfigMethods(unittest.TestCase):
     def test_parse(self):
         conf = config.load("plants/plants.yaml")
         print(conf)
+        self.assertEqual(conf.poll_interval, 5)
+        pump = conf.pumps[0]
+        self.assertEqual(pump.duration, 20)
+        self.assertEqual(pump.limits[0], config.Limit(14 * 86400, 35))
+        self.assertEqual(dict(pump.activation_thresholds), {"Pachira aquatica": 0.3})
+        self.assertEqual(pump.options["port"], 9)
+
+    def test_read_only(self):
+        conf = config.Config({"a": {"b_interval": "2m"}, "c": [{"d": "5%"}]})
+        self.assertEqual(conf["a"]["b_interval"], 120)
+        self.assertEqual(conf["c"][0]["d"], 0.05)
+        with self.assertRaises(TypeError):
+            conf["a"] = 1
+
+    def test_errors(self):
+        pump = {"kind": "mock-gpio", "duration": "1s"}
+        for raw in [
+            {},
+            {"poll_interval": "1x"},
+            {"poll_interval": "1s", "unknown": 1},
+            {"poll_interval": "1s", "sensor_groups": [{"sensors": []}]},
+            {"poll_interval": "1s", "pumps": [{"p": {"duration": "1s"}}]},
+            {"poll_interval": "1s", "pumps": [{"p": {"kind": "mock-gpio"}}]},
+            {"poll_interval": "1s", "pumps": [{"p": pump}, {"p": pump}]},
+            {
+                "poll_interval": "1s",
+                "pumps": [{"p": dict(pump, activation_thresholds=[{"s": "150%"}])}],
+            },
+            {"poll_interval": "1s", "can_autoconf": {"first_id": 0x2A, "last_id": 1}},
+            {
+                "poll_interval": "1s",
+                "pumps": [{"p": dict(pump, limits=[{"per_interval": "2w"}])}],
+            },
+            {
+                "poll_interval": "1s",
+                "pumps": [{"p": dict(pump, limits=[{"duration": "35s"}])}],
+            },
+        ]:
+            with self.assertRaises(config.Error, msg=raw):
+                config.GardenerConfig.parse(raw)
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from plants.hw import drivers, pumps
+
+LAZY = """
+import contextlib, io, sys
+from plants import config
+from plants.gardener import Gardener
+from plants.testing import CONF
+
+gardener = Gardener(config.GardenerConfig.parse(CONF))
+with contextlib.redirect_stdout(io.StringIO()):
+    gardener.setup_thread_from_config()
+    gardener.poll()
+gardener.poller.shutdown()
+print(" ".join(m for m in ["asyncio", "gpiozero", "prometheus_client", "smbus"]
+               if m in sys.modules))
+"""
+
+
+class TestRegistry(unittest.TestCase):
+    def test_mock_garden_is_hardware_free(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        out = subprocess.run(
+            [sys.executable, "-c", LAZY],
+            check=True,
+            cwd=root,
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(out.stdout.strip(), "")
+
+    def test_builtin(self):
+        self.assertIs(pumps.registry["mock-gpio"], pumps.MockGPIOPump)
+        self.assertIn("gpio", pumps.registry)
+        with self.assertRaises(KeyError):
+            pumps.registry["nope"]  # pylint: disable=pointless-statement
+
+    def test_entry_point(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "relay_pump.py"), "w", encoding="utf-8") as f:
+                f.write("from plants.hw.pumps import MockGPIOPump as Relay\n")
+            info = os.path.join(tmp, "relay_pump-1.0.dist-info")
+            os.mkdir(info)
+            with open(os.path.join(info, "METADATA"), "w", encoding="utf-8") as f:
+                f.write("Name: relay-pump\nVersion: 1.0\n")
+            with open(
+                os.path.join(info, "entry_points.txt"), "w", encoding="utf-8"
+            ) as f:
+                f.write("[plants.pumps]\nrelay = relay_pump:Relay\n")
+            sys.path.insert(0, tmp)
+            try:
+                registry = drivers.Registry("plants.pumps", {})
+                self.assertIn("relay", registry.kinds())
+                self.assertIs(registry["relay"], pumps.MockGPIOPump)
+            finally:
+                sys.path.remove(tmp)
+                sys.modules.pop("relay_pump", None)
@@ -0,0 +1,74 @@
+import contextlib
+import io
+import time
+import unittest
+
+from plants.hw import ads1115, emulator, i2c
+from plants.hw.sensors import chirp
+
+
+class TestEmulator(unittest.TestCase):
+    def setUp(self):
+        self.bus = emulator.EmulatedBus(seed=1)
+        self.adc = self.bus.attach(72, emulator.ADS1115({0: 1.7, 1: lambda: 2.5}))
+        self.chirp = self.bus.attach(0x20, emulator.Chirp(capacitance=375))
+        i2c.install(90, self.bus)
+
+    def test_single_shot(self):
+        adc = ads1115.ADC(90, 72)
+        self.assertAlmostEqual(adc.single_shot_read_gnd(0), 1.7, places=3)
+        self.assertAlmostEqual(adc.single_shot_read_gnd(1), 2.5, places=3)
+
+    def test_conversion_delay(self):
+        self.adc.write(
+            ads1115.Register.CONFIG, ads1115.Config.single_shot_read_gnd(0).to_bytes()
+        )
+        conf = ads1115.Config.from_bytes(self.adc.read(ads1115.Register.CONFIG, 2))
+        self.assertEqual(conf.value >> conf.OS, 0)  # Still converting
+        time.sleep(2 / 128)
+        conf = ads1115.Config.from_bytes(self.adc.read(ads1115.Register.CONFIG, 2))
+        self.assertEqual(conf.value >> conf.OS, 1)
+
+    def test_burst(self):
+        readings = ads1115.ADC(90, 72).burst_read_gnd(1, 4, 860)
+        self.assertEqual(len(readings), 4)
+        for v in readings:
+            self.assertAlmostEqual(v, 2.5, places=3)
+        self.assertEqual(self.adc.config, ads1115.Config.power_down().value)
+
+    def test_comparator(self):
+        ads1115.ADC(90, 72).watch_gnd(0, 1.0, 1.5, rate=860, queue=1)
+        time.sleep(3 / 860)
+        self.adc.read(ads1115.Register.CONVERSION, 2)
+        self.assertTrue(self.adc.alert)
+        self.adc.inputs[0] = 0.5
+        time.sleep(3 / 860)
+        self.adc.read(ads1115.Register.CONVERSION, 2)
+        self.assertFalse(self.adc.alert)
+
+    def test_chirp(self):
+        group = chirp.SensorGroup({"i2c_bus": 90, "cap_dry": 250, "cap_wet": 500})
+        result = group.poll()
+        self.assertEqual(result["moisture"][group.name], 0.5)
+        self.assertEqual(result["temperature"][f"temp-{group.name}"], 21.5)
+
+        self.chirp.measure_time = 0.01
+        group.bus.write_i2c_block_data(0x20, chirp.Register.MEASURE_LIGHT, [])
+        self.assertEqual(
+            group.bus.read_i2c_block_data(0x20, chirp.Register.GET_BUSY, 1), [1]
+        )
+        time.sleep(0.02)
+        self.assertEqual(
+            group.bus.read_i2c_block_data(0x20, chirp.Register.GET_BUSY, 1), [0]
+        )
+        light = group.bus.read_i2c_block_data(0x20, chirp.Register.GET_LIGHT, 2)
+        self.assertEqual(int.from_bytes(light, byteorder="big"), 1000)
+
+    def test_faults(self):
+        self.bus.fault_rate = 1
+        group = chirp.SensorGroup({"i2c_bus": 90})
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNone(group.poll()["moisture"][group.name])
+        with self.assertRaises(OSError):
+            ads1115.ADC(90, 72).single_shot_read_gnd(0)
+        self.assertEqual(self.bus.faults, 3)
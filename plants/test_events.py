@@ -0,0 +1,55 @@
+import contextlib
+import io
+import json
+import unittest
+
+from plants import api, config, events
+from plants.gardener import Gardener
+from plants.testing import CONF
+
+
+class TestBroker(unittest.TestCase):
+    def test_slow_subscriber(self):
+        broker = events.Broker(buffer=2, max_subscribers=2)
+        fast, slow = broker.subscribe(), broker.subscribe()
+        self.assertIsNone(broker.subscribe())
+        received = iter(fast)
+        self.assertEqual(next(received), ": subscribed\n\n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(3):
+                broker.publish("poll", i)
+                self.assertEqual(
+                    next(received), f"id: {i + 1}\nevent: poll\ndata: {i}\n\n"
+                )
+        self.assertEqual(broker.subscribers, {fast})
+        self.assertEqual(broker.dropped, 1)
+        self.assertEqual(list(slow)[-1], "event: dropped\ndata: {}\n\n")
+        # Room for another one
+        self.assertIsNotNone(broker.subscribe())
+
+
+class TestStream(unittest.TestCase):
+    def test_events(self):
+        gardener = Gardener(config.GardenerConfig.parse(CONF))
+        api.app.gardener = gardener
+        r = api.app.test_client().get("/events", buffered=False)
+        self.assertEqual(r.mimetype, "text/event-stream")
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.setup_thread_from_config()
+            gardener.poll()
+            gardener.pumps[0].switch(True)
+        gardener.poller.shutdown()
+
+        received = iter(r.response)
+        self.assertEqual(next(received), b": subscribed\n\n")
+        poll = next(received).decode().split("\n")
+        self.assertEqual(poll[1], "event: poll")
+        result = json.loads(poll[2][len("data: ") :])["result"]
+        self.assertEqual(result["volts"], {"A": 1.7})
+        pump = next(received).decode().split("\n")
+        self.assertEqual(pump[1], "event: pump")
+        data = json.loads(pump[2][len("data: ") :])
+        self.assertEqual((data["pump"], data["on"]), ("P", True))
+
+        r.close()
+        self.assertEqual(gardener.events.subscribers, set())
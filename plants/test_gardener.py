@@ -0,0 +1,372 @@
+import contextlib
+import copy
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import yaml
+
+from plants import api, config, timings
+from plants.clock import VirtualClock
+from plants.commands import Poll, Wakeup
+from plants.gardener import Gardener
+from plants.hw import emulator, i2c
+from plants.hw.pumps import MockGPIOPump
+from plants.hw.pumps import registry as pumps_registry
+from plants.testing import CONF, ads1115_group, mock_pins, wait_for
+
+
+class TestGardener(unittest.TestCase):
+    def setUp(self):
+        self.gardener = Gardener(config.GardenerConfig.parse(CONF))
+        self.gardener.start_thread()
+        self.assertTrue(wait_for(lambda: self.gardener.last_poll))
+
+    def test_water_wakes_loop(self):
+        pump = self.gardener.pumps[0]
+        self.assertTrue(self.gardener.water(pump))
+        self.assertTrue(wait_for(lambda: pump.is_on, timeout=0.5))
+        self.gardener.exit()
+        self.assertFalse(pump.is_on)
+
+    def test_reload_api(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            api.app.config_path = os.path.join(tmp, "plants.yaml")
+            api.app.gardener = self.gardener
+            client = api.app.test_client()
+            with open(api.app.config_path, "w", encoding="utf-8") as f:
+                yaml.dump(dict(CONF, max_running_pumps=2), f)
+            with contextlib.redirect_stdout(io.StringIO()):
+                r = client.post("/reload")
+            self.assertEqual(
+                json.loads(r.get_data())["changes"]["pumps"]["kept"], ["P"]
+            )
+            self.assertEqual(self.gardener.config.max_running_pumps, 2)
+            with open(api.app.config_path, "w", encoding="utf-8") as f:
+                f.write("pumps: [")
+            self.assertEqual(client.post("/reload").status_code, 400)
+        self.gardener.exit()
+
+    def test_poll_errors(self):
+        def fail():
+            raise OSError("bus error")
+
+        self.gardener.sensor_groups[0].poll = fail
+        errors = timings.recorder.counters["group_poll_errors"]
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.gardener.queue.put(Poll(0))
+            self.assertTrue(
+                wait_for(
+                    lambda: timings.recorder.counters["group_poll_errors"] > errors
+                )
+            )
+        self.assertTrue(self.gardener.thread.is_alive())
+        self.gardener.exit()
+
+    def test_pumps_off_when_loop_dies(self):
+        pump = self.gardener.pumps[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.gardener.water(pump)
+            self.assertTrue(wait_for(lambda: pump.is_on))
+
+            def fail(now=None):
+                raise RuntimeError(f"loop bug at {now}")
+
+            self.gardener.scheduler.due = fail
+            with contextlib.redirect_stderr(io.StringIO()):
+                self.gardener.queue.put(Wakeup())
+                self.gardener.thread.join(5)
+        self.assertFalse(self.gardener.thread.is_alive())
+        self.assertFalse(pump.is_on)
+
+    def test_exit_is_immediate(self):
+        start = time.monotonic()
+        self.gardener.exit()
+        self.assertLess(time.monotonic() - start, 0.5)
+
+
+class TestFailedPoll(unittest.TestCase):
+    def test_clears_readings(self):
+        conf = copy.deepcopy(CONF)
+        conf["pumps"][0]["P"].update(
+            activation_thresholds=[{"A": "90%"}], dry_duration="10m"
+        )
+        clock = VirtualClock()
+        gardener = Gardener(config.GardenerConfig.parse(conf), clock)
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.setup_thread_from_config()
+            self.addCleanup(gardener.poller.shutdown)
+            gardener.poll()
+        # Dry, waiting for dry_duration
+        self.assertIsNotNone(gardener.last_poll["result"]["moisture"]["A"])
+
+        def fail():
+            raise OSError("bus error")
+
+        gardener.sensor_groups[0].poll = fail
+        clock.advance_to(3600)
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.poll()
+        self.assertIsNone(gardener.last_poll["result"]["moisture"]["A"])
+        self.assertIsNone(gardener.last_poll["result"]["volts"]["A"])
+        self.assertEqual(gardener.queue.qsize(), 0)
+
+
+class TestManualWater(unittest.TestCase):
+    """Checked against the published snapshot, from other threads"""
+
+    def test_water(self):
+        conf = copy.deepcopy(CONF)
+        conf["pumps"][0]["P"]["limits"] = [{"per_interval": "1d", "duration": "1h"}]
+        clock = VirtualClock()
+        gardener = Gardener(config.GardenerConfig.parse(conf), clock)
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.setup_thread_from_config()
+            self.addCleanup(gardener.poller.shutdown)
+            pump = gardener.pumps[0]
+            # Nothing published yet, the loop decides
+            self.assertTrue(gardener.water(pump))
+            gardener.handle(gardener.queue.get_nowait())
+            gardener.publish()
+            self.assertFalse(gardener.water(pump), "already watering")
+            clock.advance_to(3600)
+            gardener.actuator.run_due()
+            gardener.publish()
+            self.assertFalse(gardener.water(pump), "at its limit")
+            self.assertEqual(gardener.queue.qsize(), 0)
+            self.assertTrue(gardener.water(pump, force=True))
+        self.assertEqual(gardener.queue.qsize(), 1)
+        self.assertEqual(pump.inhibitions, 0)
+
+
+def with_changes(**changes):
+    conf = copy.deepcopy(CONF)
+    conf.update(changes)
+    return config.GardenerConfig.parse(conf)
+
+
+class TestReload(unittest.TestCase):
+    def setUp(self):
+        self.gardener = Gardener(config.GardenerConfig.parse(CONF), VirtualClock())
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.gardener.setup_thread_from_config()
+            self.gardener.poll()
+
+    def tearDown(self):
+        self.gardener.poller.shutdown()
+
+    def reload(self, conf):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.gardener.reload(conf)
+
+    def test_keeps_unchanged(self):
+        group, pump = self.gardener.sensor_groups[0], self.gardener.pumps[0]
+        next_poll = self.gardener.scheduler.next_poll[0]
+        changes = self.reload(with_changes(port=8000, max_running_pumps=3))
+        self.assertEqual(changes["restart_required"], ["port"])
+        self.assertEqual(changes["pumps"]["kept"], ["P"])
+        self.assertEqual(changes["sensor_groups"], {"kept": 1, "built": 0, "closed": 0})
+        self.assertIs(self.gardener.sensor_groups[0], group)
+        self.assertIs(self.gardener.pumps[0], pump)
+        self.assertEqual(self.gardener.scheduler.next_poll[0], next_poll)
+        self.assertEqual(self.gardener.config.port, 9001)
+        self.assertEqual(self.gardener.actuator.max_running, 3)
+
+    def test_pumps(self):
+        pump = self.gardener.pumps[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            pump.water(duration=5)
+        pumps = copy.deepcopy(CONF["pumps"])
+        pumps[0]["P"]["activation_thresholds"] = [{"A": "20%"}]
+        changes = self.reload(with_changes(pumps=pumps))
+        self.assertEqual(changes["pumps"]["reconfigured"], ["P"])
+        self.assertIs(self.gardener.pumps[0], pump)
+        self.assertEqual(self.gardener.rules.rules[0].thresholds, {"A": 0.2})
+
+        # Another driver: a new pump, stopped first, with the same history
+        self.gardener.clock.sleep(2)
+        pumps_registry["test-gpio"] = MockGPIOPump
+        pumps[0]["P"]["kind"] = "test-gpio"
+        pumps.append({"Q": {"kind": "mock-gpio", "duration": 1}})
+        changes = self.reload(with_changes(pumps=pumps))
+        self.assertEqual(changes["pumps"]["rebuilt"], ["P"])
+        self.assertEqual(changes["pumps"]["added"], ["Q"])
+        self.assertFalse(pump.is_on)
+        # Charged the 2 seconds it ran
+        self.assertEqual(self.gardener.pumps[0].usage, {86400: 2})
+
+        changes = self.reload(with_changes(pumps=pumps[1:]))
+        self.assertEqual(changes["pumps"]["removed"], ["P"])
+
+    def test_groups(self):
+        groups = copy.deepcopy(CONF["sensor_groups"])
+        groups[0]["sensors"][0] = {
+            "B": {"voltage_dry": 2.9, "voltage_wet": 1.5, "port": 1}
+        }
+        groups.insert(0, copy.deepcopy(CONF["sensor_groups"][0]))
+        changes = self.reload(with_changes(sensor_groups=groups))
+        self.assertEqual(changes["sensor_groups"], {"kept": 1, "built": 1, "closed": 0})
+        self.assertEqual(len(self.gardener.scheduler.next_poll), 2)
+        self.assertEqual(self.gardener.scheduler.due(), [1])
+
+        changes = self.reload(with_changes(sensor_groups=groups[1:]))
+        self.assertEqual(changes["sensor_groups"], {"kept": 1, "built": 0, "closed": 1})
+        self.assertEqual(self.gardener.last_poll["result"]["moisture"], {})
+
+    def test_invalid(self):
+        pumps = copy.deepcopy(CONF["pumps"])
+        pumps[0]["P"]["kind"] = "nope"
+        with self.assertRaises(config.Error):
+            self.reload(with_changes(pumps=pumps))
+        self.assertEqual(self.gardener.pumps[0].config.kind, "mock-gpio")
+
+
+class TestReloadRollback(unittest.TestCase):
+    """Reloads failing in drivers, on emulated i2c and mock GPIO pins"""
+
+    def setUp(self):
+        self.pins = mock_pins(self)
+        i2c.install(91, emulator.EmulatedBus()).smbus.attach(
+            72, emulator.ADS1115({0: 1.7})
+        )
+        self.conf = {
+            "poll_interval": "1h",
+            "sensor_groups": [
+                {
+                    "kind": "ads1115",
+                    "smbus": 91,
+                    "enable_port": 17,
+                    "warmup_duration": 0,
+                    "sensors": [
+                        {"A": {"voltage_dry": 2.9, "voltage_wet": 1.5, "port": 0}}
+                    ],
+                }
+            ],
+            "pumps": [{"P": {"kind": "gpio", "port": 18, "duration": 10}}],
+        }
+        self.gardener = Gardener(config.GardenerConfig.parse(self.conf), VirtualClock())
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.gardener.setup_thread_from_config()
+
+    def tearDown(self):
+        self.gardener.poller.shutdown()
+
+    def reload(self, group=None, pump=None):
+        conf = copy.deepcopy(self.conf)
+        conf["sensor_groups"][0].update(group or {})
+        conf["pumps"][0]["P"].update(pump or {})
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.gardener.reload(config.GardenerConfig.parse(conf))
+
+    def assert_hardware_works(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.gardener.poll()
+            pump = self.gardener.pumps[0]
+            pump.switch(True)
+            self.assertEqual(self.pins.pin(18).state, 1)
+            pump.switch(False)
+        self.assertAlmostEqual(
+            self.gardener.last_poll["result"]["volts"]["A"], 1.7, places=3
+        )
+
+    def test_group_fails(self):
+        with self.assertRaises(config.Error):
+            self.reload(group={"data_rate": 7})
+        self.assertEqual(self.gardener.config.sensor_groups[0].get("data_rate"), None)
+        self.assert_hardware_works()
+
+    def test_pump_fails(self):
+        # The group is rebuilt on its pins, then the pump fails: both
+        # are back as they were.
+        with self.assertRaises(config.Error):
+            self.reload(group={"data_rate": 8}, pump={"kind": "can"})
+        self.assertEqual(self.gardener.pumps[0].config.kind, "gpio")
+        self.assertEqual(self.gardener.sensor_groups[0].data_rate, 860)
+        self.assert_hardware_works()
+        # Same pins, valid this time
+        changes = self.reload(group={"data_rate": 8}, pump={"duration": 5})
+        self.assertEqual(changes["sensor_groups"]["built"], 1)
+        self.assertEqual(changes["pumps"]["reconfigured"], ["P"])
+        self.assert_hardware_works()
+
+
+class TestConcurrentPolls(unittest.TestCase):
+    """Groups on emulated i2c buses, warming up on mock GPIO pins"""
+
+    WARMUP = 0.1
+
+    def setUp(self):
+        self.pins = mock_pins(self)
+        self.buses = []
+        for bus_id, addresses in [(92, [72, 73]), (93, [72])]:
+            bus = SerializedBus(latency=0.0005)
+            for address in addresses:
+                bus.attach(address, emulator.ADS1115({0: 1.7}))
+            i2c.install(bus_id, bus)
+            self.buses.append(bus)
+        groups = [
+            ads1115_group(92, 72, 5, self.WARMUP),
+            ads1115_group(92, 73, 6, self.WARMUP),
+            ads1115_group(93, 72, 7, self.WARMUP),
+            # Switched in front of the first one's ADC
+            ads1115_group(92, 72, 8, self.WARMUP),
+        ]
+        self.gardener = Gardener(
+            config.GardenerConfig.parse(
+                {"poll_interval": "1h", "sensor_groups": groups}
+            )
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.gardener.setup_thread_from_config()
+
+    def tearDown(self):
+        self.gardener.poller.shutdown()
+
+    def on_times(self, port):
+        """[(on, off)] times of a pin"""
+        states = self.pins.pin(port).states
+        ons = [s.timestamp for s in states if s.state]
+        offs = [s.timestamp for s in states[1:] if not s.state]
+        return list(zip(ons, offs))
+
+    def test_concurrent(self):
+        start = time.monotonic()
+        self.gardener.poll()
+        elapsed = time.monotonic() - start
+        # The two groups sharing an ADC take turns, others run alongside:
+        # not the 4 warmups one after the other.
+        self.assertGreaterEqual(elapsed, 2 * self.WARMUP)
+        self.assertLess(elapsed, 3 * self.WARMUP)
+        self.assertEqual(len(self.gardener.last_poll["result"]["volts"]), 4)
+
+        (first,), (shared,) = self.on_times(5), self.on_times(8)
+        self.assertTrue(first[1] <= shared[0] or shared[1] <= first[0])
+        (other,) = self.on_times(6)
+        self.assertLess(other[0], min(first[1], shared[1]))
+
+        for bus in self.buses:
+            self.assertGreater(bus.transactions, 0)
+            self.assertEqual(bus.max_concurrent, 1)
+
+
+class SerializedBus(emulator.EmulatedBus):
+    """Counts transactions running at once"""
+
+    def __init__(self, latency):
+        super().__init__(latency)
+        self.lock = threading.Lock()
+        self.concurrent = self.max_concurrent = 0
+
+    def _device(self, address):
+        with self.lock:
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+        try:
+            return super()._device(address)
+        finally:
+            with self.lock:
+                self.concurrent -= 1
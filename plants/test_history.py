@@ -0,0 +1,78 @@
+import os
+import tempfile
+import time
+import unittest
+
+from plants import config
+from plants.history import HistoryManager, InMemoryHistory
+
+
+class TestInMemoryHistory(unittest.TestCase):
+    def test_same_timestamp(self):
+        h = InMemoryHistory()
+        now = time.time()
+        h.record(now, 5)
+        h.record(now, 7)
+        self.assertEqual(h.total_up_to(60), 12)
+
+    def test_windows(self):
+        h = InMemoryHistory()
+        now = time.time()
+        for age, v in [(3600, 1), (600, 2), (60, 4), (1, 8)]:
+            h.record(now - age, v)
+        self.assertEqual(h.total_up_to(30), 8)
+        self.assertEqual(h.total_up_to(120), 12)
+        self.assertEqual(h.total_up_to(86400), 15)
+
+    def test_out_of_order(self):
+        h = InMemoryHistory()
+        now = time.time()
+        h.record(now - 10, 1)
+        h.record(now - 1000, 2)
+        h.record(now - 5, 4)
+        self.assertEqual(h.total_up_to(100), 5)
+        self.assertEqual(h.total_up_to(2000), 7)
+
+    def test_forget(self):
+        h = InMemoryHistory()
+        now = time.time()
+        for age in range(100, 0, -1):
+            h.record(now - age, 1)
+        h.forget_up_to(10.5)
+        self.assertEqual(len(h), 10)
+        self.assertEqual(h.total_up_to(1000), 10)
+        h.add(3)
+        self.assertEqual(h.total_up_to(1000), 13)
+
+
+class TestSqliteHistory(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmp.name, "history.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_grouped_commits(self):
+        conf = config.GardenerConfig(
+            poll_interval=1,
+            pumps_history_db=self.db,
+            pumps_history_commit_interval=60,
+        )
+        manager = HistoryManager(conf)
+        for name in ["a", "b"]:
+            h = manager.history_for(name)
+            h.add(3)
+            h.add(4)
+            h.forget_up_to(3600)
+        self.assertTrue(manager.conn.in_transaction)
+        self.assertEqual(manager.commit_due(), manager.dirty_since + 60)
+        self.assertIsNone(manager.commit_due(now=time.monotonic() + 60))
+        self.assertFalse(manager.conn.in_transaction)
+        manager.close()
+
+        manager = HistoryManager(conf)
+        self.assertEqual(manager.history_for("a").total_up_to(60), 7)
+        self.assertEqual(manager.history_for("b").total_up_to(60), 7)
+        manager.close()
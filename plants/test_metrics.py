@@ -0,0 +1,68 @@
+import contextlib
+import io
+import unittest
+
+import prometheus_client
+
+from plants import config, metrics
+from plants.clock import VirtualClock
+from plants.commands import Wakeup
+from plants.gardener import Gardener
+from plants.testing import CONF
+
+
+class TestCollector(unittest.TestCase):
+    def test_scrape(self):
+        gardener = Gardener(config.GardenerConfig.parse(CONF))
+        registry = prometheus_client.CollectorRegistry()
+        registry.register(metrics.Collector(gardener))
+        self.assertEqual(prometheus_client.generate_latest(registry), b"")
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.setup_thread_from_config()
+            gardener.poll()
+            gardener.pumps[0].water(duration=5)
+        gardener.publish()
+        gardener.poller.shutdown()
+        scrape = prometheus_client.generate_latest(registry).decode()
+        for line in [
+            'plants_moisture_ratio{sensor_id="A"} 0.857',
+            'plants_ads1115_sensor_volts{sensor_id="A"} 1.7',
+            'plants_pump_seconds_total{pump_id="P"} 5.0',
+            'plants_pump_on{pump_id="P"} 1.0',
+            'plants_pump_usage_seconds{per_interval="86400",pump_id="P"} 5.0',
+        ]:
+            self.assertIn(line, scrape)
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_rebuilt_on_change(self):
+        gardener = Gardener(config.GardenerConfig.parse(CONF), VirtualClock())
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.setup_thread_from_config()
+            self.addCleanup(gardener.poller.shutdown)
+            gardener.poll()
+        gardener.publish()
+        snap = gardener.snapshot
+        gardener.publish()
+        self.assertIs(gardener.snapshot, snap)
+
+        # Only the queue changed
+        gardener.queue.put(Wakeup())
+        gardener.publish()
+        self.assertIsNot(gardener.snapshot, snap)
+        self.assertEqual(gardener.snapshot.queued_ops, 1)
+        self.assertIs(gardener.snapshot.pumps[0], snap.pumps[0])
+        self.assertIs(gardener.snapshot.readings, snap.readings)
+
+        snap = gardener.snapshot
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.pumps[0].switch(True)
+        gardener.publish()
+        self.assertTrue(gardener.snapshot.pumps[0].is_on)
+        self.assertIs(gardener.snapshot.readings, snap.readings)
+
+        snap = gardener.snapshot
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.poll()
+        gardener.publish()
+        self.assertIsNot(gardener.snapshot.readings, snap.readings)
@@ -0,0 +1,78 @@
+import unittest
+
+from plants import config
+from plants.history import HistoryManager
+from plants.hw.pumps import Actuator, MockGPIOPump
+
+
+def mock_pump(name, actuator, **conf):
+    conf.setdefault("kind", "mock-gpio")
+    conf.setdefault("duration", "10s")
+    return MockGPIOPump(
+        name,
+        config.PumpConfig.parse(config.Config({name: conf})),
+        HistoryManager(config.GardenerConfig(poll_interval=1)),
+        actuator,
+    )
+
+
+class TestActuator(unittest.TestCase):
+    def test_concurrency(self):
+        actuator = Actuator(max_running=2)
+        pumps = [mock_pump(f"p{i}", actuator) for i in range(3)]
+        for p in pumps:
+            actuator.start(p, 10, now=0)
+        self.assertEqual([p.is_on for p in pumps], [True, True, False])
+        self.assertEqual(actuator.run_due(now=10), 20)
+        self.assertEqual([p.is_on for p in pumps], [False, False, True])
+        self.assertIsNone(actuator.run_due(now=20))
+        self.assertFalse(pumps[2].is_on)
+
+    def test_stop(self):
+        actuator = Actuator(max_running=1)
+        pumps = [mock_pump(f"p{i}", actuator) for i in range(3)]
+        for p in pumps:
+            actuator.start(p, 10, now=0)
+        actuator.stop(pumps[1], now=1)
+        actuator.stop(pumps[0], now=1)
+        self.assertEqual([p.is_on for p in pumps], [False, False, True])
+        self.assertIsNone(actuator.run_due(now=11))
+
+    def test_charged_when_run(self):
+        actuator = Actuator(max_running=1)
+        q, p = [
+            mock_pump(n, actuator, limits=[{"per_interval": "1d", "duration": "40s"}])
+            for n in "qp"
+        ]
+        actuator.start(q, 10, now=0)
+        actuator.start(p, 30, now=0)
+        self.assertEqual((q.usage, p.usage), ({86400: 10}, {86400: 0}))
+        # p never ran, q ran 4 of its 10 seconds
+        actuator.stop(p, now=4)
+        actuator.stop(q, now=4)
+        self.assertEqual((q.usage, p.usage), ({86400: 4}, {86400: 0}))
+        self.assertEqual((q.seconds, p.seconds), (4, 0))
+        actuator.start(p, 30, now=4)
+        actuator.all_off(now=5)
+        self.assertEqual((p.usage, p.seconds), ({86400: 1}, 1))
+
+    def test_power_budget(self):
+        actuator = Actuator(max_running=0, power_budget=10)
+        big = mock_pump("big", actuator, power=12)
+        small = mock_pump("small", actuator, power=4)
+        actuator.start(big, 5, now=0)
+        actuator.start(small, 5, now=0)
+        # Above budget alone still runs, the other one waits.
+        self.assertTrue(big.is_on)
+        self.assertFalse(small.is_on)
+        actuator.run_due(now=5)
+        self.assertTrue(small.is_on)
+
+    def test_water_does_not_block(self):
+        actuator = Actuator()
+        pump = mock_pump("p", actuator)
+        self.assertTrue(pump.water())
+        self.assertTrue(pump.is_on)
+        self.assertFalse(pump.water(), "pump already watering")
+        actuator.all_off()
+        self.assertFalse(pump.is_on)
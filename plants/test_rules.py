@@ -0,0 +1,46 @@
+import types
+import unittest
+
+from plants import config, rules
+
+
+def pump(name, thresholds, **conf):
+    conf = dict(conf, kind="mock-gpio", duration="1s")
+    conf["activation_thresholds"] = [{s: t} for s, t in thresholds.items()]
+    return types.SimpleNamespace(
+        name=name, config=config.PumpConfig.parse(config.Config({name: conf}))
+    )
+
+
+class TestRules(unittest.TestCase):
+    def test_all_any_and_missing(self):
+        p_all = pump("all", {"a": 0.5, "b": 0.5})
+        p_any = pump("any", {"a": 0.5, "b": 0.5}, activation_mode="any")
+        engine = rules.Engine([p_all, p_any])
+        self.assertEqual(engine.evaluate({"a": 0.0}), [p_any])
+        self.assertEqual(engine.evaluate({"a": 0.0, "b": 0.1}), [p_all, p_any])
+        self.assertEqual(engine.evaluate({"a": 0.0, "b": None}), [p_any])
+        self.assertEqual(engine.evaluate({"b": 0.1}), [p_any])
+        self.assertEqual(engine.evaluate({"a": 0.9, "b": 0.9}), [])
+
+    def test_no_thresholds(self):
+        engine = rules.Engine([pump("manual", {})])
+        self.assertEqual(engine.evaluate({"a": 0.0}), [])
+
+    def test_hysteresis(self):
+        p = pump("p", {"a": 0.5}, activation_hysteresis="10%")
+        engine = rules.Engine([p])
+        self.assertEqual(engine.evaluate({"a": 0.4}), [p])
+        self.assertEqual(engine.evaluate({"a": 0.55}), [p])
+        self.assertEqual(engine.evaluate({"a": 0.6}), [])
+        self.assertEqual(engine.evaluate({"a": 0.55}), [])
+
+    def test_dry_duration(self):
+        p = pump("p", {"a": 0.5}, dry_duration="10m")
+        engine = rules.Engine([p])
+        self.assertEqual(engine.evaluate({"a": 0.4}, now=0), [])
+        # Unchanged readings, only time passes.
+        self.assertEqual(engine.evaluate({"a": 0.4}, now=599), [])
+        self.assertEqual(engine.evaluate({"a": 0.4}, now=600), [p])
+        self.assertEqual(engine.evaluate({"a": 0.8}, now=601), [])
+        self.assertFalse(engine.pending)
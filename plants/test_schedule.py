@@ -0,0 +1,67 @@
+import types
+import unittest
+
+from plants import config, schedule
+
+
+def group(*names):
+    return types.SimpleNamespace(
+        sensors=[types.SimpleNamespace(name=n, kind="moisture") for n in names],
+        alert_poll_interval=None,
+    )
+
+
+def pump(name, mode="all", **thresholds):
+    return types.SimpleNamespace(
+        name=name,
+        activation_thresholds=thresholds,
+        config=types.SimpleNamespace(activation_mode=mode),
+    )
+
+
+class TestPollScheduler(unittest.TestCase):
+    def scheduler(self, **adaptive):
+        conf = config.GardenerConfig.parse(
+            {"poll_interval": "1m", "adaptive_polling": adaptive or None}
+        )
+        return schedule.PollScheduler(
+            [group("a"), group("b")], [pump("p", a=0.5)], conf
+        )
+
+    def test_fixed_interval(self):
+        s = schedule.PollScheduler(
+            [group("a")], [], config.GardenerConfig(poll_interval=60)
+        )
+        self.assertEqual(s.due(now=0), [0])
+        s.polled(0, {"a": 0.9}, now=0)
+        self.assertEqual(s.due(now=59), [])
+        self.assertEqual(s.next_deadline(), 60)
+
+    def test_adaptive(self):
+        s = self.scheduler(min_interval="1m", max_interval="6h")
+        # Drying 1% per hour, 40% away from threshold: 40h left.
+        for h in range(4):
+            s.polled(0, {"a": 0.93 - h / 100}, now=h * 3600)
+            s.polled(1, {"b": 0.5}, now=h * 3600)
+        self.assertEqual(s.next_deadline(), 3 * 3600 + 6 * 3600)
+        self.assertAlmostEqual(
+            s.time_to_threshold("a", s.samples["a"]), 40 * 3600, places=3
+        )
+        # Closing in: polls get more frequent.
+        s.polled(0, {"a": 0.52}, now=4 * 3600)
+        self.assertLess(s.next_poll[0], 5 * 3600)
+        # Below threshold, or watered: as often as allowed.
+        s.polled(0, {"a": 0.4}, now=5 * 3600)
+        self.assertEqual(s.next_poll[0], 5 * 3600 + 60)
+        s.watered(pump("p", a=0.5), now=5 * 3600)
+        self.assertEqual(s.next_poll[0], 5 * 3600 + 60)
+        # b has no threshold
+        self.assertEqual(s.next_poll[1], 9 * 3600)
+
+    def test_predictions(self):
+        s = self.scheduler(min_interval="1m", max_interval="1h")
+        for h in range(4):
+            s.polled(0, {"a": 0.6 - h / 100}, now=h * 60)
+        p = s.predictions()
+        self.assertIsNotNone(p["next_watering"]["p"])
+        self.assertAlmostEqual(p["sensors"]["a"]["drying_rate_per_hour"], -0.6)
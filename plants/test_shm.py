@@ -0,0 +1,116 @@
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+
+from plants import config, shm
+from plants.clock import VirtualClock
+from plants.gardener import Gardener
+from plants.testing import CONF
+
+
+def snapshot(value, sensors=("A", "B", "C"), pumps=("P",)):
+    return SimpleNamespace(
+        poll_time=value,
+        readings=tuple(("moisture", s, value) for s in sensors),
+        pumps=tuple(
+            SimpleNamespace(name=p, is_on=True, seconds=value, inhibitions=0)
+            for p in pumps
+        ),
+    )
+
+
+class TestShm(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "plants")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_gardener(self):
+        conf = config.GardenerConfig.parse(dict(CONF, shared_memory=self.path))
+        gardener = Gardener(conf, VirtualClock())
+        with contextlib.redirect_stdout(io.StringIO()):
+            gardener.setup_thread_from_config()
+            self.addCleanup(gardener.poller.shutdown)
+            gardener.pumps[0].switch(True)
+            gardener.poll()
+        gardener.publish()
+        # From another process
+        out = subprocess.run(
+            [sys.executable, "-m", "plants.shm", self.path],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        self.assertIn('"A": 1.7', out)
+        with shm.Reader(self.path) as reader:
+            self.assertEqual(reader.get("volts", "A"), 1.7)
+            self.assertIsNone(reader.get("volts", "Z"))
+            self.assertEqual(reader.pump("P")[0], True)
+            data = reader.read()
+            self.assertEqual(data["poll_time"], gardener.last_poll["time"])
+            self.assertEqual(data["pumps"]["P"]["is_on"], True)
+
+    def test_layout_change(self):
+        writer = shm.Writer(self.path, max_readings=2)
+        self.addCleanup(writer.close)
+        writer.write(snapshot(1.0, sensors=("A", "B")))
+        with shm.Reader(self.path) as reader:
+            self.assertEqual(reader.get("moisture", "B"), 1.0)
+            writer.write(snapshot(2.0, sensors=("B", "A")))
+            self.assertEqual(reader.get("moisture", "B"), 2.0)
+            with contextlib.redirect_stdout(io.StringIO()):
+                writer.write(snapshot(3.0, sensors=("C", "D", "B"), pumps=()))
+            self.assertIsNone(reader.get("moisture", "B"))
+            self.assertIsNone(reader.pump("P"))
+            self.assertEqual(
+                reader.read()["result"], {"moisture": {"C": 3.0, "D": 3.0}}
+            )
+
+    def test_consistent_reads(self):
+        writer = shm.Writer(self.path)
+        self.addCleanup(writer.close)
+        writer.write(snapshot(0.0))
+        done = threading.Event()
+
+        def write():
+            i = 0.0
+            while not done.is_set():
+                i += 1
+                writer.write(snapshot(i))
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        try:
+            with shm.Reader(self.path) as reader:
+                for _ in range(2000):
+                    data = reader.read()
+                    values = set(data["result"]["moisture"].values())
+                    values.add(data["pumps"]["P"]["seconds"])
+                    values.add(data["poll_time"])
+                    self.assertEqual(len(values), 1, data)
+        finally:
+            done.set()
+            thread.join()
+
+    def test_writer_busy(self):
+        writer = shm.Writer(self.path)
+        self.addCleanup(writer.close)
+        shm.SEQ.pack_into(writer.mm, shm.SEQ_OFFSET, 1)
+        with shm.Reader(self.path) as reader:
+            with self.assertRaises(TimeoutError):
+                reader.read()
+
+    def test_not_a_snapshot(self):
+        with open(self.path, "wb") as f:
+            f.write(b"\0" * shm.HEADER.size)
+        with self.assertRaises(ValueError):
+            shm.Reader(self.path)
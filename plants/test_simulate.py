@@ -0,0 +1,59 @@
+import contextlib
+import io
+import queue
+import unittest
+
+from plants import config
+from plants.clock import VirtualClock
+from plants.simulate import Simulation
+
+CONF = {
+    "poll_interval": "10m",
+    "sensor_groups": [
+        {
+            "kind": "ads1115",
+            "sensors": [{"A": {"voltage_dry": 2.9, "voltage_wet": 1.5, "port": 0}}],
+        }
+    ],
+    "pumps": [
+        {
+            "P": {
+                "kind": "mock-gpio",
+                "duration": "10s",
+                "limits": [{"per_interval": "1d", "duration": "20s"}],
+                "activation_thresholds": [{"A": "50%"}],
+            }
+        }
+    ],
+}
+
+
+class TestVirtualClock(unittest.TestCase):
+    def test_waits_advance(self):
+        clock = VirtualClock(100)
+        spans = []
+        clock.listeners.append(lambda start, end: spans.append((start, end)))
+        clock.sleep(5)
+        q = queue.Queue()
+        with self.assertRaises(queue.Empty):
+            clock.get(q, 200)
+        q.put(1)
+        self.assertEqual(clock.get(q, 300), 1)
+        self.assertEqual(clock.time(), 200)
+        self.assertEqual(spans, [(100, 105), (105, 200)])
+
+
+class TestSimulation(unittest.TestCase):
+    def test_days(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            sim = Simulation(
+                config.GardenerConfig.parse(CONF), drying_per_day=0.5, start=0
+            )
+            report = sim.run(10 * 86400)
+        self.assertGreaterEqual(report["seconds"], 10 * 86400)
+        pump = report["pumps"]["P"]
+        # Capped at 20s a day, in 10s waterings
+        self.assertLessEqual(pump["runtime_seconds"], 11 * 20)
+        self.assertGreater(pump["waterings"], 5)
+        self.assertGreater(pump["inhibitions"], 0)
+        self.assertGreater(report["sensors"]["A"]["seconds_below_threshold"], 0)
@@ -0,0 +1,43 @@
+import types
+import unittest
+
+import prometheus_client
+
+from plants import api, config, timings
+
+
+class TestTimings(unittest.TestCase):
+    def test_cycles(self):
+        t = timings.Timings()
+        t.begin_cycle()
+        with t.span("poll"):
+            t.record("sensor_read", 0.002, "A")
+            t.record("sensor_read", 0.003, "B")
+        t.count("retries", 2)
+        t.begin_cycle(lateness=0.3)
+        t.begin_cycle()  # Nothing happened in the previous one
+        report = t.report()
+        self.assertEqual(len(report["cycles"]), 1)
+        cycle = report["cycles"][0]
+        self.assertEqual(
+            set(cycle["spans"]), {"poll", "sensor_read:A", "sensor_read:B"}
+        )
+        self.assertEqual(cycle["counts"], {"retries": 2})
+        self.assertEqual(report["histograms"]["sensor_read"]["counts"][3], 1)
+        self.assertAlmostEqual(report["histograms"]["sensor_read"]["sum"], 0.005)
+        self.assertEqual(sum(report["histograms"]["poll_lateness"]["counts"]), 1)
+
+        registry = prometheus_client.CollectorRegistry()
+        registry.register(timings.Collector(t))
+        scrape = prometheus_client.generate_latest(registry).decode()
+        self.assertIn(
+            'plants_span_seconds_bucket{le="0.005",span="sensor_read"} 2.0', scrape
+        )
+        self.assertIn('plants_span_seconds_count{span="sensor_read"} 2.0', scrape)
+        self.assertIn('plants_events_total{event="retries"} 2.0', scrape)
+
+    def test_endpoint(self):
+        api.app.gardener = types.SimpleNamespace(config=config.GardenerConfig(5))
+        report = api.app.test_client().get("/debug/timings").get_json()
+        self.assertEqual(report["poll_interval"], 5)
+        self.assertIn("cycles", report)
@@ -0,0 +1,56 @@
+"""Fixtures shared by the tests: a small mock garden, and helpers"""
+
+import time
+
+CONF = {
+    "poll_interval": "1h",
+    "sensor_groups": [
+        {
+            "kind": "mock-ads1115",
+            "sensors": [{"A": {"voltage_dry": 2.9, "voltage_wet": 1.5, "port": 0}}],
+        }
+    ],
+    "pumps": [
+        {
+            "P": {
+                "kind": "mock-gpio",
+                "duration": "1h",
+                "activation_thresholds": [{"A": "10%"}],
+            }
+        }
+    ],
+}
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def mock_pins(test):
+    """Has gpiozero use mock pins for a test, returns their factory"""
+    # pylint: disable=import-outside-toplevel
+    from gpiozero import Device
+    from gpiozero.pins.mock import MockFactory
+
+    def restore(factory):
+        Device.pin_factory.close()
+        Device.pin_factory = factory
+
+    test.addCleanup(restore, Device.pin_factory)
+    Device.pin_factory = MockFactory()
+    return Device.pin_factory
+
+
+def ads1115_group(bus, address, enable_port, warmup):
+    name = f"{bus}.{address}.{enable_port}"
+    return {
+        "kind": "ads1115",
+        "smbus": bus,
+        "i2c_address": address,
+        "enable_port": enable_port,
+        "warmup_duration": warmup,
+        "sensors": [{name: {"port": 0, "voltage_dry": 2.9, "voltage_wet": 1.5}}],
+    }
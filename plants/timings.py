@@ -0,0 +1,137 @@
+"""Latency of the hot paths, cheap enough to stay on.
+
+Code wraps what it wants timed in span(name), or counts events with
+count(name). Durations land in fixed bucket histograms, and in the
+current cycle: the gardener starts one per loop step, keeping the last
+CYCLES of them with their per span breakdown, and how late their polls
+were. Both are served by /debug/timings, and histograms are exported to
+Prometheus at scrape time by Collector.
+
+Spans from any thread add up in the current cycle, spans named with a
+detail (e.g. a sensor name) are broken down by it there."""
+
+import bisect
+import collections
+import threading
+import time
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+BUCKETS += (5, 10, float("inf"))
+CYCLES = 50
+
+
+class Span:
+    __slots__ = ("timings", "name", "detail", "start")
+
+    def __init__(self, timings, name, detail):
+        self.timings = timings
+        self.name = name
+        self.detail = detail
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.record(self.name, time.perf_counter() - self.start, self.detail)
+
+
+class Timings:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # name -> [counts per bucket, sum]
+        self.counters = collections.Counter()
+        self.cycles = collections.deque(maxlen=CYCLES)
+        self.cycle = None
+
+    def span(self, name, detail=None):
+        return Span(self, name, detail)
+
+    def _add(self, name, seconds):
+        """Adds to a histogram, under lock"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [[0] * len(BUCKETS), 0.0]
+        histogram[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+        histogram[1] += seconds
+
+    def record(self, name, seconds, detail=None):
+        with self.lock:
+            self._add(name, seconds)
+            if self.cycle is not None:
+                spans = self.cycle["spans"]
+                key = f"{name}:{detail}" if detail is not None else name
+                spans[key] = spans.get(key, 0) + seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+            if self.cycle is not None:
+                counts = self.cycle["counts"]
+                counts[name] = counts.get(name, 0) + n
+
+    def begin_cycle(self, lateness=None):
+        """Starts a new cycle, keeping the previous one if anything
+        happened in it. lateness is how late its polls are, in seconds."""
+        with self.lock:
+            if lateness is not None:
+                self._add("poll_lateness", lateness)
+            if self.cycle and (self.cycle["spans"] or self.cycle["counts"]):
+                self.cycles.append(self.cycle)
+            self.cycle = {
+                "time": time.time(),
+                "poll_lateness": lateness,
+                "spans": {},
+                "counts": {},
+            }
+
+    def report(self):
+        with self.lock:
+            return {
+                "buckets": [str(b) for b in BUCKETS],
+                "histograms": dict(
+                    (name, {"counts": list(counts), "sum": total})
+                    for name, (counts, total) in self.histograms.items()
+                ),
+                "counters": dict(self.counters),
+                "cycles": list(self.cycles),
+            }
+
+
+# Shared by the gardener, drivers and history
+recorder = Timings()
+span = recorder.span
+count = recorder.count
+begin_cycle = recorder.begin_cycle
+report = recorder.report
+
+
+class Collector:
+    """Exports histograms and counters, registered with prometheus_client"""
+
+    # pylint: disable=too-few-public-methods
+    def __init__(self, source=recorder):
+        self.source = source
+
+    def collect(self):
+        # pylint: disable=import-outside-toplevel
+        from prometheus_client.core import CounterMetricFamily, HistogramMetricFamily
+
+        data = self.source.report()
+        spans = HistogramMetricFamily(
+            "plants_span_seconds", "Duration of hot path spans", labels=["span"]
+        )
+        for name, h in data["histograms"].items():
+            cumulative, buckets = 0, []
+            for bound, n in zip(data["buckets"], h["counts"]):
+                cumulative += n
+                buckets.append(("+Inf" if bound == "inf" else bound, cumulative))
+            spans.add_metric([name], buckets, h["sum"])
+        yield spans
+        events = CounterMetricFamily(
+            "plants_events", "Counted hot path events", labels=["event"]
+        )
+        for name, n in data["counters"].items():
+            events.add_metric([name], n)
+        yield events
@@ -10,7 +10,8 @@ setup(
         "prometheus-client",
         "PyYAML",
         "smbus",
+        "waitress",
     ],
     name="plants",
-    packages=["plants"],
+    packages=["plants", "plants.hw", "plants.hw.pumps", "plants.hw.sensors"],
 )